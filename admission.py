@@ -0,0 +1,143 @@
+import math
+import time
+import threading
+from collections import OrderedDict
+
+
+class TokenBucket:
+    """`rate` tokens per second up to `burst`; callers pass in the clock"""
+
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def take(self, cost, now, rate=None):
+        """Spend `cost` tokens; returns 0 if allowed, else seconds until it would be"""
+        rate = self.rate if rate is None else rate
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+        if cost <= self.tokens:
+            self.tokens -= cost
+            return 0
+        # A request larger than the burst can never pass; make that visible
+        if cost > self.burst:
+            return None
+        return (cost - self.tokens) / rate
+
+
+class Rejection:
+    """Why a request was not admitted, with the Retry-After to send back"""
+
+    __slots__ = ('reason', 'retry_after', 'message')
+
+    def __init__(self, reason, retry_after, message):
+        self.reason = reason
+        self.retry_after = retry_after
+        self.message = message
+
+    def to_dict(self):
+        return {'error': self.message, 'reason': self.reason, 'retry_after': self.retry_after}
+
+
+class AdmissionController:
+    """Fast admit/reject in front of the ingest path
+
+    Two checks, both O(1): a global cap on requests in flight, and a
+    token bucket per client (API key or IP) measured in records. Rejected
+    requests get a reason and a Retry-After instead of queueing, so
+    admitted traffic keeps bounded latency under overload.
+
+    Per-client rates are scaled by a shared factor that follows
+    downstream health with AIMD: throttling or slow processing cuts it,
+    healthy intervals raise it back toward 1.
+    """
+
+    def __init__(self, records_per_second=200, burst=None, max_in_flight=32, max_clients=10000,
+                 min_factor=0.1, decrease=0.7, increase=0.05, adjust_interval=1.0,
+                 target_latency=None, clock=time.monotonic):
+        self.rate = records_per_second
+        self.burst = burst or records_per_second * 2
+        self.max_in_flight = max_in_flight
+        self.max_clients = max_clients
+        self.min_factor = min_factor
+        self.decrease = decrease
+        self.increase = increase
+        self.adjust_interval = adjust_interval
+        self.target_latency = target_latency
+        self.clock = clock
+
+        self.factor = 1.0
+        self.in_flight = 0
+        self._buckets = OrderedDict()  # client -> TokenBucket, least recently seen first
+        self._last_adjust = clock()
+        self._congested = False
+        self._lock = threading.Lock()
+        self.stats = {'admitted': 0, 'rejected_concurrency': 0, 'rejected_rate': 0,
+                      'rejected_too_large': 0, 'decreases': 0}
+
+    def enter(self):
+        """Claim an in-flight slot; returns a Rejection when the server is full"""
+        with self._lock:
+            if self.max_in_flight and self.in_flight >= self.max_in_flight:
+                self.stats['rejected_concurrency'] += 1
+                return Rejection('concurrency', 1, 'Server busy, retry later')
+            self.in_flight += 1
+        return None
+
+    def exit(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def check_rate(self, client_id, cost=1):
+        """Charge `cost` records to a client; returns a Rejection when over its limit"""
+        now = self.clock()
+        with self._lock:
+            bucket = self._buckets.get(client_id)
+            if bucket is None:
+                bucket = self._buckets[client_id] = TokenBucket(self.rate, self.burst, now)
+                if len(self._buckets) > self.max_clients:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(client_id)
+
+            wait = bucket.take(cost, now, self.rate * self.factor)
+            if wait is None:
+                self.stats['rejected_too_large'] += 1
+                return Rejection('too_large', None, f'Batch of {cost} records exceeds the limit of {self.burst}')
+            if wait:
+                self.stats['rejected_rate'] += 1
+                return Rejection('rate_limited', max(1, math.ceil(wait)), 'Rate limit exceeded')
+            self.stats['admitted'] += 1
+        return None
+
+    def record_downstream(self, total, throttled=0, latency=None):
+        """Feed back what the downstream did with an admitted request"""
+        congested = throttled > 0 or (
+            self.target_latency is not None and latency is not None and latency > self.target_latency
+        )
+        now = self.clock()
+        with self._lock:
+            self._congested = self._congested or congested
+            if now - self._last_adjust < self.adjust_interval:
+                return
+            if self._congested:
+                self.factor = max(self.min_factor, self.factor * self.decrease)
+                self.stats['decreases'] += 1
+            else:
+                self.factor = min(1.0, self.factor + self.increase)
+            self._congested = False
+            self._last_adjust = now
+
+    def summary(self):
+        summary = dict(self.stats)
+        summary.update({
+            'in_flight': self.in_flight,
+            'clients': len(self._buckets),
+            'rate_factor': round(self.factor, 3),
+            'effective_records_per_second': round(self.rate * self.factor, 1)
+        })
+        return summary
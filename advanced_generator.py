@@ -1,3 +1,4 @@
+import os
 import random
 import json
 import time
@@ -8,6 +9,8 @@ from faker import Faker
 import threading
 import queue
 
+from wire import encode_records, FORMATS
+
 fake = Faker()
 
 class UserSession:
@@ -42,10 +45,12 @@ class UserSession:
         return (datetime.utcnow() - self.start_time).total_seconds()
 
 class RealisticClickstreamGenerator:
-    def __init__(self, endpoint="http://localhost:3000/events"):
+    def __init__(self, endpoint="http://localhost:3000/events", wire_format='json', catalog=None, ids_only=False):
         self.endpoint = endpoint
+        self.content_type = FORMATS[wire_format]
+        self.ids_only = ids_only  # Send product_id only; the API enriches from its reference store
         self.active_sessions = {}
-        self.products = self._load_products()
+        self.products = self._load_products(catalog)
         self.event_queue = queue.Queue()
         self.stats = {
             'total_events': 0,
@@ -54,8 +59,12 @@ class RealisticClickstreamGenerator:
             'events_by_type': {}
         }
         
-    def _load_products(self):
-        """Create realistic product catalog"""
+    def _load_products(self, catalog=None):
+        """Create realistic product catalog (or reuse/save it at `catalog`)"""
+        if catalog and os.path.exists(catalog):
+            with open(catalog) as f:
+                return json.load(f)
+        
         categories = {
             'Electronics': ['Laptop', 'Phone', 'Headphones', 'Tablet', 'Smart Watch'],
             'Clothing': ['T-Shirt', 'Jeans', 'Jacket', 'Shoes', 'Hat'],
@@ -75,6 +84,11 @@ class RealisticClickstreamGenerator:
                     'rating': round(random.uniform(3.0, 5.0), 1),
                     'in_stock': random.choice([True, True, True, False])  # 75% in stock
                 })
+        
+        if catalog:
+            # Load into the API with: python enrichment.py --load-products <catalog>
+            with open(catalog, 'w') as f:
+                json.dump(products, f, indent=2)
         return products
     
     def generate_user_journey(self, session):
@@ -177,6 +191,9 @@ class RealisticClickstreamGenerator:
                 'quantity': quantity,
                 'cart_value': session.total_value + (product['price'] * quantity)
             }
+            if self.ids_only:
+                for field in ('product_name', 'category', 'price'):
+                    del base_event['properties'][field]
             
             session.cart_items.append(product)
             session.total_value += product['price'] * quantity
@@ -189,6 +206,8 @@ class RealisticClickstreamGenerator:
                     'product_name': product['name'],
                     'reason': random.choice(['changed_mind', 'too_expensive', 'found_better'])
                 }
+                if self.ids_only:
+                    del base_event['properties']['product_name']
                 session.cart_items.remove(product)
                 session.total_value -= product['price']
                 
@@ -251,13 +270,20 @@ class RealisticClickstreamGenerator:
             try:
                 response = requests.post(
                     self.endpoint,
-                    json={'records': events},
-                    headers={'Content-Type': 'application/json'},
+                    data=encode_records(events, self.content_type),
+                    headers={'Content-Type': self.content_type},
                     timeout=5
                 )
                 
                 if response.status_code == 202:
                     print(f"✅ Sent {len(events)} events")
+                elif response.status_code == 429:
+                    # Back off as long as the API asks before resending
+                    retry_after = float(response.headers.get('Retry-After', 1))
+                    print(f"⏳ Rate limited, retrying in {retry_after:.0f}s")
+                    for event in events:
+                        self.event_queue.put(event)
+                    time.sleep(retry_after)
                 else:
                     print(f"❌ Error {response.status_code}")
                     # Put events back in queue
@@ -322,8 +348,11 @@ if __name__ == "__main__":
     parser.add_argument('--endpoint', default='http://localhost:3000/events', help='API endpoint')
     parser.add_argument('--duration', type=int, default=60, help='Duration in seconds')
     parser.add_argument('--users', type=int, default=5, help='Max concurrent users')
+    parser.add_argument('--format', choices=sorted(FORMATS), default='json', help='Request body encoding (binary: ~5x smaller, 4-5x slower to decode than json)')
+    parser.add_argument('--catalog', help='Product catalog JSON to reuse, or to write if missing')
+    parser.add_argument('--ids-only', action='store_true', help='Send product_id without name/category/price')
     
     args = parser.parse_args()
     
-    generator = RealisticClickstreamGenerator(args.endpoint)
+    generator = RealisticClickstreamGenerator(args.endpoint, args.format, args.catalog, args.ids_only)
     generator.run_simulation(duration_seconds=args.duration, concurrent_users=args.users)
\ No newline at end of file
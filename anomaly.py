@@ -0,0 +1,279 @@
+import math
+import time
+import threading
+from collections import deque
+
+TOTAL = '__all__'
+MAD_SCALE = 1.4826  # Makes a mean absolute deviation comparable to a standard deviation
+
+
+class SeasonalBaseline:
+    """Expected per-minute count for one series, by season slot
+
+    Each slot (hour-of-week by default) keeps an EWMA of the count and an
+    EWMA of the absolute deviation from it. A global EWMA covers slots that
+    have not been seen often enough yet. Memory is fixed at a few floats
+    per slot.
+    """
+
+    __slots__ = ('slots', 'alpha', 'min_samples', 'mean', 'dev', 'samples', 'level', 'level_dev', 'level_samples')
+
+    def __init__(self, slots, alpha=0.05, min_samples=30):
+        self.slots = slots
+        self.alpha = alpha
+        self.min_samples = min_samples
+        self.mean = [0.0] * slots
+        self.dev = [0.0] * slots
+        self.samples = [0] * slots
+        self.level = 0.0
+        self.level_dev = 0.0
+        self.level_samples = 0
+
+    def expected(self, slot):
+        """(mean, scale, samples) to score against; seasonal once the slot is warm"""
+        if self.samples[slot] >= self.min_samples:
+            return self.mean[slot], self.dev[slot] * MAD_SCALE, self.samples[slot]
+        return self.level, self.level_dev * MAD_SCALE, self.level_samples
+
+    def update(self, slot, value):
+        alpha = self.alpha
+        if self.samples[slot]:
+            self.dev[slot] += alpha * (abs(value - self.mean[slot]) - self.dev[slot])
+            self.mean[slot] += alpha * (value - self.mean[slot])
+        else:
+            self.mean[slot] = value
+        self.samples[slot] += 1
+
+        if self.level_samples:
+            self.level_dev += alpha * (abs(value - self.level) - self.level_dev)
+            self.level += alpha * (value - self.level)
+        else:
+            self.level = value
+        self.level_samples += 1
+
+    def to_dict(self):
+        return {
+            'mean': self.mean, 'dev': self.dev, 'samples': self.samples,
+            'level': self.level, 'level_dev': self.level_dev, 'level_samples': self.level_samples
+        }
+
+    def load(self, data):
+        self.mean = list(data['mean'])
+        self.dev = list(data['dev'])
+        self.samples = list(data['samples'])
+        self.level = data['level']
+        self.level_dev = data['level_dev']
+        self.level_samples = data['level_samples']
+        return self
+
+
+class VolumeAnomalyDetector:
+    """Online drop/spike detection on per-minute event counts
+
+    Counts are kept for the current minute (overall and per event_type).
+    When a minute closes, each series is scored with a robust z-score
+    against its seasonal baseline: (count - mean) / max(scale, sqrt(mean)),
+    where the sqrt term is the Poisson noise floor for quiet series. Scores
+    past `threshold` raise an alert right away, so detection lags by at most
+    one minute plus the time until the next event or tick(). Anomalous
+    minutes are not learned, so an outage or burst does not become the new
+    normal, unless it lasts `adapt_after` minutes (a real level shift).
+    """
+
+    def __init__(self, season_minutes=7 * 24 * 60, slot_minutes=60, alpha=0.05, threshold=4.0,
+                 min_samples=30, min_expected=5, adapt_after=60, max_series=50, on_alert=None,
+                 max_alerts=100, clock=time.time):
+        self.season_minutes = season_minutes
+        self.slot_minutes = slot_minutes
+        self.slots = max(1, season_minutes // slot_minutes)
+        self.alpha = alpha
+        self.threshold = threshold
+        self.min_samples = min_samples
+        self.min_expected = min_expected
+        self.adapt_after = adapt_after
+        self.max_series = max_series
+        self.on_alert = on_alert
+        self.clock = clock
+
+        self.baselines = {}   # series -> SeasonalBaseline
+        self.current = {}     # series -> count in the open minute
+        self.minute = None    # Open minute, as epoch minutes
+        self.alerts = deque(maxlen=max_alerts)
+        self.active = {}      # series -> ongoing alert kind
+        self._anomalous_minutes = {}
+        self._lock = threading.Lock()
+        self._timer = None
+        self._stop = threading.Event()
+        self.stats = {'minutes_closed': 0, 'alerts': 0, 'series_dropped': 0}
+
+    def observe(self, event_type=None, count=1, now=None):
+        """Count `count` events arriving now"""
+        minute = int((self.clock() if now is None else now) // 60)
+        with self._lock:
+            self._advance(minute)
+            current = self.current
+            current[TOTAL] = current.get(TOTAL, 0) + count
+            if event_type:
+                if event_type in current or event_type in self.baselines or len(self.baselines) < self.max_series:
+                    current[event_type] = current.get(event_type, 0) + count
+                else:
+                    self.stats['series_dropped'] += count
+
+    def record_minute(self, minute_start, counts):
+        """Feed an already-aggregated minute (epoch seconds, {series: count})"""
+        minute = int(minute_start // 60)
+        with self._lock:
+            if self.minute is not None and minute < self.minute:
+                return False  # Already closed
+            self._advance(minute)
+            for series, count in counts.items():
+                self.current[series] = self.current.get(series, 0) + count
+            self._advance(minute + 1)
+        return True
+
+    def tick(self, now=None):
+        """Close minutes that passed without events, so silence is detected too"""
+        minute = int((self.clock() if now is None else now) // 60)
+        with self._lock:
+            self._advance(minute)
+
+    def _advance(self, minute):
+        if self.minute is None:
+            self.minute = minute
+            return
+        if minute <= self.minute:
+            return
+        # Close the open minute, then any silent minutes up to a full season
+        self._close(self.minute, self.current)
+        self.current = {}
+        for silent in range(max(self.minute + 1, minute - self.season_minutes), minute):
+            self._close(silent, {})
+        self.minute = minute
+
+    def _close(self, minute, counts):
+        slot = (minute // self.slot_minutes) % self.slots
+        for series in set(self.baselines) | set(counts):
+            baseline = self.baselines.get(series)
+            if baseline is None:
+                baseline = self.baselines[series] = SeasonalBaseline(self.slots, self.alpha, self.min_samples)
+            value = counts.get(series, 0)
+            value = self._score(series, minute, slot, baseline, value)
+            if value is not None:
+                baseline.update(slot, value)
+        self.stats['minutes_closed'] += 1
+
+    def _score(self, series, minute, slot, baseline, value):
+        """Alert if needed; returns the value to learn from, or None to learn nothing"""
+        mean, scale, samples = baseline.expected(slot)
+        if samples < self.min_samples:
+            return value
+        scale = max(scale, math.sqrt(max(mean, 1.0)))
+        z = (value - mean) / scale
+        active = self.active.get(series)
+
+        kind = None
+        if z <= -self.threshold and mean >= self.min_expected:
+            kind = 'no_data' if value == 0 else 'drop'
+        elif z >= self.threshold:
+            kind = 'spike'
+        elif active and abs(z) > self.threshold / 2:
+            kind = active  # Hysteresis: stay in alert until clearly back to normal
+
+        if kind is None:
+            if active:
+                self._alert(series, minute, 'recovered', value, mean, z)
+                del self.active[series]
+                del self._anomalous_minutes[series]
+            return value
+
+        if active != kind:
+            if not active:
+                self._anomalous_minutes[series] = 0
+            self.active[series] = kind
+            self._alert(series, minute, kind, value, mean, z)
+        self._anomalous_minutes[series] += 1
+        if self._anomalous_minutes[series] < self.adapt_after:
+            return None
+        # A shift that lasts this long is a new normal: learn it, clipped
+        limit = self.threshold * scale
+        return min(max(value, mean - limit), mean + limit)
+
+    def _alert(self, series, minute, kind, value, mean, z):
+        alert = {
+            'series': 'total' if series == TOTAL else series,
+            'kind': kind,
+            'minute': minute * 60,
+            'count': value,
+            'expected': round(mean, 2),
+            'z_score': round(z, 2)
+        }
+        self.alerts.append(alert)
+        if kind != 'recovered':
+            self.stats['alerts'] += 1
+        if self.on_alert:
+            self.on_alert(alert)
+
+    def start(self, interval=5.0):
+        """Background thread calling tick(), for ingest paths that can go silent"""
+        if self._timer is not None:
+            return
+        self._stop.clear()
+
+        def run():
+            while not self._stop.wait(interval):
+                self.tick()
+
+        self._timer = threading.Thread(target=run, name='volume-anomaly-tick', daemon=True)
+        self._timer.start()
+
+    def stop(self):
+        if self._timer is not None:
+            self._stop.set()
+            self._timer.join()
+            self._timer = None
+
+    def summary(self):
+        with self._lock:
+            baselines = {}
+            for series, baseline in self.baselines.items():
+                slot = ((self.minute or 0) // self.slot_minutes) % self.slots
+                mean, scale, samples = baseline.expected(slot)
+                baselines['total' if series == TOTAL else series] = {
+                    'expected_per_minute': round(mean, 2),
+                    'scale': round(scale, 2),
+                    'warm': samples >= self.min_samples
+                }
+            return {
+                'current_minute': self.minute * 60 if self.minute is not None else None,
+                'active_alerts': {('total' if s == TOTAL else s): k for s, k in self.active.items()},
+                'recent_alerts': list(self.alerts)[-10:],
+                'baselines': baselines,
+                'stats': dict(self.stats)
+            }
+
+    def to_dict(self):
+        """State for detectors that do not live between runs (e.g. a scheduled Lambda)"""
+        with self._lock:
+            return {
+                'season_minutes': self.season_minutes,
+                'slot_minutes': self.slot_minutes,
+                'minute': self.minute,
+                'current': dict(self.current),
+                'active': dict(self.active),
+                'anomalous_minutes': dict(self._anomalous_minutes),
+                'baselines': {series: b.to_dict() for series, b in self.baselines.items()}
+            }
+
+    def load(self, data):
+        if (data['season_minutes'], data['slot_minutes']) != (self.season_minutes, self.slot_minutes):
+            raise ValueError('Saved detector state uses a different season layout')
+        with self._lock:
+            self.minute = data['minute']
+            self.current = dict(data['current'])
+            self.active = dict(data['active'])
+            self._anomalous_minutes = dict(data.get('anomalous_minutes', {}))
+            self.baselines = {
+                series: SeasonalBaseline(self.slots, self.alpha, self.min_samples).load(b)
+                for series, b in data['baselines'].items()
+            }
+        return self
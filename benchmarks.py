@@ -0,0 +1,390 @@
+import os
+import sys
+import gc
+import json
+import time
+import types
+import shutil
+import argparse
+import platform
+import importlib
+import tempfile
+import contextlib
+from datetime import datetime, timezone
+
+from wire import sample_events
+from local_kinesis import LocalKinesisStream
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+INFRASTRUCTURE = os.path.join(ROOT, 'infrastructure')
+
+DEFAULT_SIZES = (1000, 10000, 100000)
+BATCH_SIZE = 500          # Records per ingest request, as the generators send them
+ATHENA_PAGE_ROWS = 1000   # GetQueryResults returns at most this many rows per page
+BASELINE_FILE = 'benchmarks_baseline.json'
+TOLERANCE = 0.2
+
+# Ingest admission would throttle a benchmark long before the code under test does
+BENCHMARK_ENV = {
+    'ADMISSION_RECORDS_PER_SECOND': '1e12',
+    'AWS_DEFAULT_REGION': os.environ.get('AWS_DEFAULT_REGION', 'us-east-1')
+}
+
+# name -> (function(size) returning timed seconds, unit, default max size)
+BENCHMARKS = {}
+
+
+class Skip(Exception):
+    """A benchmark that cannot run here (missing dependency, size over its limit)"""
+
+
+def benchmark(name, unit='events', max_size=None):
+    def register(func):
+        BENCHMARKS[name] = (func, unit, max_size)
+        return func
+    return register
+
+
+def fresh_import(name):
+    """Import (or re-import) a module so its module-level state starts empty"""
+    try:
+        if name in sys.modules:
+            return importlib.reload(sys.modules[name])
+        return importlib.import_module(name)
+    except ImportError as e:
+        raise Skip(f'needs {e.name}')
+
+
+class _UnusedClient:
+    def __getattr__(self, name):
+        raise RuntimeError(f'AWS call {name} during a benchmark')
+
+
+@contextlib.contextmanager
+def stub_aws(clients):
+    """boto3.client(service) returns clients[service] while importing code under test
+
+    Works with or without boto3 installed; services not in `clients` get a
+    client that fails on first use, so nothing reaches AWS.
+    """
+    def client(service, *args, **kw):
+        return clients.get(service) or _UnusedClient()
+
+    original = sys.modules.get('boto3')
+    if original is None:
+        sys.modules['boto3'] = types.SimpleNamespace(client=client)
+    else:
+        real_client = original.client
+        original.client = client
+    try:
+        yield
+    finally:
+        if original is None:
+            del sys.modules['boto3']
+        else:
+            original.client = real_client
+
+
+def event_batches(count, batch_size=BATCH_SIZE):
+    """Fresh generator-shaped events (unique event_ids), one batch at a time"""
+    for start in range(0, count, batch_size):
+        yield sample_events(min(batch_size, count - start))
+
+
+def timed(func, *args, **kw):
+    started = time.perf_counter()
+    result = func(*args, **kw)
+    return result, time.perf_counter() - started
+
+
+def check(ok, detail):
+    if not ok:
+        raise RuntimeError(f'Unexpected result: {detail}')
+
+
+@benchmark('generate.data_generator')
+def bench_data_generator(size):
+    generator = fresh_import('data_generator').ClickstreamGenerator()
+    generate = generator.generate_event
+    started = time.perf_counter()
+    for _ in range(size):
+        generate()
+    return time.perf_counter() - started
+
+
+@benchmark('generate.advanced_generator')
+def bench_advanced_generator(size):
+    module = fresh_import('advanced_generator')
+    generator = module.RealisticClickstreamGenerator()
+    generated = 0
+    started = time.perf_counter()
+    while generated < size:
+        session = module.UserSession()
+        for event_type in generator.generate_user_journey(session)[:size - generated]:
+            generator.generate_event(session, event_type)
+            generated += 1
+    return time.perf_counter() - started
+
+
+@benchmark('ingest.lambda_handler')
+def bench_lambda_handler(size):
+    stream = LocalKinesisStream(max_records_per_shard=BATCH_SIZE)
+    with stub_aws({'kinesis': stream}):
+        index = fresh_import('index')
+    context = types.SimpleNamespace(aws_request_id='benchmark', function_name='benchmark')
+    elapsed = 0.0
+    for batch in event_batches(size):
+        request = {
+            'headers': {'Content-Type': 'application/json'},
+            'body': json.dumps({'records': batch})
+        }
+        response, seconds = timed(index.lambda_handler, request, context)
+        check(response['statusCode'] == 202, response)
+        elapsed += seconds
+    return elapsed
+
+
+def local_api():
+    api = fresh_import('local_api')
+    api.load_events()  # Empty sandbox: opens the event log, as a fresh start would
+    return api, api.app.test_client()
+
+
+def fill(api, size):
+    """Put `size` events through the local API's processing path, untimed"""
+    for batch in event_batches(size):
+        api.process_events(batch)
+
+
+def repeat_call(size, call):
+    """Time `call` enough times to be measurable; events per second over the buffer"""
+    calls = max(1, min(100, 100000 // size))
+    elapsed = 0.0
+    for _ in range(calls):
+        _, seconds = timed(call)
+        elapsed += seconds
+    return elapsed / calls
+
+
+@benchmark('ingest.local_api', max_size=100000)
+def bench_local_api(size):
+    api, client = local_api()
+    elapsed = 0.0
+    for batch in event_batches(size):
+        body = json.dumps({'records': batch})
+        response, seconds = timed(client.post, '/events', data=body, content_type='application/json')
+        check(response.status_code == 202, response.get_json())
+        elapsed += seconds
+    return elapsed
+
+
+@benchmark('api.stats', max_size=1000000)
+def bench_stats(size):
+    api, client = local_api()
+    fill(api, size)
+
+    def call():
+        response = client.get('/stats')
+        check(response.status_code == 200, response.status_code)
+
+    return repeat_call(size, call)
+
+
+def bench_export(size, format_type):
+    api, client = local_api()
+    fill(api, size)
+
+    def call():
+        response = client.get(f'/export?format={format_type}')
+        check(response.status_code == 200, response.status_code)
+        os.remove(response.get_json()['filename'])
+
+    return repeat_call(size, call)
+
+
+@benchmark('api.export.json', max_size=1000000)
+def bench_export_json(size):
+    return bench_export(size, 'json')
+
+
+@benchmark('api.export.ndjson', max_size=1000000)
+def bench_export_ndjson(size):
+    return bench_export(size, 'ndjson')
+
+
+class AthenaResults:
+    """Athena client whose queries succeed at once and return one prebuilt page"""
+
+    columns = ('event_type', 'event_hour', 'events', 'unique_users', 'null_user_ids', 'duplicate_events')
+
+    def __init__(self, rows):
+        def cell(value):
+            return {'VarCharValue': str(value)}
+
+        header = {'Data': [cell(column) for column in self.columns]}
+        data = [{'Data': [
+            cell(['page_view', 'click', 'search', 'purchase'][i % 4]), cell(f'2024-01-01 {i % 24:02d}:00'),
+            cell(1000 + i), cell(100 + i % 97), cell(i % 5), {}  # NULL cells have no VarCharValue
+        ]} for i in range(rows)]
+        self.page = {'ResultSet': {'Rows': [header] + data}}
+
+    def start_query_execution(self, **kw):
+        return {'QueryExecutionId': 'benchmark'}
+
+    def get_query_execution(self, **kw):
+        return {'QueryExecution': {'Status': {'State': 'SUCCEEDED'}}}
+
+    def get_query_results(self, **kw):
+        return self.page
+
+
+@benchmark('athena.execute_athena_query', unit='rows')
+def bench_athena_results(size):
+    athena = AthenaResults(min(size, ATHENA_PAGE_ROWS))
+    if INFRASTRUCTURE not in sys.path:
+        sys.path.append(INFRASTRUCTURE)
+    with stub_aws({'athena': athena}):
+        module = fresh_import('lambda_data_quality')
+    page_rows = len(athena.page['ResultSet']['Rows']) - 1
+    elapsed = 0.0
+    parsed = 0
+    while parsed < size:
+        rows, seconds = timed(module.execute_athena_query, 'SELECT 1', 'benchmark')
+        check(rows and len(rows) == page_rows, rows)
+        elapsed += seconds
+        parsed += page_rows
+    # Sizes that are not a whole number of pages parse a few extra rows
+    return elapsed * size / parsed
+
+
+@contextlib.contextmanager
+def sandbox():
+    """Temporary working directory and environment, stdout silenced
+
+    Code under test writes backups, exports, quarantine segments and a
+    reference database relative to the working directory.
+    """
+    workdir = tempfile.mkdtemp(prefix='clickstream-bench-')
+    cwd = os.getcwd()
+    saved = {key: os.environ.get(key) for key in BENCHMARK_ENV}
+    os.environ.update(BENCHMARK_ENV)
+    os.chdir(workdir)
+    try:
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            yield workdir
+    finally:
+        os.chdir(cwd)
+        for key, value in saved.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def run(names, sizes, repeat=3, limits=True, report=print):
+    """{'name@size': result}; each result keeps the fastest of `repeat` runs"""
+    results = {}
+    for name in names:
+        func, unit, max_size = BENCHMARKS[name]
+        for size in sizes:
+            key = f'{name}@{size}'
+            if limits and max_size and size > max_size:
+                results[key] = {'skipped': f'above default limit of {max_size} (use --no-limits)'}
+                report(f"⏭️  {key}: {results[key]['skipped']}")
+                continue
+            try:
+                best = None
+                for _ in range(repeat):
+                    gc.collect()
+                    with sandbox():
+                        seconds = func(size)
+                    best = seconds if best is None else min(best, seconds)
+            except Skip as e:
+                results[key] = {'skipped': str(e)}
+                report(f"⏭️  {key}: {e}")
+                break
+            results[key] = {
+                'unit': unit,
+                'size': size,
+                'seconds': round(best, 6),
+                'throughput': round(size / best, 1) if best else None
+            }
+            report(f"⏱️  {key}: {results[key]['throughput']:,.0f} {unit}/s")
+    return results
+
+
+def compare(results, baseline, tolerance=TOLERANCE):
+    """Rows of (key, throughput, baseline throughput, change, regressed) for measured results"""
+    rows = []
+    for key, result in results.items():
+        recorded = baseline.get(key) or {}
+        if 'throughput' not in result or not recorded.get('throughput'):
+            continue
+        change = result['throughput'] / recorded['throughput'] - 1
+        rows.append((key, result['throughput'], recorded['throughput'], change, change < -tolerance))
+    return rows
+
+
+def load_baseline(path):
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_baseline(path, results, previous=None):
+    """Merge measured results into the baseline file; skipped ones keep their old entry"""
+    recorded = dict((previous or {}).get('results', {}))
+    recorded.update({key: result for key, result in results.items() if 'throughput' in result})
+    with open(path, 'w') as f:
+        json.dump({
+            'updated': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'machine': f'{platform.system()} {platform.machine()}',
+            'results': recorded
+        }, f, indent=2, sort_keys=True)
+
+
+def parse_sizes(value):
+    return [int(float(size)) for size in value.split(',') if size.strip()]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Throughput benchmarks with regression baselines')
+    parser.add_argument('--sizes', type=parse_sizes, default=list(DEFAULT_SIZES),
+                        help='Comma separated dataset sizes, e.g. 1e3,1e4,1e5,1e6,1e7')
+    parser.add_argument('--only', help='Comma separated benchmark name prefixes')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per size; the fastest counts')
+    parser.add_argument('--no-limits', action='store_true', help='Run sizes above a benchmark\'s default limit')
+    parser.add_argument('--baseline', default=BASELINE_FILE, help='Baseline JSON file')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE,
+                        help='Allowed throughput drop before failing (0.2 = 20%%)')
+    parser.add_argument('--update', action='store_true', help='Record these results as the new baseline')
+    parser.add_argument('--list', action='store_true', help='List benchmarks and exit')
+    args = parser.parse_args()
+
+    if args.list:
+        for name, (_, unit, max_size) in BENCHMARKS.items():
+            print(f"{name:32} {unit:7} {f'max {max_size:,}' if max_size else ''}")
+        sys.exit(0)
+
+    prefixes = args.only.split(',') if args.only else ['']
+    names = [name for name in BENCHMARKS if any(name.startswith(prefix) for prefix in prefixes)]
+    print(f"🏁 {len(names)} benchmarks at sizes {', '.join(f'{size:g}' for size in args.sizes)}")
+    results = run(names, args.sizes, repeat=args.repeat, limits=not args.no_limits)
+
+    previous = load_baseline(args.baseline)
+    if args.update or previous is None:
+        save_baseline(args.baseline, results, previous)
+        print(f"📝 Baseline {'updated' if previous else 'recorded'}: {args.baseline}")
+        sys.exit(0)
+
+    rows = compare(results, previous['results'], args.tolerance)
+    regressions = [row for row in rows if row[4]]
+    for key, throughput, recorded, change, regressed in rows:
+        print(f"{'❌' if regressed else '✅'} {key}: {throughput:,.0f} vs {recorded:,.0f} ({change:+.1%})")
+    if regressions:
+        print(f"🚨 {len(regressions)} regression(s) beyond {args.tolerance:.0%} of {args.baseline}")
+        sys.exit(1)
+    print(f"🎉 No regressions beyond {args.tolerance:.0%} ({len(rows)} compared)")
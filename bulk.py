@@ -0,0 +1,169 @@
+import json
+import zlib
+
+from quarantine import validate_record, INVALID_JSON
+
+NDJSON_CONTENT_TYPES = ('application/x-ndjson', 'application/ndjson', 'application/jsonl')
+CHUNK_SIZE = 64 * 1024
+MAX_LINE_BYTES = 1024 * 1024
+MAX_ERRORS = 100
+
+# Reported per line but not passed to on_invalid: the line itself is not kept
+LINE_TOO_LONG = 'LINE_TOO_LONG'
+INVALID_ENCODING = 'INVALID_ENCODING'
+
+
+def is_ndjson(content_type):
+    return (content_type or '').split(';')[0].strip().lower() in NDJSON_CONTENT_TYPES
+
+
+def iter_chunks(source, chunk_size=CHUNK_SIZE):
+    """Chunks from a file-like object (anything with read) or a bytes body"""
+    if isinstance(source, (bytes, bytearray)):
+        for start in range(0, len(source), chunk_size):
+            yield bytes(source[start:start + chunk_size])
+        return
+    while True:
+        chunk = source.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+
+def decompress_chunks(chunks, content_encoding=None, chunk_size=CHUNK_SIZE):
+    """Undo Content-Encoding gzip/deflate chunk by chunk, never more than chunk_size at a time"""
+    encoding = (content_encoding or '').strip().lower()
+    if encoding in ('', 'identity'):
+        yield from chunks
+        return
+    if encoding not in ('gzip', 'x-gzip', 'deflate'):
+        raise ValueError(f'Unsupported Content-Encoding: {content_encoding}')
+
+    # 32 + MAX_WBITS auto-detects zlib or gzip headers
+    decompressor = zlib.decompressobj(32 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = decompressor.decompress(chunk, chunk_size)
+        while data:
+            yield data
+            data = decompressor.decompress(decompressor.unconsumed_tail, chunk_size)
+    tail = decompressor.flush()
+    if tail:
+        yield tail
+
+
+class BulkReader:
+    """Incremental NDJSON parse + validate for bulk ingest
+
+    The body is read in chunks, split on newlines and parsed one line at a
+    time; valid records come out in batches of `batch_size`, so a request
+    never holds more than one batch of parsed records plus one chunk of
+    raw bytes. Bad lines are reported by line number and byte offset (in
+    the decompressed body) and handed to `on_invalid` for quarantine.
+    """
+
+    def __init__(self, source, content_encoding=None, batch_size=500, chunk_size=CHUNK_SIZE,
+                 max_line_bytes=MAX_LINE_BYTES, max_errors=MAX_ERRORS, on_invalid=None):
+        self.source = source
+        self.content_encoding = content_encoding
+        self.batch_size = batch_size
+        self.chunk_size = chunk_size
+        self.max_line_bytes = max_line_bytes
+        self.max_errors = max_errors
+        self.on_invalid = on_invalid
+
+        self.lines = 0        # Non-blank lines seen
+        self.valid = 0
+        self.invalid = 0
+        self.set_aside = 0    # Invalid lines handed to on_invalid
+        self.bytes_read = 0   # Decompressed
+        self.last_line = 0    # Last line number handed out (or rejected)
+        self.errors = []
+
+    def batches(self):
+        """Yield lists of (line number, record); stop iterating to stop reading"""
+        batch = []
+        for line_no, offset, line in self._lines():
+            self.last_line = line_no
+            record = self._parse(line_no, offset, line)
+            if record is None:
+                continue
+            self.valid += 1
+            batch.append((line_no, record))
+            if len(batch) >= self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def _lines(self):
+        pending = bytearray()
+        pending_offset = 0
+        line_no = 0
+        skipping = False   # Inside a line already reported as too long
+        offset = 0
+        chunks = decompress_chunks(iter_chunks(self.source, self.chunk_size), self.content_encoding, self.chunk_size)
+        for chunk in chunks:
+            self.bytes_read += len(chunk)
+            start = 0
+            while True:
+                end = chunk.find(b'\n', start)
+                if end < 0:
+                    break
+                line_no += 1
+                if skipping:
+                    skipping = False
+                else:
+                    pending += chunk[start:end]
+                    if pending.strip():
+                        yield line_no, pending_offset, bytes(pending)
+                pending.clear()
+                start = end + 1
+                pending_offset = offset + start
+            if not skipping:
+                pending += chunk[start:]
+                if len(pending) > self.max_line_bytes:
+                    self.lines += 1
+                    self._error(line_no + 1, pending_offset, LINE_TOO_LONG,
+                                f'Line exceeds {self.max_line_bytes} bytes', None)
+                    pending.clear()
+                    skipping = True
+            offset += len(chunk)
+        if pending.strip() and not skipping:
+            yield line_no + 1, pending_offset, bytes(pending)
+
+    def _parse(self, line_no, offset, line):
+        self.lines += 1
+        try:
+            record = json.loads(line)
+        except UnicodeDecodeError as e:
+            self._error(line_no, offset, INVALID_ENCODING, str(e), None)
+            return None
+        except ValueError as e:
+            self._error(line_no, offset, INVALID_JSON, str(e), line.decode('utf-8', 'replace'))
+            return None
+        reason = validate_record(record)
+        if reason:
+            self._error(line_no, offset, reason, None, record)
+            return None
+        return record
+
+    def _error(self, line_no, offset, reason, message, record):
+        self.invalid += 1
+        if len(self.errors) < self.max_errors:
+            error = {'line': line_no, 'offset': offset, 'reason': reason}
+            if message:
+                error['error'] = message
+            self.errors.append(error)
+        if self.on_invalid and record is not None:
+            self.on_invalid(record, reason, message)
+            self.set_aside += 1
+
+    def summary(self):
+        return {
+            'lines': self.lines,
+            'valid': self.valid,
+            'invalid': self.invalid,
+            'bytes': self.bytes_read,
+            'errors': self.errors,
+            'errors_truncated': self.invalid > len(self.errors)
+        }
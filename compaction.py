@@ -0,0 +1,335 @@
+import os
+import gzip
+import json
+import uuid
+import argparse
+from datetime import datetime
+
+from watermarks import LocalManifestStore, WatermarkManifest
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet support is optional for local runs
+    pa = None
+    pq = None
+
+try:
+    import zstandard
+except ImportError:  # Only needed for zstd-compressed local Firehose output
+    zstandard = None
+
+MANIFEST_NAME = '_manifest.json'
+STAGING_DIR = '_staging'
+MB = 1024 * 1024
+
+
+def is_data_file(name):
+    """Athena/Hive ignore files starting with _ or ."""
+    return not name.startswith(('_', '.'))
+
+
+def read_records(path):
+    """Read all records from a gzip/zstd/ndjson/json/parquet file"""
+    if path.endswith('.parquet'):
+        if pq is None:
+            raise RuntimeError('pyarrow is required to read Parquet files')
+        return pq.read_table(path).to_pylist()
+
+    if path.endswith('.zst'):
+        if zstandard is None:
+            raise RuntimeError('zstandard is required to read .zst files')
+        with open(path, 'rb') as f:
+            data = zstandard.ZstdDecompressor().decompressobj().decompress(f.read())
+        return parse_concatenated_json(data.decode('utf-8'))
+
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt') as f:
+        return parse_concatenated_json(f.read())
+
+
+def parse_concatenated_json(text):
+    """Parse NDJSON as well as Firehose's back-to-back {..}{..} records"""
+    decoder = json.JSONDecoder()
+    records = []
+    pos = 0
+    end = len(text)
+    while pos < end:
+        while pos < end and text[pos].isspace():
+            pos += 1
+        if pos >= end:
+            break
+        obj, pos = decoder.raw_decode(text, pos)
+        if isinstance(obj, list):
+            records.extend(obj)
+        else:
+            records.append(obj)
+    return records
+
+
+def sort_key(record):
+    """Sort on user_id then timestamp so Parquet min/max stats prune well"""
+    return (str(record.get('user_id') or ''), str(record.get('timestamp') or ''))
+
+
+class PartitionFileWriter:
+    """Writes records into rolling output files of roughly target_bytes each
+
+    Parquet files use `schema` when given (e.g. the Glue table's columns);
+    otherwise one is inferred over every buffered row and widened across
+    files, so a column missing or null in the first rows is still kept.
+    """
+
+    def __init__(self, directory, compaction_id, target_bytes, file_format='json.gz', schema=None):
+        self.directory = directory
+        self.compaction_id = compaction_id
+        self.target_bytes = target_bytes
+        self.file_format = file_format
+        self.schema = schema
+        self._fixed_schema = schema is not None
+        self.files = []
+        self._raw = None
+        self._out = None
+        self._rows = []
+        self._row_bytes = 0
+
+    def _next_path(self):
+        name = f'part-{self.compaction_id}-{len(self.files):05d}.{self.file_format}'
+        path = os.path.join(self.directory, name)
+        self.files.append(name)
+        return path
+
+    def write(self, record):
+        if self.file_format == 'parquet':
+            self._rows.append(record)
+            self._row_bytes += len(json.dumps(record))
+            if self._row_bytes >= self.target_bytes:
+                self._flush_parquet()
+            return
+
+        if self._out is None:
+            self._raw = open(self._next_path(), 'wb')
+            self._out = gzip.GzipFile(fileobj=self._raw, mode='wb')
+        self._out.write((json.dumps(record) + '\n').encode('utf-8'))
+        # Compressed size is only approximate until the gzip buffer is flushed
+        if self._raw.tell() >= self.target_bytes:
+            self._close_current()
+
+    def _flush_parquet(self):
+        if not self._rows:
+            return
+        if pa is None:
+            raise RuntimeError('pyarrow is required to write Parquet files')
+        pq.write_table(self._table(), self._next_path(), compression='snappy')
+        self._rows = []
+        self._row_bytes = 0
+
+    def _table(self):
+        if not self._fixed_schema:
+            # from_pylist alone takes its columns from the first row only
+            columns = {}
+            for row in self._rows:
+                columns.update(dict.fromkeys(row))
+            inferred = pa.Table.from_pydict({c: [row.get(c) for row in self._rows] for c in columns}).schema
+            self.schema = inferred if self.schema is None else pa.unify_schemas([self.schema, inferred])
+        return pa.Table.from_pylist(self._rows, schema=self.schema)
+
+    def _close_current(self):
+        if self._out is not None:
+            self._out.close()
+            self._raw.close()
+            self._out = None
+            self._raw = None
+
+    def close(self):
+        if self.file_format == 'parquet':
+            self._flush_parquet()
+        else:
+            self._close_current()
+        return self.files
+
+
+class PartitionCompactor:
+    """Merges small files inside year/month/day/hour partitions of a local S3 stand-in"""
+
+    def __init__(self, root, prefix='events/', target_mb=256, small_file_mb=64, min_files=2, manifest=None):
+        self.root = root
+        self.manifest = manifest  # Optional watermarks.WatermarkManifest to keep current
+        self.prefix = prefix
+        self.target_bytes = int(target_mb * MB)
+        self.small_file_bytes = int(small_file_mb * MB)
+        self.min_files = min_files
+
+    def list_partitions(self):
+        """Find every hour partition directory below the prefix"""
+        base = os.path.join(self.root, self.prefix)
+        partitions = []
+        for dirpath, dirnames, filenames in os.walk(base):
+            dirnames[:] = sorted(d for d in dirnames if d != STAGING_DIR)
+            if os.path.basename(dirpath).startswith('hour='):
+                partitions.append(dirpath)
+        return partitions
+
+    def _data_files(self, partition):
+        return sorted(
+            name for name in os.listdir(partition)
+            if is_data_file(name) and os.path.isfile(os.path.join(partition, name))
+        )
+
+    def compact_partition(self, partition, file_format='json.gz', dry_run=False):
+        """Compact one partition and return a before/after report"""
+        self.recover(partition)
+
+        files = self._data_files(partition)
+        sizes = {name: os.path.getsize(os.path.join(partition, name)) for name in files}
+        small = [name for name in files if sizes[name] < self.small_file_bytes]
+
+        report = {
+            'partition': os.path.relpath(partition, self.root),
+            'files_before': len(files),
+            'bytes_before': sum(sizes.values()),
+            'files_after': len(files),
+            'bytes_after': sum(sizes.values()),
+            'records': None,
+            'compacted': False
+        }
+
+        if len(small) < self.min_files or dry_run:
+            return report
+
+        records = []
+        for name in small:
+            records.extend(read_records(os.path.join(partition, name)))
+        records.sort(key=sort_key)
+
+        compaction_id = uuid.uuid4().hex[:12]
+        staging = os.path.join(partition, STAGING_DIR)
+        os.makedirs(staging, exist_ok=True)
+
+        writer = PartitionFileWriter(staging, compaction_id, self.target_bytes, file_format)
+        for record in records:
+            writer.write(record)
+        new_files = writer.close()
+
+        kept = [name for name in files if name not in small]
+        manifest = {
+            'compaction_id': compaction_id,
+            'state': 'committing',
+            'created_at': datetime.utcnow().isoformat(),
+            'files': sorted(kept + new_files),
+            'staged': new_files,
+            'replaced': small,
+            'record_count': len(records),
+            'sort_keys': ['user_id', 'timestamp']
+        }
+        write_manifest(partition, manifest)
+        self._apply(partition, manifest)
+
+        after = manifest['files']
+        report.update({
+            'files_after': len(after),
+            'bytes_after': sum(os.path.getsize(os.path.join(partition, name)) for name in after),
+            'records': len(records),
+            'compacted': True
+        })
+
+        if self.manifest is not None:
+            timestamps = [str(r['timestamp']) for r in records if r.get('timestamp')]
+            # Row counts are only authoritative when every file was rewritten
+            self.manifest.record_partition(
+                os.path.relpath(partition, os.path.join(self.root, self.prefix)),
+                len(records) if not kept else 0,
+                max_event_time=max(timestamps) if timestamps else None,
+                bytes_written=report['bytes_after'] if not kept else None,
+                replace=not kept,
+                maintenance=True
+            )
+        return report
+
+    def _apply(self, partition, manifest):
+        """Roll a committing manifest forward: publish staged files, drop replaced ones"""
+        staging = os.path.join(partition, STAGING_DIR)
+        for name in manifest['staged']:
+            staged_path = os.path.join(staging, name)
+            if os.path.exists(staged_path):
+                os.replace(staged_path, os.path.join(partition, name))
+        for name in manifest['replaced']:
+            path = os.path.join(partition, name)
+            if os.path.exists(path):
+                os.remove(path)
+        if os.path.isdir(staging) and not os.listdir(staging):
+            os.rmdir(staging)
+
+        manifest['state'] = 'committed'
+        manifest['committed_at'] = datetime.utcnow().isoformat()
+        write_manifest(partition, manifest)
+
+    def recover(self, partition):
+        """Finish a compaction that crashed after its manifest was written"""
+        manifest = load_manifest(partition)
+        if manifest and manifest.get('state') == 'committing':
+            self._apply(partition, manifest)
+            return True
+        return False
+
+    def run(self, file_format='json.gz', dry_run=False):
+        """Compact every partition and return per-partition reports plus totals"""
+        reports = [self.compact_partition(p, file_format, dry_run) for p in self.list_partitions()]
+        totals = {
+            'partitions': len(reports),
+            'partitions_compacted': sum(1 for r in reports if r['compacted']),
+            'files_before': sum(r['files_before'] for r in reports),
+            'files_after': sum(r['files_after'] for r in reports),
+            'bytes_before': sum(r['bytes_before'] for r in reports),
+            'bytes_after': sum(r['bytes_after'] for r in reports)
+        }
+        return {'partitions': reports, 'totals': totals}
+
+
+def load_manifest(partition):
+    """Load a partition manifest, or None if the partition was never compacted"""
+    path = os.path.join(partition, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def write_manifest(partition, manifest):
+    """Atomically replace the partition manifest"""
+    path = os.path.join(partition, MANIFEST_NAME)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compact small files in partitioned clickstream data')
+    parser.add_argument('--root', default='./data/processed', help='Local directory standing in for the S3 bucket')
+    parser.add_argument('--prefix', default='events/', help='Table prefix inside the bucket')
+    parser.add_argument('--target-mb', type=float, default=256, help='Target output file size in MB')
+    parser.add_argument('--small-file-mb', type=float, default=64, help='Files below this size are compacted')
+    parser.add_argument('--format', default='json.gz', choices=['json.gz', 'parquet'], help='Output file format')
+    parser.add_argument('--dry-run', action='store_true', help='Only report current file counts')
+
+    args = parser.parse_args()
+
+    manifest = WatermarkManifest(LocalManifestStore(args.root), args.prefix)
+    compactor = PartitionCompactor(args.root, args.prefix, args.target_mb, args.small_file_mb, manifest=manifest)
+    result = compactor.run(file_format=args.format, dry_run=args.dry_run)
+
+    print("🗜️  Compaction Report")
+    print("=" * 50)
+    for report in result['partitions']:
+        status = '✅' if report['compacted'] else '⏭️ '
+        print(f"{status} {report['partition']}: {report['files_before']} → {report['files_after']} files, "
+              f"{report['bytes_before'] / MB:.1f} MB → {report['bytes_after'] / MB:.1f} MB")
+
+    totals = result['totals']
+    print("=" * 50)
+    print(f"Partitions compacted: {totals['partitions_compacted']}/{totals['partitions']}")
+    print(f"Files: {totals['files_before']} → {totals['files_after']}")
+    print(f"Bytes: {totals['bytes_before']:,} → {totals['bytes_after']:,}")
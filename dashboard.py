@@ -1,4 +1,4 @@
-from flask import Flask, render_template, jsonify
+from flask import Flask, render_template, jsonify, request
 import requests
 import json
 from datetime import datetime, timedelta
@@ -6,6 +6,7 @@ from datetime import datetime, timedelta
 app = Flask(__name__)
 
 API_URL = "http://localhost:3000/stats"
+SERIES_URL = "http://localhost:3000/series"
 
 @app.route('/')
 def dashboard():
@@ -19,8 +20,16 @@ def get_stats():
         data = response.json()
         
         # Add calculated metrics
-        if data['total_events'] > 0:
-            # Calculate conversion funnel
+        if data.get('funnel'):
+            # Per-session funnel tracked by the API at ingest time
+            counts = data['funnel']['counts']
+            rates = data['funnel']['conversion_rates']
+            data['conversion_metrics'] = {
+                'view_to_cart': rates.get('page_view_to_add_to_cart', 0),
+                'cart_to_purchase': (counts.get('purchase', 0) / counts['add_to_cart']) * 100 if counts.get('add_to_cart', 0) > 0 else 0
+            }
+        elif data['total_events'] > 0:
+            # Older APIs only report global event counts
             events = data.get('events_by_type', {})
             data['conversion_metrics'] = {
                 'view_to_cart': (events.get('add_to_cart', 0) / events.get('page_view', 1)) * 100,
@@ -31,5 +40,14 @@ def get_stats():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/series')
+def get_series():
+    """Proxy pre-aggregated series (metric, from, to, step) from main API"""
+    try:
+        response = requests.get(SERIES_URL, params=request.args)
+        return jsonify(response.json()), response.status_code
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 if __name__ == '__main__':
     app.run(debug=True, port=5000)
\ No newline at end of file
@@ -1,15 +1,19 @@
 import random
 import json
 import time
+import os
 import requests
 from datetime import datetime
 from faker import Faker
 
+from wire import encode_records, FORMATS
+
 fake = Faker()
 
 class ClickstreamGenerator:
-    def __init__(self, endpoint="http://localhost:3000/events"):
+    def __init__(self, endpoint="http://localhost:3000/events", wire_format='json'):
         self.endpoint = endpoint
+        self.content_type = FORMATS[wire_format]
         self.user_sessions = {}
         print(f"🎯 Generator initialized. Sending to: {endpoint}")
         
@@ -77,8 +81,8 @@ class ClickstreamGenerator:
         try:
             response = requests.post(
                 self.endpoint,
-                json={'records': events},
-                headers={'Content-Type': 'application/json'},
+                data=encode_records(events, self.content_type),
+                headers={'Content-Type': self.content_type},
                 timeout=5
             )
             
@@ -122,8 +126,8 @@ if __name__ == "__main__":
     print("🔧 Clickstream Data Generator")
     print("=" * 50)
     
-    # Create generator
-    generator = ClickstreamGenerator()
+    # Create generator (WIRE_FORMAT=binary shrinks request bodies at the cost of server-side decode time)
+    generator = ClickstreamGenerator(wire_format=os.environ.get('WIRE_FORMAT', 'json'))
     
     # Test with a small batch first
     print("\n📋 Sending test batch...")
@@ -0,0 +1,190 @@
+import math
+import time
+import hashlib
+from collections import deque
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter sized for `capacity` items at `fp_rate`"""
+
+    def __init__(self, capacity, fp_rate=1e-4):
+        self.capacity = capacity
+        self.fp_rate = fp_rate
+        self.size = self.optimal_bits(capacity, fp_rate)
+        self.hash_count = max(1, int(round(self.size / capacity * math.log(2))))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    @staticmethod
+    def optimal_bits(capacity, fp_rate):
+        return max(8, int(math.ceil(-capacity * math.log(fp_rate) / (math.log(2) ** 2))))
+
+    def _positions(self, item):
+        digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        size = self.size
+        return [(h1 + i * h2) % size for i in range(self.hash_count)]
+
+    def contains_positions(self, positions):
+        bits = self.bits
+        for p in positions:
+            if not bits[p >> 3] & (1 << (p & 7)):
+                return False
+        return True
+
+    def add_positions(self, positions):
+        bits = self.bits
+        for p in positions:
+            bits[p >> 3] |= 1 << (p & 7)
+        self.count += 1
+
+    def __contains__(self, item):
+        return self.contains_positions(self._positions(item))
+
+    def add(self, item):
+        self.add_positions(self._positions(item))
+
+    @property
+    def full(self):
+        return self.count >= self.capacity
+
+
+class EventDeduplicator:
+    """Drops repeated event_ids seen within a sliding horizon, in bounded memory
+
+    The horizon is covered by a ring of `partitions` Bloom filters, each
+    owning horizon / partitions seconds of arrivals. Lookups check every
+    live filter, inserts go to the newest, and the oldest filter is dropped
+    as time moves on. A filter that reaches capacity early is rotated out
+    early too, so memory and the false-positive rate stay fixed under any
+    traffic; the effective horizon shrinks instead (`early_rotations`).
+    """
+
+    def __init__(self, horizon_seconds=3600, partitions=6, capacity_per_partition=200000,
+                 fp_rate=1e-5, clock=time.time):
+        self.horizon = horizon_seconds
+        self.partitions = partitions
+        self.slot_seconds = horizon_seconds / partitions
+        self.capacity = capacity_per_partition
+        # Each lookup may hit any live filter, so split the budget between them
+        self.filter_fp_rate = fp_rate / partitions
+        self.clock = clock
+        self.filters = deque()  # (slot start, BloomFilter), oldest first
+        self.stats = {'checked': 0, 'duplicates': 0, 'missing_ids': 0, 'early_rotations': 0}
+
+    def _current(self, now):
+        if self.filters:
+            start, bloom = self.filters[-1]
+            if now - start < self.slot_seconds and not bloom.full:
+                return bloom
+            if bloom.full and now - start < self.slot_seconds:
+                self.stats['early_rotations'] += 1
+
+        bloom = BloomFilter(self.capacity, self.filter_fp_rate)
+        self.filters.append((now, bloom))
+        while len(self.filters) > self.partitions or (self.filters and now - self.filters[0][0] >= self.horizon):
+            self.filters.popleft()
+        return bloom
+
+    def _seen(self, positions):
+        for _, bloom in self.filters:
+            if bloom.contains_positions(positions):
+                return True
+        return False
+
+    def is_duplicate(self, event_id, now=None):
+        """Check-and-insert: True if event_id was already seen inside the horizon"""
+        if not event_id:
+            self.stats['missing_ids'] += 1
+            return False
+        self.stats['checked'] += 1
+
+        current = self._current(self.clock() if now is None else now)
+        positions = current._positions(str(event_id))
+        if self._seen(positions):
+            self.stats['duplicates'] += 1
+            return True
+        current.add_positions(positions)
+        return False
+
+    def filter_events(self, events, commit=True):
+        """Split a batch into (unique, duplicates); also catches repeats inside the batch
+
+        With commit=False the unique ids are only checked, not remembered:
+        call commit(unique) once the batch is stored, so a client retrying a
+        batch that failed half way is not dropped as a duplicate.
+        """
+        if commit:
+            now = self.clock()
+            unique = []
+            duplicates = []
+            for event in events:
+                if self.is_duplicate(event.get('event_id'), now):
+                    duplicates.append(event)
+                else:
+                    unique.append(event)
+            return unique, duplicates
+
+        # Bloom filters cannot forget, so nothing is added until commit()
+        positions = self._current(self.clock())._positions  # Every filter hashes alike
+        batch = set()
+        unique = []
+        duplicates = []
+        for event in events:
+            event_id = event.get('event_id')
+            if not event_id:
+                self.stats['missing_ids'] += 1
+                unique.append(event)
+                continue
+            self.stats['checked'] += 1
+            event_id = str(event_id)
+            if event_id in batch or self._seen(positions(event_id)):
+                self.stats['duplicates'] += 1
+                duplicates.append(event)
+            else:
+                batch.add(event_id)
+                unique.append(event)
+        return unique, duplicates
+
+    def commit(self, events):
+        """Remember the event_ids of a batch checked with filter_events(commit=False)"""
+        current = self._current(self.clock())
+        for event in events:
+            event_id = event.get('event_id')
+            if event_id:
+                if current.full:
+                    current = self._current(self.clock())
+                current.add_positions(current._positions(str(event_id)))
+
+    def memory_bytes(self):
+        return sum(len(bloom.bits) for _, bloom in self.filters)
+
+    def summary(self):
+        summary = dict(self.stats)
+        summary.update({
+            'horizon_seconds': self.horizon,
+            'live_filters': len(self.filters),
+            'memory_bytes': self.memory_bytes(),
+            'max_memory_bytes': self.partitions * ((BloomFilter.optimal_bits(self.capacity, self.filter_fp_rate) + 7) // 8)
+        })
+        return summary
+
+
+def dedupe_batch(events, seen=None):
+    """Exact, stateless dedup within one request: (unique, duplicates)
+
+    Pass the same `seen` set for each chunk of a request that arrives in pieces.
+    """
+    seen = set() if seen is None else seen
+    unique = []
+    duplicates = []
+    for event in events:
+        event_id = event.get('event_id')
+        if event_id and event_id in seen:
+            duplicates.append(event)
+        else:
+            if event_id:
+                seen.add(event_id)
+            unique.append(event)
+    return unique, duplicates
@@ -13,7 +13,26 @@ cd infrastructure
 
 echo "📦 Creating Lambda deployment package..."
 # Create the Lambda zip file that Terraform expects
-zip -j lambda.zip lambda_function.py
+zip -j lambda.zip lambda_function.py ../metrics.py ../dedup.py ../quarantine.py ../partitioning.py ../sketches.py ../event_sources.py ../local_kinesis.py ../admission.py ../bulk.py ../wire.py
+
+echo "🧪 Checking the package imports on its own..."
+# Import lambda_function from the unzipped package only, so a module missing from the
+# file list above fails here instead of on every request
+PACKAGE_DIR=$(mktemp -d)
+unzip -q lambda.zip -d "$PACKAGE_DIR"
+if ! (cd "$PACKAGE_DIR" && python3 -c "
+import sys, types
+try:
+    import boto3
+except ImportError:  # Only the package's own modules are under test
+    sys.modules['boto3'] = types.SimpleNamespace(client=lambda *args, **kwargs: None)
+import lambda_function
+"); then
+    rm -rf "$PACKAGE_DIR"
+    echo "❌ lambda.zip is missing a module lambda_function imports"
+    exit 1
+fi
+rm -rf "$PACKAGE_DIR"
 
 echo "🔧 Initializing Terraform..."
 terraform init
@@ -70,6 +89,9 @@ from awsglue.context import GlueContext
 from awsglue.job import Job
 from pyspark.sql.functions import *
 from pyspark.sql.types import *
+import boto3
+from datetime import datetime
+from watermarks import PARTITION_PATTERN, S3ManifestStore, WatermarkManifest, partition_path
 
 # Get job parameters
 args = getResolvedOptions(sys.argv, ['JOB_NAME', 'SOURCE_BUCKET', 'TARGET_BUCKET', 'DATABASE_NAME'])
@@ -83,6 +105,8 @@ job.init(args['JOB_NAME'], args)
 # Set up paths
 source_path = f"s3://{args['SOURCE_BUCKET']}/clickstream-data/year=*/month=*/day=*/hour=*/*.gz"
 target_path = f"s3://{args['TARGET_BUCKET']}/events/"
+# Matches the events_processed partition keys; hourly partitions are what the rollup job builds from
+PARTITION_COLUMNS = ["year", "month", "day", "hour"]
 
 print(f"Reading from: {source_path}")
 print(f"Writing to: {target_path}")
@@ -123,15 +147,19 @@ try:
     df_with_partitions = df_with_partitions \
         .withColumn("year", year("timestamp_parsed")) \
         .withColumn("month", month("timestamp_parsed")) \
-        .withColumn("day", dayofmonth("timestamp_parsed"))
+        .withColumn("day", dayofmonth("timestamp_parsed")) \
+        .withColumn("hour", hour("timestamp_parsed"))
     
     # Filter out any remaining null partitions
     df_final = df_with_partitions.filter(
         col("year").isNotNull() & 
         col("month").isNotNull() & 
-        col("day").isNotNull()
+        col("day").isNotNull() &
+        col("hour").isNotNull()
     )
     
+    # Keep the parsed time for the watermark manifest; the table itself doesn't carry it
+    df_timed = df_final
     df_final = df_final.drop("timestamp_parsed", "processed_at_clean")
     
     final_count = df_final.count()
@@ -142,15 +170,38 @@ try:
         df_final.printSchema()
         
         print("Partition distribution:")
-        df_final.groupBy("year", "month", "day").count().show()
+        df_final.groupBy(*PARTITION_COLUMNS).count().show()
         
         # Write as Parquet with partitioning
         df_final.write \
             .mode("overwrite") \
-            .partitionBy("year", "month", "day") \
+            .partitionBy(*PARTITION_COLUMNS) \
             .option("compression", "snappy") \
             .parquet(target_path)
         
+        # Watermark manifest for the data quality Lambda and the Athena scan guard:
+        # rows and newest event per partition from Spark, bytes from listing the output
+        stats = df_timed.groupBy(*PARTITION_COLUMNS).agg(
+            count(lit(1)).alias("rows"),
+            max(date_format(col("timestamp_parsed"), "yyyy-MM-dd'T'HH:mm:ss")).alias("max_event_time")
+        ).collect()
+        s3 = boto3.client("s3")
+        sizes = {}
+        for page in s3.get_paginator("list_objects_v2").paginate(Bucket=args['TARGET_BUCKET'], Prefix="events/"):
+            for obj in page.get("Contents", []):
+                match = PARTITION_PATTERN.search(obj["Key"])
+                if match and not obj["Key"].rsplit("/", 1)[-1].startswith(("_", ".")):
+                    year_, month_, day_, hour_ = (int(v or 0) for v in match.groups())
+                    partition = partition_path(datetime(year_, month_, day_, hour_))
+                    sizes[partition] = sizes.get(partition, 0) + obj["Size"]
+        entries = []
+        for row in stats:
+            partition = partition_path(datetime(row["year"], row["month"], row["day"], row["hour"]))
+            entries.append((partition, row["rows"], row["max_event_time"], sizes.get(partition)))
+        # The write above replaced the whole table, so the manifest is rebuilt rather than added to
+        WatermarkManifest(S3ManifestStore(s3, args['TARGET_BUCKET']), "events").record_partitions(entries, rebuild=True)
+        print(f"Recorded {len(entries)} partitions in the watermark manifest")
+        
         print("ETL job completed successfully")
     else:
         print("No data to write after filtering")
@@ -167,6 +218,11 @@ EOF
 echo "📤 Uploading Glue script to S3..."
 aws s3 cp glue_scripts/json_to_parquet.py s3://$PROCESSED_BUCKET/scripts/json_to_parquet.py --region eu-west-2
 
+echo "📤 Uploading rollup job scripts to S3..."
+for script in infrastructure/rollup_job.py rollup_tables.py compaction.py watermarks.py sketches.py event_sources.py; do
+    aws s3 cp $script s3://$PROCESSED_BUCKET/scripts/$(basename $script) --region eu-west-2
+done
+
 echo ""
 echo "🎉 Deployment complete!"
 echo ""
@@ -55,6 +55,7 @@ echo "   (Use the code from the artifact above)"
 if [ -f "lambda_functions/lambda_data_quality.py" ]; then
     cd lambda_functions
     zip -r data_quality_lambda.zip lambda_data_quality.py
+    zip -j data_quality_lambda.zip ../metrics.py ../watermarks.py ../anomaly.py ../query_guard.py
     mv data_quality_lambda.zip ../infrastructure/
     cd ..
     echo "✅ Data quality Lambda package created"
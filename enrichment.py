@@ -0,0 +1,332 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import argparse
+import threading
+from collections import OrderedDict
+
+# Kept under data/ with the other local state so importing local_api doesn't litter the cwd
+DEFAULT_REFERENCE_DB = os.path.join('data', 'reference.db')
+
+# table -> (key column, value columns)
+TABLES = {
+    'products': ('product_id', ('product_name', 'category', 'price')),
+    'countries': ('code', ('country_name', 'region'))
+}
+
+DEFAULT_COUNTRIES = [
+    ('US', 'United States', 'North America'), ('CA', 'Canada', 'North America'),
+    ('MX', 'Mexico', 'North America'), ('BR', 'Brazil', 'South America'),
+    ('AR', 'Argentina', 'South America'), ('GB', 'United Kingdom', 'Europe'),
+    ('DE', 'Germany', 'Europe'), ('FR', 'France', 'Europe'), ('ES', 'Spain', 'Europe'),
+    ('IT', 'Italy', 'Europe'), ('NL', 'Netherlands', 'Europe'), ('SE', 'Sweden', 'Europe'),
+    ('PL', 'Poland', 'Europe'), ('IN', 'India', 'Asia'), ('CN', 'China', 'Asia'),
+    ('JP', 'Japan', 'Asia'), ('KR', 'South Korea', 'Asia'), ('SG', 'Singapore', 'Asia'),
+    ('AU', 'Australia', 'Oceania'), ('NZ', 'New Zealand', 'Oceania'),
+    ('ZA', 'South Africa', 'Africa'), ('NG', 'Nigeria', 'Africa'), ('EG', 'Egypt', 'Africa')
+]
+
+MISSING = object()
+
+_BROWSERS = [
+    (re.compile(r'Edg(e|A|iOS)?/'), 'Edge'), (re.compile(r'OPR/|Opera'), 'Opera'),
+    (re.compile(r'Firefox/|FxiOS/'), 'Firefox'), (re.compile(r'Chrome/|CriOS/'), 'Chrome'),
+    (re.compile(r'Safari/'), 'Safari')
+]
+_OPERATING_SYSTEMS = [
+    (re.compile(r'iPhone|iPad|iPod'), 'iOS'), (re.compile(r'Android'), 'Android'),
+    (re.compile(r'Windows'), 'Windows'), (re.compile(r'Mac OS X|Macintosh'), 'macOS'),
+    (re.compile(r'Linux'), 'Linux')
+]
+_BOT = re.compile(r'bot|crawl|spider|slurp', re.IGNORECASE)
+_TABLET = re.compile(r'iPad|Tablet')
+_MOBILE = re.compile(r'Mobi|iPhone|Android')
+
+
+def parse_user_agent(user_agent):
+    """device_type / browser / os from a User-Agent string (rule based, no dependency)"""
+    if _BOT.search(user_agent):
+        device_type = 'bot'
+    elif _TABLET.search(user_agent):
+        device_type = 'tablet'
+    elif _MOBILE.search(user_agent):
+        device_type = 'mobile'
+    else:
+        device_type = 'desktop'
+    browser = next((name for pattern, name in _BROWSERS if pattern.search(user_agent)), 'Other')
+    os_name = next((name for pattern, name in _OPERATING_SYSTEMS if pattern.search(user_agent)), 'Other')
+    return {'device_type': device_type, 'browser': browser, 'os': os_name}
+
+
+class ReferenceStore:
+    """Dimension tables in a local SQLite file, loaded and read in bulk"""
+
+    def __init__(self, path=DEFAULT_REFERENCE_DB):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self.db:
+            for table, (key, columns) in TABLES.items():
+                self.db.execute(
+                    f'CREATE TABLE IF NOT EXISTS {table} ({key} TEXT PRIMARY KEY, {", ".join(columns)})'
+                )
+        if not self.count('countries'):
+            self.load('countries', [dict(zip(('code', 'country_name', 'region'), row)) for row in DEFAULT_COUNTRIES])
+
+    def load(self, table, rows):
+        """Upsert rows (dicts with the table's key and value columns); returns the count"""
+        key, columns = TABLES[table]
+        fields = (key,) + columns
+        values = [tuple(row.get(field) for field in fields) for row in rows]
+        with self._lock, self.db:
+            self.db.executemany(
+                f'INSERT OR REPLACE INTO {table} ({", ".join(fields)}) VALUES ({", ".join("?" * len(fields))})',
+                values
+            )
+        return len(values)
+
+    def get_many(self, table, keys, chunk_size=500):
+        """{key: row} for the keys that exist, one query per chunk"""
+        key, columns = TABLES[table]
+        keys = list(keys)
+        rows = {}
+        with self._lock:
+            for start in range(0, len(keys), chunk_size):
+                chunk = keys[start:start + chunk_size]
+                cursor = self.db.execute(
+                    f'SELECT {key}, {", ".join(columns)} FROM {table} WHERE {key} IN ({", ".join("?" * len(chunk))})',
+                    chunk
+                )
+                for found in cursor:
+                    rows[found[0]] = dict(zip(columns, found[1:]))
+        return rows
+
+    def get(self, table, key):
+        return self.get_many(table, [key]).get(key)
+
+    def count(self, table):
+        with self._lock:
+            return self.db.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+
+
+class LRUCache:
+    """Bounded LRU with a per-entry TTL; callers pass `now` so a hit costs no clock read"""
+
+    def __init__(self, maxsize=10000, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> (value, expires at)
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+
+    def get(self, key, now):
+        entry = self.entries.get(key)
+        if entry is not None:
+            if entry[1] > now:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            del self.entries[key]
+            self.expired += 1
+        self.misses += 1
+        return MISSING
+
+    def put(self, key, value, now):
+        self.entries[key] = (value, now + self.ttl)
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def hit_ratio(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def summary(self):
+        return {
+            'size': len(self.entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'expired': self.expired,
+            'evictions': self.evictions,
+            'hit_ratio': round(self.hit_ratio(), 4)
+        }
+
+
+class Enricher:
+    """Fills dimension attributes into events so clients only send IDs
+
+    - properties.product_id -> product_name, category, price
+    - user_agent -> device_type, browser, os
+    - country (ISO code) -> country_name, region
+
+    Values the client already sent win. Each dimension has an LRU/TTL
+    cache in front of the reference store (unknown keys are cached too),
+    so a hit is a dict lookup. refresh() re-reads every cached key in bulk
+    before it expires, keeping hot keys warm and picking up catalog changes.
+    """
+
+    def __init__(self, store, cache_size=10000, ttl=300, refresh_seconds=60, clock=time.monotonic):
+        self.store = store
+        self.refresh_seconds = refresh_seconds
+        self.clock = clock
+        self.caches = {
+            'products': LRUCache(cache_size, ttl),
+            'countries': LRUCache(1000, ttl),
+            'user_agents': LRUCache(cache_size, ttl)
+        }
+        self._lock = threading.Lock()
+        self._timer = None
+        self._stop = threading.Event()
+        self.stats = {'events': 0, 'enriched': 0, 'unknown_products': 0, 'unknown_countries': 0, 'refreshes': 0}
+
+    def _lookup(self, name, key, now):
+        cache = self.caches[name]
+        value = cache.get(key, now)
+        if value is MISSING:
+            value = parse_user_agent(key) if name == 'user_agents' else self.store.get(name, key)
+            cache.put(key, value, now)
+        return value
+
+    def enrich(self, events, now=None):
+        now = self.clock() if now is None else now
+        lookup = self._lookup
+        enriched = 0
+        with self._lock:
+            for event in events:
+                touched = False
+                properties = event.get('properties')
+                if isinstance(properties, dict):
+                    product_id = properties.get('product_id')
+                    if product_id and 'product_name' not in properties:
+                        product = lookup('products', product_id, now)
+                        if product:
+                            for field, value in product.items():
+                                properties.setdefault(field, value)
+                            touched = True
+                        else:
+                            self.stats['unknown_products'] += 1
+
+                user_agent = event.get('user_agent')
+                if user_agent and 'browser' not in event:
+                    for field, value in lookup('user_agents', user_agent, now).items():
+                        event.setdefault(field, value)
+                    touched = True
+
+                country = event.get('country')
+                if country and 'country_name' not in event:
+                    row = lookup('countries', country, now)
+                    if row:
+                        for field, value in row.items():
+                            event.setdefault(field, value)
+                        touched = True
+                    else:
+                        self.stats['unknown_countries'] += 1
+                enriched += touched
+            self.stats['events'] += len(events)
+            self.stats['enriched'] += enriched
+        return enriched
+
+    def refresh(self, now=None):
+        """Re-read all cached store keys in bulk and reset their TTLs"""
+        now = self.clock() if now is None else now
+        for name in ('products', 'countries'):
+            cache = self.caches[name]
+            with self._lock:
+                keys = list(cache.entries)
+            rows = self.store.get_many(name, keys)
+            with self._lock:
+                for key in keys:
+                    if key in cache.entries:
+                        cache.entries[key] = (rows.get(key), now + cache.ttl)
+        self.stats['refreshes'] += 1
+
+    def start(self):
+        """Background bulk refresh every refresh_seconds"""
+        if self._timer is not None:
+            return
+        self._stop.clear()
+
+        def run():
+            while not self._stop.wait(self.refresh_seconds):
+                self.refresh()
+
+        self._timer = threading.Thread(target=run, name='enrichment-refresh', daemon=True)
+        self._timer.start()
+
+    def stop(self):
+        if self._timer is not None:
+            self._stop.set()
+            self._timer.join()
+            self._timer = None
+
+    def hit_ratio(self):
+        hits = sum(cache.hits for cache in self.caches.values())
+        total = hits + sum(cache.misses for cache in self.caches.values())
+        return hits / total if total else 0.0
+
+    def summary(self):
+        summary = dict(self.stats)
+        summary['hit_ratio'] = round(self.hit_ratio(), 4)
+        summary['caches'] = {name: cache.summary() for name, cache in self.caches.items()}
+        return summary
+
+
+def load_catalog(path):
+    """Product rows from a catalog JSON file (advanced_generator --catalog writes one)"""
+    with open(path) as f:
+        products = json.load(f)
+    return [{
+        'product_id': product.get('product_id', product.get('id')),
+        'product_name': product.get('product_name', product.get('name')),
+        'category': product.get('category'),
+        'price': product.get('price')
+    } for product in products]
+
+
+def create_enricher(path=None, **kw):
+    return Enricher(ReferenceStore(path or os.environ.get('REFERENCE_DB', DEFAULT_REFERENCE_DB)), **kw)
+
+
+def benchmark(enricher, lookups=200000):
+    """Average ns per cached product lookup"""
+    product_ids = list(enricher.store.get_many('products', [
+        row[0] for row in enricher.store.db.execute('SELECT product_id FROM products LIMIT 100')
+    ]))
+    if not product_ids:
+        return None
+    now = enricher.clock()
+    for product_id in product_ids:
+        enricher._lookup('products', product_id, now)
+    keys = [product_ids[i % len(product_ids)] for i in range(lookups)]
+    lookup = enricher._lookup
+    started = time.perf_counter_ns()
+    for key in keys:
+        lookup('products', key, now)
+    return (time.perf_counter_ns() - started) / lookups
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Reference data for ingest-time enrichment')
+    parser.add_argument('--db', default=os.environ.get('REFERENCE_DB', DEFAULT_REFERENCE_DB), help='SQLite reference store')
+    parser.add_argument('--load-products', help='Catalog JSON to load into the products table')
+    parser.add_argument('--benchmark', action='store_true', help='Time cached product lookups')
+    args = parser.parse_args()
+
+    enricher = create_enricher(args.db)
+    if args.load_products:
+        loaded = enricher.store.load('products', load_catalog(args.load_products))
+        print(f"📥 Loaded {loaded} products into {args.db}")
+    print(f"📚 {args.db}: {enricher.store.count('products')} products, {enricher.store.count('countries')} countries")
+    if args.benchmark:
+        ns = benchmark(enricher)
+        if ns is None:
+            print("⚠️  No products to benchmark; load a catalog first")
+        else:
+            print(f"⚡ Cached lookup: {ns:.0f} ns")
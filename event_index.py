@@ -0,0 +1,209 @@
+import threading
+
+from event_sources import event_time
+
+BLOCK_SIZE = 128
+INDEXED_FIELDS = ('user_id', 'session_id', 'event_type')
+
+
+def _encode_varint(value, out):
+    while value > 0x7f:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _decode_block(first, data):
+    """Offsets of one block: `first`, then varint gaps"""
+    offsets = [first]
+    current = first
+    value = 0
+    shift = 0
+    for byte in data:
+        value |= (byte & 0x7f) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            current += value
+            offsets.append(current)
+            value = 0
+            shift = 0
+    return offsets
+
+
+class PostingList:
+    """Ascending event offsets, delta + varint encoded in blocks
+
+    Each block of BLOCK_SIZE offsets keeps its first/last offset and the
+    min/max event time it covers, so range and cursor queries skip whole
+    blocks without decoding them. Most gaps fit in one or two bytes.
+    """
+
+    __slots__ = ('blocks', 'count')
+
+    def __init__(self):
+        self.blocks = []  # [first offset, last offset, min ts, max ts, count, gap bytes]
+        self.count = 0
+
+    def append(self, offset, ts):
+        blocks = self.blocks
+        if blocks and blocks[-1][4] < BLOCK_SIZE:
+            block = blocks[-1]
+            _encode_varint(offset - block[1], block[5])
+            block[1] = offset
+            block[4] += 1
+            if ts < block[2]:
+                block[2] = ts
+            if ts > block[3]:
+                block[3] = ts
+        else:
+            blocks.append([offset, offset, ts, ts, 1, bytearray()])
+        self.count += 1
+
+    def iter_offsets(self, start_ts=None, end_ts=None, after=None, before=None, descending=False):
+        """Offsets in blocks that may hold events in [start_ts, end_ts), past the cursor"""
+        blocks = reversed(self.blocks) if descending else self.blocks
+        for first, last, min_ts, max_ts, count, data in blocks:
+            if start_ts is not None and max_ts < start_ts:
+                continue
+            if end_ts is not None and min_ts >= end_ts:
+                continue
+            if after is not None and last <= after:
+                continue
+            if before is not None and first >= before:
+                continue
+            offsets = _decode_block(first, data)
+            if descending:
+                offsets.reverse()
+            for offset in offsets:
+                if (after is None or offset > after) and (before is None or offset < before):
+                    yield offset
+
+    def nbytes(self):
+        return sum(len(block[5]) + 40 for block in self.blocks)
+
+    def frozen(self):
+        """Copy sharing the full blocks, which append() never touches again"""
+        copy = PostingList()
+        copy.blocks = self.blocks[:]
+        if copy.blocks and copy.blocks[-1][4] < BLOCK_SIZE:
+            last = copy.blocks[-1]
+            copy.blocks[-1] = last[:5] + [bytearray(last[5])]
+        copy.count = self.count
+        return copy
+
+
+class EventIndex:
+    """Secondary indexes from user_id / session_id / event_type to buffer offsets
+
+    Offsets point into the append-only events list the index was built
+    over. Lookups return one page of offsets plus a cursor (the last offset
+    returned), so paging never rescans earlier results.
+    """
+
+    def __init__(self, fields=INDEXED_FIELDS):
+        self.fields = tuple(fields)
+        self.postings = {field: {} for field in self.fields}
+        self.indexed = 0
+        self._lock = threading.Lock()
+        self._frozen = {}  # Posting list copies from the last frozen(), by field and value
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state['_lock']  # Snapshots pickle the postings, not the lock
+        del state['_frozen']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+        self._frozen = {}
+
+    def frozen(self):
+        """Point-in-time copy for snapshots
+
+        Lists unchanged since the previous call reuse that call's copy, so
+        only the keys that got events in between are copied again.
+        """
+        with self._lock:
+            copy = EventIndex(self.fields)
+            for field, postings in self.postings.items():
+                previous = self._frozen.get(field, {})
+                copies = copy.postings[field]
+                for value, posting_list in postings.items():
+                    frozen = previous.get(value)
+                    if frozen is None or frozen.count != posting_list.count:
+                        frozen = posting_list.frozen()
+                    copies[value] = frozen
+            copy.indexed = self.indexed
+            self._frozen = copy.postings
+        return copy
+
+    @staticmethod
+    def event_ts(event):
+        ts = event_time(event)
+        if ts is None and event.get('received_at'):
+            ts = event_time({'timestamp': event['received_at']})
+        return ts if ts is not None else 0.0
+
+    def add(self, offset, event):
+        ts = self.event_ts(event)
+        with self._lock:
+            for field in self.fields:
+                value = event.get(field)
+                if value is None:
+                    continue
+                postings = self.postings[field]
+                posting_list = postings.get(value)
+                if posting_list is None:
+                    posting_list = postings[value] = PostingList()
+                posting_list.append(offset, ts)
+            self.indexed += 1
+
+    def add_many(self, first_offset, events):
+        for i, event in enumerate(events):
+            self.add(first_offset + i, event)
+
+    def count(self, field, value):
+        posting_list = self.postings[field].get(value)
+        return posting_list.count if posting_list else 0
+
+    def lookup(self, events, field, value, start_ts=None, end_ts=None, cursor=None, limit=100,
+               descending=False, where=None):
+        """One page of (offset, event) matches and the cursor for the next page"""
+        posting_list = self.postings[field].get(value)
+        if posting_list is None:
+            return [], None
+
+        after = None if descending else cursor
+        before = cursor if descending else None
+        page = []
+        for offset in posting_list.iter_offsets(start_ts, end_ts, after, before, descending):
+            event = events[offset]
+            if start_ts is not None or end_ts is not None:
+                ts = self.event_ts(event)
+                if (start_ts is not None and ts < start_ts) or (end_ts is not None and ts >= end_ts):
+                    continue
+            if where and any(event.get(k) != v for k, v in where.items()):
+                continue
+            page.append((offset, event))
+            if len(page) >= limit:
+                return page, offset
+        return page, None
+
+    def summary(self):
+        postings = 0
+        nbytes = 0
+        keys = {}
+        for field, lists in self.postings.items():
+            keys[field] = len(lists)
+            for posting_list in lists.values():
+                postings += posting_list.count
+                nbytes += posting_list.nbytes()
+        return {
+            'indexed_events': self.indexed,
+            'keys': keys,
+            'postings': postings,
+            'approx_bytes': nbytes,
+            'bytes_per_posting': round(nbytes / postings, 2) if postings else 0
+        }
@@ -0,0 +1,118 @@
+import time
+from collections import OrderedDict
+
+from event_sources import event_time
+
+DEFAULT_STEPS = ['page_view', 'add_to_cart', 'checkout', 'purchase']
+RESOLUTIONS = {'minute': 60, 'hour': 3600}
+
+
+class FunnelEngine:
+    """Incremental per-session conversion funnel
+
+    Each session keeps a bitset of the ordered steps it has reached plus the
+    event-time it entered the funnel. A step only counts if the previous one
+    was already reached and the session is still inside `window_seconds` of
+    its entry, so every update is a couple of dict lookups and bit tests.
+    Sessions are kept in entry order and dropped once their window closes.
+    """
+
+    def __init__(self, steps=None, window_seconds=1800, max_sessions=500000,
+                 retention_minutes=24 * 60, retention_hours=24 * 7):
+        self.steps = list(steps or DEFAULT_STEPS)
+        self.step_index = {step: i for i, step in enumerate(self.steps)}
+        self.window = window_seconds
+        self.max_sessions = max_sessions
+        self.retention = {'minute': retention_minutes, 'hour': retention_hours}
+
+        self.sessions = OrderedDict()  # session key -> [reached bitset, entry time]
+        self.totals = [0] * len(self.steps)
+        self.buckets = {'minute': OrderedDict(), 'hour': OrderedDict()}
+        self.stats = {'events': 0, 'steps_recorded': 0, 'sessions_expired': 0}
+
+    def process(self, event, ts=None):
+        step = self.step_index.get(event.get('event_type'))
+        if step is None:
+            return
+        self.stats['events'] += 1
+
+        if ts is None:
+            ts = event_time(event)
+            if ts is None:
+                ts = time.time()
+
+        key = event.get('session_id') or event.get('user_id') or 'anonymous'
+        state = self.sessions.get(key)
+
+        if state is not None and ts - state[1] > self.window:
+            # Window elapsed: the session starts a fresh pass through the funnel
+            del self.sessions[key]
+            state = None
+
+        if state is None:
+            if step != 0:
+                return
+            self.sessions[key] = [1, ts]
+            self._record(0, ts)
+            self._expire(ts)
+            return
+
+        bit = 1 << step
+        if state[0] & bit:
+            return
+        if state[0] & (bit >> 1):
+            state[0] |= bit
+            self._record(step, ts)
+
+    def _record(self, step, ts):
+        self.totals[step] += 1
+        self.stats['steps_recorded'] += 1
+        for resolution, width in RESOLUTIONS.items():
+            start = int(ts // width * width)
+            buckets = self.buckets[resolution]
+            counts = buckets.get(start)
+            if counts is None:
+                counts = buckets[start] = [0] * len(self.steps)
+                # New buckets almost always arrive in time order
+                while len(buckets) > self.retention[resolution]:
+                    buckets.popitem(last=False)
+            counts[step] += 1
+
+    def _expire(self, now):
+        sessions = self.sessions
+        cutoff = now - self.window
+        while sessions:
+            key, state = next(iter(sessions.items()))
+            if state[1] >= cutoff and len(sessions) <= self.max_sessions:
+                break
+            del sessions[key]
+            self.stats['sessions_expired'] += 1
+
+    def conversion_rates(self, counts=None):
+        """Step-to-step and overall conversion percentages"""
+        counts = counts or self.totals
+        rates = {}
+        for i in range(1, len(self.steps)):
+            previous = counts[i - 1]
+            rates[f'{self.steps[i - 1]}_to_{self.steps[i]}'] = (counts[i] / previous * 100) if previous else 0
+        rates['overall'] = (counts[-1] / counts[0] * 100) if counts[0] else 0
+        return rates
+
+    def summary(self):
+        return {
+            'steps': self.steps,
+            'window_seconds': self.window,
+            'counts': dict(zip(self.steps, self.totals)),
+            'conversion_rates': self.conversion_rates(),
+            'active_sessions': len(self.sessions)
+        }
+
+    def series(self, resolution='minute', limit=60):
+        """Most recent funnel counts per minute or hour bucket"""
+        if resolution not in RESOLUTIONS:
+            raise ValueError(f"resolution must be one of {', '.join(RESOLUTIONS)}")
+        buckets = sorted(self.buckets[resolution].items())[-limit:]
+        return [
+            {'bucket_start': start, 'counts': dict(zip(self.steps, counts))}
+            for start, counts in buckets
+        ]
@@ -1,17 +1,250 @@
 import json
 import boto3
 import os
+import time
+import zlib
 from datetime import datetime
 
+from metrics import Metrics, create_sink
+from dedup import EventDeduplicator, dedupe_batch
+from quarantine import create_store, validate_record, reason_for_error, INVALID_JSON
+from partitioning import AdaptivePartitioner, open_shard_ranges, SALT_FIELD
+from admission import AdmissionController
+from bulk import BulkReader, is_ndjson
+from wire import decode_records, media_type, supported_types, WireFormatError, UnsupportedContentType, JSON_TYPE
+
 # Initialize Kinesis client
 kinesis = boto3.client('kinesis')
 stream_name = os.environ.get('KINESIS_STREAM_NAME', 'clickstream-demo-stream')
 
+# put_records limit; bulk NDJSON requests are forwarded in batches of this size
+KINESIS_BATCH_SIZE = 500
+
+# Duplicate suppression: 'batch' is exact and stateless, 'container' also
+# remembers event_ids across warm invocations of this container
+dedup_mode = os.environ.get('DEDUP_MODE', 'batch')
+deduplicator = EventDeduplicator(
+    horizon_seconds=int(os.environ.get('DEDUP_HORIZON_SECONDS', 900)),
+    capacity_per_partition=int(os.environ.get('DEDUP_CAPACITY', 100000)),
+    fp_rate=float(os.environ.get('DEDUP_FP_RATE', 1e-6))
+) if dedup_mode == 'container' else None
+
+# Partition keys: 'adaptive' salts hot keys (anonymous traffic, bots) over
+# several shards, 'user_id' sends every record under its own user_id
+partitioning = os.environ.get('PARTITIONING', 'adaptive')
+partitioner = AdaptivePartitioner(
+    hot_records_per_second=float(os.environ.get('PARTITION_HOT_RATE', 100)),
+    max_salts=int(os.environ.get('PARTITION_MAX_SALTS', 8))
+) if partitioning == 'adaptive' else None
+# 'explicit' also pins salted sub-keys to distinct shards (needs kinesis:ListShards)
+partition_balance = os.environ.get('PARTITION_BALANCE', 'hash')
+
+# Per-client record budgets for this container, scaled down while Kinesis
+# throttles. Each container serves one request at a time, so the in-flight
+# cap is left to Lambda concurrency and API Gateway throttling.
+admission = AdmissionController(
+    records_per_second=float(os.environ.get('ADMISSION_RECORDS_PER_SECOND', 500)),
+    max_in_flight=0
+)
+# Bulk uploads are charged per 500-record batch against their own, larger budget
+bulk_admission = AdmissionController(
+    records_per_second=float(os.environ.get('ADMISSION_BULK_RECORDS_PER_SECOND', 5000)),
+    max_in_flight=0
+)
+
+# Custom metrics, emitted as EMF log lines by default (no API calls)
+metrics = Metrics('ClickstreamPipeline/Ingestion', {'StreamName': stream_name}, create_sink())
+
+# Invalid and failed records go to compressed segments for later replay
+quarantine = create_store(source='lambda')
+
 def lambda_handler(event, context):
     """Process clickstream events from API Gateway"""
     
     print(f"Received event: {json.dumps(event)}")
     
+    handler_start = time.perf_counter()
+    try:
+        if is_ndjson(_headers(event).get('content-type')):
+            return _handle_bulk(event, context)
+        return _handle(event, context)
+    finally:
+        try:
+            quarantined = quarantine.flush()
+            if quarantined:
+                print(f"Wrote quarantine segments: {quarantined}")
+        except Exception as e:
+            print(f"Error writing quarantine segments: {str(e)}")
+            metrics.count('QuarantineWriteErrors')
+        metrics.observe('HandlerLatency', (time.perf_counter() - handler_start) * 1000, 'Milliseconds')
+        metrics.flush()
+
+def _headers(event):
+    return {k.lower(): v for k, v in (event.get('headers') or {}).items()}
+
+def _client_id(event):
+    headers = _headers(event)
+    if headers.get('x-api-key'):
+        return headers['x-api-key']
+    return event.get('requestContext', {}).get('http', {}).get('sourceIp', 'unknown')
+
+def _forward(records, context):
+    """Partition and put one batch (at most 500) to Kinesis: (succeeded, failed)"""
+    if partitioner and partition_balance == 'explicit' and partitioner.shard_ranges is None:
+        partitioner.set_shard_ranges(open_shard_ranges(kinesis, stream_name))
+    
+    # Prepare records for Kinesis
+    kinesis_records = []
+    for record in records:
+        # Add server timestamp
+        record['processed_at'] = datetime.utcnow().isoformat()
+        record['lambda_request_id'] = context.aws_request_id
+        
+        if partitioner:
+            # Also records partition_salt on salted records
+            kinesis_records.append(partitioner.kinesis_record(record))
+            continue
+        
+        # NO BASE64 ENCODING! Just send the JSON string
+        record_json = json.dumps(record)
+        
+        kinesis_records.append({
+            'Data': record_json,  # Plain JSON string - boto3 handles encoding
+            'PartitionKey': record.get('user_id', 'anonymous')
+        })
+    
+    salted = sum(1 for record in records if SALT_FIELD in record)
+    if salted:
+        metrics.count('SaltedRecords', salted)
+    
+    print(f"Sending {len(kinesis_records)} records to Kinesis stream: {stream_name}")
+    
+    # Send to Kinesis
+    with metrics.timer('KinesisPutLatency'):
+        response = kinesis.put_records(
+            Records=kinesis_records,
+            StreamName=stream_name
+        )
+    
+    print(f"Kinesis response: {response}")
+    
+    failed = response.get('FailedRecordCount', 0)
+    success = len(records) - failed
+    throttled = sum(
+        1 for result in response['Records']
+        if result.get('ErrorCode') == 'ProvisionedThroughputExceededException'
+    )
+    admission.record_downstream(len(records), throttled)
+    bulk_admission.record_downstream(len(records), throttled)
+    metrics.gauge('AdmissionRateFactor', admission.factor)
+    
+    print(f"Successfully sent {success} records, {failed} failed")
+    metrics.count('IngestedRecords', success)
+    metrics.count('FailedRecords', failed)
+    
+    # Quarantine failures so they can be replayed once the stream recovers
+    if failed > 0:
+        for record, result in zip(records, response['Records']):
+            if 'ErrorCode' in result:
+                quarantine.add(record, reason_for_error(result['ErrorCode']), result.get('ErrorMessage'))
+        print(f"Quarantined {failed} failed records")
+        metrics.count('QuarantinedRecords', failed)
+    return success, failed
+
+def _response(status_code, body, headers=None):
+    all_headers = {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
+    all_headers.update(headers or {})
+    return {'statusCode': status_code, 'headers': all_headers, 'body': json.dumps(body)}
+
+def _handle_bulk(event, context):
+    """NDJSON body (optionally gzip), parsed line by line and sent to Kinesis in batches"""
+    headers = _headers(event)
+    if not event.get('body'):
+        return _response(400, {'error': 'Empty request body'})
+    
+    # API Gateway hands over the whole body; only the parsed records are kept per batch
+    if event.get('isBase64Encoded', False):
+        import base64
+        raw = base64.b64decode(event['body'])
+    else:
+        raw = event['body'].encode('utf-8')
+    metrics.count('RequestBytes', len(raw), 'Bytes')
+    
+    reader = BulkReader(
+        raw,
+        content_encoding=headers.get('content-encoding'),
+        batch_size=KINESIS_BATCH_SIZE,
+        on_invalid=quarantine.add
+    )
+    seen = set()  # event_ids across batches, for 'batch' dedup
+    processed = failed = duplicates = 0
+    rejection = None
+    resume_line = None
+    done_through = 0  # Last line of the last batch fully handled, for resuming after an error
+    try:
+        for batch in reader.batches():
+            records = [record for _, record in batch]
+            rejection = bulk_admission.check_rate(_client_id(event), len(records))
+            if rejection:
+                resume_line = batch[0][0]
+                metrics.count('RejectedRequests')
+                metrics.count('RejectedRecords', len(records))
+                break
+            
+            if dedup_mode == 'container':
+                records, dropped = deduplicator.filter_events(records, commit=False)
+            elif dedup_mode == 'batch':
+                records, dropped = dedupe_batch(records, seen)
+            else:
+                dropped = []
+            duplicates += len(dropped)
+            if records:
+                metrics.observe('BatchSize', len(records), 'Count')
+                sent, not_sent = _forward(records, context)
+                processed += sent
+                failed += not_sent
+                if dedup_mode == 'container':
+                    # Sent or quarantined; only now may a resend count as a duplicate
+                    deduplicator.commit(records)
+            done_through = batch[-1][0]
+    except (ValueError, zlib.error) as e:
+        print(f"Unreadable bulk body: {str(e)}")
+        metrics.count('InvalidRequests')
+        return _response(400, dict(reader.summary(), error=f'Unreadable body: {str(e)}', processed=processed))
+    except Exception as e:
+        # Kinesis or quarantine failures: report progress so the client can resume instead of getting a 502
+        print(f"Error processing bulk request: {str(e)}")
+        metrics.count('HandlerErrors')
+        import traceback
+        print(f"Traceback: {traceback.format_exc()}")
+        return _response(500, dict(reader.summary(), error='Internal server error', processed=processed,
+                                   failed=failed, resume_from_line=done_through + 1))
+    
+    print(f"Bulk request: {reader.lines} lines, {processed} sent, {failed} failed, {reader.invalid} invalid")
+    metrics.count('BulkRequests')
+    if duplicates:
+        metrics.count('DuplicateRecords', duplicates)
+    if reader.invalid:
+        metrics.count('InvalidLines', reader.invalid)
+    
+    result = reader.summary()
+    result.update({
+        'status': 'partial' if rejection else 'accepted',
+        'processed': processed,
+        'failed': failed,
+        'duplicates': duplicates,
+        'quarantined': failed + reader.set_aside,
+        'request_id': context.aws_request_id
+    })
+    if rejection:
+        result.update(rejection.to_dict())
+        result['resume_from_line'] = resume_line
+        if rejection.retry_after is None:
+            return _response(413, result)
+        return _response(429, result, {'Retry-After': str(rejection.retry_after)})
+    return _response(202, result)
+
+def _handle(event, context):
     try:
         # Parse the request body
         if 'body' not in event:
@@ -30,58 +263,99 @@ def lambda_handler(event, context):
                 'body': json.dumps({'error': 'Empty request body'})
             }
         
+        # Binary batches are negotiated by Content-Type; JSON stays the default (it
+        # parses fastest) and other types go to decode_records, which answers 415 as local_api does
+        content_type = media_type(_headers(event).get('content-type'))
+        binary = content_type != JSON_TYPE
+        
         # Handle base64 encoding if needed (from API Gateway)
         if event.get('isBase64Encoded', False):
             import base64
-            body_str = base64.b64decode(body_str).decode('utf-8')
+            body_str = base64.b64decode(body_str)
+            if not binary:
+                body_str = body_str.decode('utf-8')
         
-        body = json.loads(body_str)
-        records = body.get('records', [])
+        with metrics.timer('ParseLatency'):
+            if binary:
+                records = decode_records(body_str if isinstance(body_str, bytes) else body_str.encode('utf-8'), content_type)
+            else:
+                body = json.loads(body_str)
+                records = body.get('records', [])
+        if binary:
+            metrics.count('BinaryRequests')
         
         if not records:
+            metrics.count('EmptyBatches')
             return {
                 'statusCode': 400,
                 'headers': {'Content-Type': 'application/json'},
                 'body': json.dumps({'error': 'No records provided'})
             }
         
-        print(f"Processing {len(records)} records")
+        rejection = admission.check_rate(_client_id(event), len(records))
+        if rejection:
+            print(f"Rejected {len(records)} records: {rejection.reason}")
+            metrics.count('RejectedRequests')
+            metrics.count('RejectedRecords', len(records))
+            headers = {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
+            if rejection.retry_after is not None:
+                headers['Retry-After'] = str(rejection.retry_after)
+            return {
+                'statusCode': 429 if rejection.retry_after is not None else 413,
+                'headers': headers,
+                'body': json.dumps(rejection.to_dict())
+            }
         
-        # Prepare records for Kinesis
-        kinesis_records = []
+        # Set malformed records aside instead of rejecting the whole batch
+        valid_records = []
+        invalid = 0
         for record in records:
-            # Add server timestamp
-            record['processed_at'] = datetime.utcnow().isoformat()
-            record['lambda_request_id'] = context.aws_request_id
-            
-            # NO BASE64 ENCODING! Just send the JSON string
-            record_json = json.dumps(record)
-            
-            kinesis_records.append({
-                'Data': record_json,  # Plain JSON string - boto3 handles encoding
-                'PartitionKey': record.get('user_id', 'anonymous')
-            })
-        
-        print(f"Sending {len(kinesis_records)} records to Kinesis stream: {stream_name}")
-        
-        # Send to Kinesis
-        response = kinesis.put_records(
-            Records=kinesis_records,
-            StreamName=stream_name
-        )
+            reason = validate_record(record)
+            if reason:
+                quarantine.add(record, reason)
+                invalid += 1
+            else:
+                valid_records.append(record)
+        records = valid_records
+        if invalid:
+            print(f"Quarantined {invalid} invalid records")
+            metrics.count('QuarantinedRecords', invalid)
         
-        print(f"Kinesis response: {response}")
+        if dedup_mode == 'container':
+            # Checked now, remembered after _forward, so a retry of a failed request gets through
+            records, duplicates = deduplicator.filter_events(records, commit=False)
+        elif dedup_mode == 'batch':
+            records, duplicates = dedupe_batch(records)
+        else:
+            duplicates = []
+        if duplicates:
+            print(f"Dropped {len(duplicates)} duplicate records")
+            metrics.count('DuplicateRecords', len(duplicates))
         
-        failed = response.get('FailedRecordCount', 0)
-        success = len(records) - failed
+        if not records:
+            return {
+                'statusCode': 202,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'body': json.dumps({
+                    'status': 'accepted',
+                    'processed': 0,
+                    'failed': 0,
+                    'duplicates': len(duplicates),
+                    'quarantined': invalid,
+                    'request_id': context.aws_request_id
+                })
+            }
         
-        print(f"Successfully sent {success} records, {failed} failed")
+        print(f"Processing {len(records)} records")
+        metrics.observe('BatchSize', len(records), 'Count')
+        metrics.count('RequestBytes', len(body_str), 'Bytes')
         
-        # Log any failures
-        if failed > 0:
-            for i, result in enumerate(response['Records']):
-                if 'ErrorCode' in result:
-                    print(f"Failed record {i}: {result['ErrorCode']} - {result.get('ErrorMessage', 'No message')}")
+        success, failed = _forward(records, context)
+        if dedup_mode == 'container':
+            deduplicator.commit(records)
         
         return {
             'statusCode': 202,
@@ -93,12 +367,34 @@ def lambda_handler(event, context):
                 'status': 'accepted',
                 'processed': success,
                 'failed': failed,
+                'duplicates': len(duplicates),
+                'quarantined': invalid + failed,
                 'request_id': context.aws_request_id
             })
         }
         
+    except UnsupportedContentType as e:
+        print(f"Unsupported content type: {str(e)}")
+        metrics.count('InvalidRequests')
+        return {
+            'statusCode': 415,
+            'headers': {'Content-Type': 'application/json'},
+            'body': json.dumps({'error': str(e), 'supported': supported_types()})
+        }
+        
+    except WireFormatError as e:
+        print(f"Binary decode error: {str(e)}")
+        metrics.count('InvalidRequests')
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json'},
+            'body': json.dumps({'error': f'Invalid batch: {str(e)}'})
+        }
+        
     except json.JSONDecodeError as e:
         print(f"JSON decode error: {str(e)}")
+        metrics.count('InvalidRequests')
+        quarantine.add(body_str, INVALID_JSON, str(e))
         return {
             'statusCode': 400,
             'headers': {'Content-Type': 'application/json'},
@@ -107,6 +403,7 @@ def lambda_handler(event, context):
         
     except Exception as e:
         print(f"Error processing request: {str(e)}")
+        metrics.count('HandlerErrors')
         import traceback
         print(f"Traceback: {traceback.format_exc()}")
         return {
@@ -50,6 +50,23 @@ resource "aws_cloudwatch_event_target" "glue_target" {
   role_arn  = aws_iam_role.eventbridge_glue_role.arn
 }
 
+resource "aws_cloudwatch_event_rule" "rollup_schedule" {
+  name                = "${var.project_name}-rollup-schedule"
+  description         = "Trigger the event_rollups build job"
+  schedule_expression = var.rollup_schedule
+
+  tags = {
+    Name = "${var.project_name}-rollup-schedule"
+  }
+}
+
+resource "aws_cloudwatch_event_target" "rollup_target" {
+  rule      = aws_cloudwatch_event_rule.rollup_schedule.name
+  target_id = "RollupJobTarget"
+  arn       = "arn:aws:glue:${var.aws_region}:${data.aws_caller_identity.current.account_id}:job/${aws_glue_job.event_rollups.name}"
+  role_arn  = aws_iam_role.eventbridge_glue_role.arn
+}
+
 # IAM role for EventBridge to trigger Glue
 resource "aws_iam_role" "eventbridge_glue_role" {
   name = "${var.project_name}-eventbridge-glue-role"
@@ -80,7 +97,10 @@ resource "aws_iam_role_policy" "eventbridge_glue_policy" {
         Action = [
           "glue:StartJobRun"
         ]
-        Resource = "arn:aws:glue:${var.aws_region}:${data.aws_caller_identity.current.account_id}:job/${aws_glue_job.json_to_parquet.name}"
+        Resource = [
+          "arn:aws:glue:${var.aws_region}:${data.aws_caller_identity.current.account_id}:job/${aws_glue_job.json_to_parquet.name}",
+          "arn:aws:glue:${var.aws_region}:${data.aws_caller_identity.current.account_id}:job/${aws_glue_job.event_rollups.name}"
+        ]
       }
     ]
   })
@@ -121,6 +121,7 @@ if [ -f "lambda_functions/lambda_data_quality.py" ]; then
     echo "📦 Creating data quality Lambda package..."
     cd lambda_functions
     zip -r data_quality_lambda.zip lambda_data_quality.py
+    zip -j data_quality_lambda.zip ../metrics.py ../watermarks.py ../anomaly.py ../query_guard.py
     mv data_quality_lambda.zip ../infrastructure/
     cd ../infrastructure
     echo "✅ Data quality Lambda package created"
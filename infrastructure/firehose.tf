@@ -178,6 +178,10 @@ resource "aws_glue_catalog_table" "clickstream_events" {
       name = "lambda_request_id"
       type = "string"
     }
+    columns {
+      name = "partition_salt"
+      type = "int"
+    }
     columns {
       name = "device_type"
       type = "string"
@@ -1,9 +1,15 @@
 import json
 import boto3
 import os
+import time
 from datetime import datetime, timedelta
 import logging
 
+from metrics import Metrics, create_sink
+from watermarks import S3ManifestStore, WatermarkManifest, partition_path
+from anomaly import VolumeAnomalyDetector, TOTAL
+from query_guard import MB, QueryBudgetExceeded, QueryGuard, S3PartitionSizes
+
 # Configure logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
@@ -13,6 +19,20 @@ cloudwatch = boto3.client('cloudwatch')
 s3 = boto3.client('s3')
 athena = boto3.client('athena')
 
+ANOMALY_STATE_KEY = '_anomaly/ingest_volume.json'
+
+# Aggregated in-process and flushed once per run (EMF log lines by default)
+metrics = Metrics('ClickstreamPipeline/DataQuality', sink=create_sink(cloudwatch=cloudwatch))
+
+# Partition pruning and scan budget for Athena checks; statistics come from the processed bucket's
+# manifests, or from listing events/ since the Glue ETL job that writes it keeps no manifest
+query_guard = QueryGuard(
+    S3ManifestStore(s3, os.environ.get('PROCESSED_BUCKET_NAME')),
+    sizes=S3PartitionSizes(s3, os.environ.get('PROCESSED_BUCKET_NAME')),
+    max_bytes=int(float(os.environ.get('ATHENA_SCAN_BUDGET_MB', '1024')) * MB),
+    mode=os.environ.get('ATHENA_SCAN_GUARD', 'warn')
+)
+
 def lambda_handler(event, context):
     """
     Data Quality Monitoring Lambda
@@ -31,7 +51,7 @@ def lambda_handler(event, context):
         freshness_results = check_data_freshness(raw_bucket, processed_bucket)
         
         # 2. Check record counts
-        count_results = check_record_counts(database_name)
+        count_results = check_record_counts(database_name, processed_bucket)
         
         # 3. Check for data anomalies
         anomaly_results = check_data_anomalies(database_name)
@@ -57,17 +77,8 @@ def lambda_handler(event, context):
         logger.error(f"Data quality check failed: {str(e)}")
         
         # Publish error metric
-        cloudwatch.put_metric_data(
-            Namespace='ClickstreamPipeline/DataQuality',
-            MetricData=[
-                {
-                    'MetricName': 'DataQualityCheckErrors',
-                    'Value': 1,
-                    'Unit': 'Count',
-                    'Timestamp': datetime.utcnow()
-                }
-            ]
-        )
+        metrics.count('DataQualityCheckErrors')
+        metrics.flush()
         
         return {
             'statusCode': 500,
@@ -84,39 +95,25 @@ def check_data_freshness(raw_bucket, processed_bucket):
     results = {
         'raw_data_age_minutes': None,
         'processed_data_age_minutes': None,
+        'raw_latest_partition': None,
+        'processed_latest_partition': None,
         'freshness_status': 'healthy'
     }
     
     try:
         # Check raw data freshness
-        raw_objects = s3.list_objects_v2(
-            Bucket=raw_bucket,
-            Prefix='clickstream-data/',
-            MaxKeys=10
-        )
+        raw_age_minutes, results['raw_latest_partition'] = get_data_age(raw_bucket, 'clickstream-data')
+        results['raw_data_age_minutes'] = raw_age_minutes
         
-        if 'Contents' in raw_objects:
-            latest_raw = max(raw_objects['Contents'], key=lambda x: x['LastModified'])
-            raw_age_minutes = (datetime.now(latest_raw['LastModified'].tzinfo) - latest_raw['LastModified']).total_seconds() / 60
-            results['raw_data_age_minutes'] = raw_age_minutes
-            
-            if raw_age_minutes > 120:  # Alert if data is older than 2 hours
-                results['freshness_status'] = 'stale'
+        if raw_age_minutes is not None and raw_age_minutes > 120:  # Alert if data is older than 2 hours
+            results['freshness_status'] = 'stale'
         
         # Check processed data freshness
-        processed_objects = s3.list_objects_v2(
-            Bucket=processed_bucket,
-            Prefix='events/',
-            MaxKeys=10
-        )
+        processed_age_minutes, results['processed_latest_partition'] = get_data_age(processed_bucket, 'events')
+        results['processed_data_age_minutes'] = processed_age_minutes
         
-        if 'Contents' in processed_objects:
-            latest_processed = max(processed_objects['Contents'], key=lambda x: x['LastModified'])
-            processed_age_minutes = (datetime.now(latest_processed['LastModified'].tzinfo) - latest_processed['LastModified']).total_seconds() / 60
-            results['processed_data_age_minutes'] = processed_age_minutes
-            
-            if processed_age_minutes > 180:  # Alert if processed data is older than 3 hours
-                results['freshness_status'] = 'stale'
+        if processed_age_minutes is not None and processed_age_minutes > 180:  # Alert if processed data is older than 3 hours
+            results['freshness_status'] = 'stale'
                 
     except Exception as e:
         logger.error(f"Error checking data freshness: {str(e)}")
@@ -124,50 +121,79 @@ def check_data_freshness(raw_bucket, processed_bucket):
     
     return results
 
-def check_record_counts(database_name):
+def get_data_age(bucket, table):
+    """Minutes since the table was last written, from its watermark manifest (one GetObject)"""
+    
+    freshness = WatermarkManifest(S3ManifestStore(s3, bucket), table).freshness()
+    if freshness is not None:
+        return freshness['age_minutes'], freshness['latest_partition']
+    
+    # No manifest (Firehose doesn't write one for the raw bucket, nor does a failed ETL run): list recent keys instead
+    logger.warning(f"No watermark manifest for {table} in {bucket}, falling back to list_objects_v2")
+    latest = latest_object(bucket, f'{table}/', f'{table}/{partition_path(datetime.utcnow() - timedelta(days=1), "day")}')
+    if latest is None:
+        # Nothing since yesterday's partitions (or an unpadded layout): list the whole table
+        latest = latest_object(bucket, f'{table}/')
+    if latest is None:
+        return None, None
+    
+    age_minutes = (datetime.now(latest['LastModified'].tzinfo) - latest['LastModified']).total_seconds() / 60
+    return age_minutes, None
+
+def latest_object(bucket, prefix, start_after=None):
+    """Most recently modified object under prefix, paging past the 1000-key limit"""
+    
+    params = {'Bucket': bucket, 'Prefix': prefix}
+    if start_after:
+        # Keys sort by partition path, so StartAfter skips the older partitions entirely
+        params['StartAfter'] = start_after
+    latest = None
+    for page in s3.get_paginator('list_objects_v2').paginate(**params):
+        for obj in page.get('Contents', []):
+            if latest is None or obj['LastModified'] > latest['LastModified']:
+                latest = obj
+    return latest
+
+def check_record_counts(database_name, processed_bucket=None):
     """Check record counts and trends"""
     
     results = {
         'total_records': 0,
         'records_last_hour': 0,
         'records_last_24h': 0,
+        'count_source': 'athena',
         'count_status': 'healthy'
     }
     
     try:
-        # Query total records
-        total_query = "SELECT COUNT(*) as total FROM events_processed"
-        total_result = execute_athena_query(total_query, database_name)
-        
-        if total_result and len(total_result) > 0:
-            results['total_records'] = int(total_result[0]['total'])
-        
-        # Query records from last hour
-        hour_query = """
-        SELECT COUNT(*) as hourly_count 
-        FROM events_processed 
-        WHERE processed_at >= current_timestamp - interval '1' hour
-        """
-        hour_result = execute_athena_query(hour_query, database_name)
-        
-        if hour_result and len(hour_result) > 0:
-            results['records_last_hour'] = int(hour_result[0]['hourly_count'])
-        
-        # Query records from last 24 hours
-        daily_query = """
-        SELECT COUNT(*) as daily_count 
-        FROM events_processed 
-        WHERE processed_at >= current_timestamp - interval '24' hour
-        """
-        daily_result = execute_athena_query(daily_query, database_name)
-        
-        if daily_result and len(daily_result) > 0:
-            results['records_last_24h'] = int(daily_result[0]['daily_count'])
-        
-        # Determine status based on trends
-        if results['records_last_hour'] == 0:
+        # Per-partition row counts in the watermark manifest avoid three Athena scans
+        counts = None
+        if processed_bucket:
+            counts = WatermarkManifest(S3ManifestStore(s3, processed_bucket), 'events').row_counts()
+        
+        if counts is not None:
+            results['total_records'] = counts['total_rows']
+            results['records_last_hour'] = counts['rows_last_1h']
+            results['records_last_24h'] = counts['rows_last_24h']
+            results['count_source'] = 'manifest'
+        else:
+            query_record_counts(results, database_name)
+        
+        # Per-minute volume against its learned baseline replaces fixed thresholds
+        volume = check_volume_anomalies(processed_bucket) if processed_bucket else None
+        if volume is not None:
+            results['volume_alert'] = volume['alert']
+            results['volume_expected_per_minute'] = volume['expected_per_minute']
+        
+        if volume is not None and volume['warm']:
+            results['count_status'] = {
+                'no_data': 'no_recent_data',
+                'drop': 'low_volume',
+                'spike': 'volume_spike'
+            }.get(volume['alert'], 'healthy')
+        elif results['records_last_hour'] == 0:
             results['count_status'] = 'no_recent_data'
-        elif results['records_last_24h'] < 100:  # Expect at least 100 records per day
+        elif results['records_last_24h'] < 100:  # Until the baseline is warm
             results['count_status'] = 'low_volume'
             
     except Exception as e:
@@ -176,6 +202,85 @@ def check_record_counts(database_name):
     
     return results
 
+def check_volume_anomalies(state_bucket, lookback_minutes=24 * 60):
+    """Feed per-minute IngestedRecords from CloudWatch into the seasonal detector
+
+    Detector state lives in S3 between runs, so each run only reads the
+    minutes since the last one (one GetMetricStatistics call, no Athena).
+    """
+    
+    try:
+        store = S3ManifestStore(s3, state_bucket)
+        detector = VolumeAnomalyDetector()
+        state = store.get(ANOMALY_STATE_KEY)
+        if state:
+            detector.load(state)
+        
+        # Only whole minutes that CloudWatch has finished aggregating
+        end_minute = int(time.time() // 60) - 2
+        start_minute = max(detector.minute or 0, end_minute - lookback_minutes)
+        if end_minute > start_minute:
+            response = cloudwatch.get_metric_statistics(
+                Namespace='ClickstreamPipeline/Ingestion',
+                MetricName='IngestedRecords',
+                Dimensions=[{'Name': 'StreamName', 'Value': os.environ.get('KINESIS_STREAM_NAME', 'clickstream-demo-stream')}],
+                StartTime=datetime.utcfromtimestamp(start_minute * 60),
+                EndTime=datetime.utcfromtimestamp(end_minute * 60),
+                Period=60,
+                Statistics=['Sum']
+            )
+            for point in sorted(response['Datapoints'], key=lambda p: p['Timestamp']):
+                detector.record_minute(point['Timestamp'].timestamp(), {TOTAL: int(point['Sum'])})
+            # Minutes with no datapoints had no records
+            detector.tick(end_minute * 60)
+        
+        store.put(ANOMALY_STATE_KEY, detector.to_dict())
+        
+        summary = detector.summary()
+        baseline = summary['baselines'].get('total', {})
+        for alert in summary['recent_alerts']:
+            logger.warning(f"Volume alert: {alert}")
+        return {
+            'alert': summary['active_alerts'].get('total'),
+            'expected_per_minute': baseline.get('expected_per_minute'),
+            'warm': baseline.get('warm', False)
+        }
+    except Exception as e:
+        logger.error(f"Error checking volume anomalies: {str(e)}")
+        return None
+
+def query_record_counts(results, database_name):
+    """Fill record counts from Athena when no manifest is available"""
+    
+    # Query total records
+    total_query = "SELECT COUNT(*) as total FROM events_processed"
+    total_result = execute_athena_query(total_query, database_name)
+    
+    if total_result and len(total_result) > 0:
+        results['total_records'] = int(total_result[0]['total'])
+    
+    # Query records from last hour
+    hour_query = """
+    SELECT COUNT(*) as hourly_count 
+    FROM events_processed 
+    WHERE processed_at >= current_timestamp - interval '1' hour
+    """
+    hour_result = execute_athena_query(hour_query, database_name)
+    
+    if hour_result and len(hour_result) > 0:
+        results['records_last_hour'] = int(hour_result[0]['hourly_count'])
+    
+    # Query records from last 24 hours
+    daily_query = """
+    SELECT COUNT(*) as daily_count 
+    FROM events_processed 
+    WHERE processed_at >= current_timestamp - interval '24' hour
+    """
+    daily_result = execute_athena_query(daily_query, database_name)
+    
+    if daily_result and len(daily_result) > 0:
+        results['records_last_24h'] = int(daily_result[0]['daily_count'])
+
 def check_data_anomalies(database_name):
     """Check for data quality anomalies"""
     
@@ -231,6 +336,18 @@ def execute_athena_query(query, database_name):
     """Execute Athena query and return results"""
     
     try:
+        try:
+            analysis = query_guard.check(query)
+        except QueryBudgetExceeded as e:
+            logger.warning(f"Athena query refused: {e}")
+            metrics.count('AthenaQueriesRefused')
+            return None
+        for warning in analysis['warnings']:
+            logger.warning(f"Athena query: {warning}")
+        if analysis['estimated_bytes'] is not None:
+            metrics.observe('AthenaEstimatedScanBytes', analysis['estimated_bytes'], 'Bytes')
+        query = analysis['query']
+
         # Start query execution
         response = athena.start_query_execution(
             QueryString=query,
@@ -289,80 +406,31 @@ def execute_athena_query(query, database_name):
 def publish_metrics(freshness_results, count_results, anomaly_results):
     """Publish metrics to CloudWatch"""
     
-    metrics = []
-    
     # Freshness metrics
     if freshness_results['raw_data_age_minutes'] is not None:
-        metrics.append({
-            'MetricName': 'RawDataAgeMinutes',
-            'Value': freshness_results['raw_data_age_minutes'],
-            'Unit': 'None',
-            'Timestamp': datetime.utcnow()
-        })
+        metrics.gauge('RawDataAgeMinutes', freshness_results['raw_data_age_minutes'])
     
     if freshness_results['processed_data_age_minutes'] is not None:
-        metrics.append({
-            'MetricName': 'ProcessedDataAgeMinutes',
-            'Value': freshness_results['processed_data_age_minutes'],
-            'Unit': 'None',
-            'Timestamp': datetime.utcnow()
-        })
+        metrics.gauge('ProcessedDataAgeMinutes', freshness_results['processed_data_age_minutes'])
     
     # Count metrics
-    metrics.extend([
-        {
-            'MetricName': 'TotalRecords',
-            'Value': count_results['total_records'],
-            'Unit': 'Count',
-            'Timestamp': datetime.utcnow()
-        },
-        {
-            'MetricName': 'RecordsLastHour',
-            'Value': count_results['records_last_hour'],
-            'Unit': 'Count',
-            'Timestamp': datetime.utcnow()
-        },
-        {
-            'MetricName': 'RecordsLast24Hours',
-            'Value': count_results['records_last_24h'],
-            'Unit': 'Count',
-            'Timestamp': datetime.utcnow()
-        }
-    ])
+    metrics.gauge('TotalRecords', count_results['total_records'], 'Count')
+    metrics.gauge('RecordsLastHour', count_results['records_last_hour'], 'Count')
+    metrics.gauge('RecordsLast24Hours', count_results['records_last_24h'], 'Count')
+    if count_results.get('volume_expected_per_minute') is not None:
+        metrics.gauge('ExpectedRecordsPerMinute', count_results['volume_expected_per_minute'], 'Count')
+        metrics.gauge('VolumeAnomaly', 0 if count_results.get('volume_alert') is None else 1)
     
     # Anomaly metrics
-    metrics.extend([
-        {
-            'MetricName': 'NullUserIds',
-            'Value': anomaly_results['null_user_ids'],
-            'Unit': 'Count',
-            'Timestamp': datetime.utcnow()
-        },
-        {
-            'MetricName': 'NullTimestamps',
-            'Value': anomaly_results['null_timestamps'],
-            'Unit': 'Count',
-            'Timestamp': datetime.utcnow()
-        },
-        {
-            'MetricName': 'DuplicateEvents',
-            'Value': anomaly_results['duplicate_events'],
-            'Unit': 'Count',
-            'Timestamp': datetime.utcnow()
-        }
-    ])
+    metrics.gauge('NullUserIds', anomaly_results['null_user_ids'], 'Count')
+    metrics.gauge('NullTimestamps', anomaly_results['null_timestamps'], 'Count')
+    metrics.gauge('DuplicateEvents', anomaly_results['duplicate_events'], 'Count')
     
-    # Publish metrics in batches (CloudWatch limit is 20 per call)
-    batch_size = 20
-    for i in range(0, len(metrics), batch_size):
-        batch = metrics[i:i + batch_size]
-        try:
-            cloudwatch.put_metric_data(
-                Namespace='ClickstreamPipeline/DataQuality',
-                MetricData=batch
-            )
-        except Exception as e:
-            logger.error(f"Failed to publish metrics batch: {str(e)}")
+    # One EMF line (or one batched put_metric_data run) for the whole report
+    try:
+        metrics.flush()
+    except Exception as e:
+        logger.error(f"Failed to publish metrics: {str(e)}")
 
 def generate_quality_report(freshness_results, count_results, anomaly_results):
     """Generate a summary report of data quality"""
@@ -117,9 +117,15 @@ resource "aws_iam_role_policy" "lambda_kinesis" {
         Effect = "Allow"
         Action = [
           "kinesis:PutRecord",
-          "kinesis:PutRecords"
+          "kinesis:PutRecords",
+          "kinesis:ListShards"
         ]
         Resource = aws_kinesis_stream.clickstream.arn
+      },
+      {
+        Effect   = "Allow"
+        Action   = ["s3:PutObject"]
+        Resource = "${aws_s3_bucket.raw_data.arn}/quarantine/*"
       }
     ]
   })
@@ -139,6 +145,10 @@ resource "aws_lambda_function" "ingestion" {
   environment {
     variables = {
       KINESIS_STREAM_NAME = aws_kinesis_stream.clickstream.name
+      DEDUP_MODE          = "batch"
+      QUARANTINE_BUCKET   = aws_s3_bucket.raw_data.id
+      PARTITIONING        = "adaptive"
+      PARTITION_BALANCE   = "explicit"
     }
   }
 
@@ -184,11 +194,24 @@ resource "aws_apigatewayv2_route" "events" {
   target    = "integrations/${aws_apigatewayv2_integration.lambda.id}"
 }
 
+# Bulk NDJSON ingest (Content-Type: application/x-ndjson, optionally gzip)
+resource "aws_apigatewayv2_route" "events_bulk" {
+  api_id    = aws_apigatewayv2_api.main.id
+  route_key = "POST /events/bulk"
+  target    = "integrations/${aws_apigatewayv2_integration.lambda.id}"
+}
+
 # API Gateway Stage
 resource "aws_apigatewayv2_stage" "prod" {
   api_id      = aws_apigatewayv2_api.main.id
   name        = "$default"
   auto_deploy = true
+
+  # Global request cap in front of the Lambda's per-client limits; excess gets 429
+  default_route_settings {
+    throttling_burst_limit = 200
+    throttling_rate_limit  = 100
+  }
 }
 
 # CloudWatch Log Group for Lambda
@@ -191,6 +191,47 @@ resource "aws_cloudwatch_dashboard" "enhanced_pipeline" {
           title = "Pipeline Summary (Last 24h)"
           period = 86400
         }
+      },
+      
+      # Row 5: Custom ingestion metrics (EMF from the ingestion Lambda)
+      {
+        type   = "metric"
+        x      = 0
+        y      = 24
+        width  = 12
+        height = 6
+        properties = {
+          metrics = [
+            ["ClickstreamPipeline/Ingestion", "IngestedRecords", "StreamName", aws_kinesis_stream.clickstream.name],
+            [".", "FailedRecords", ".", "."]
+          ]
+          view = "timeSeries"
+          stacked = false
+          region = var.aws_region
+          title = "Ingestion Throughput"
+          period = 60
+          stat = "Sum"
+        }
+      },
+      {
+        type   = "metric"
+        x      = 12
+        y      = 24
+        width  = 12
+        height = 6
+        properties = {
+          metrics = [
+            ["ClickstreamPipeline/Ingestion", "HandlerLatency", "StreamName", aws_kinesis_stream.clickstream.name, { stat = "p99" }],
+            [".", "KinesisPutLatency", ".", ".", { stat = "p99" }],
+            [".", "ParseLatency", ".", ".", { stat = "p99" }],
+            [".", "BatchSize", ".", ".", { stat = "Average", yAxis = "right" }]
+          ]
+          view = "timeSeries"
+          stacked = false
+          region = var.aws_region
+          title = "Ingestion Stage Latency (ms)"
+          period = 60
+        }
       }
     ]
   })
@@ -152,6 +152,7 @@ resource "aws_glue_job" "json_to_parquet" {
     "--SOURCE_BUCKET"                    = aws_s3_bucket.raw_data.id
     "--TARGET_BUCKET"                    = aws_s3_bucket.processed_data.id
     "--DATABASE_NAME"                    = aws_glue_catalog_database.processed_db.name
+    "--extra-py-files"                   = "s3://${aws_s3_bucket.processed_data.id}/scripts/watermarks.py"
   }
 
   max_capacity = 2.0  # Minimum for cost savings
@@ -260,6 +261,139 @@ resource "aws_glue_catalog_table" "events_processed" {
   }
 }
 
+# Hourly rollups of events_processed (written by rollup_tables.py); day-level
+# count queries read these instead of the raw partitions
+resource "aws_glue_catalog_table" "event_rollups" {
+  name          = "event_rollups"
+  database_name = aws_glue_catalog_database.processed_db.name
+  description   = "Hourly event counts, revenue and unique-user sketches"
+
+  table_type = "EXTERNAL_TABLE"
+
+  parameters = {
+    "classification"            = "parquet"
+    "parquet.compress"          = "SNAPPY"
+    "projection.enabled"        = "true"
+    "projection.year.type"      = "integer"
+    "projection.year.range"     = "2024,2030"
+    "projection.month.type"     = "integer"
+    "projection.month.range"    = "1,12"
+    "projection.month.digits"   = "2"
+    "projection.day.type"       = "integer"
+    "projection.day.range"      = "1,31"
+    "projection.day.digits"     = "2"
+    "projection.hour.type"      = "integer"
+    "projection.hour.range"     = "0,23"
+    "projection.hour.digits"    = "2"
+    "storage.location.template" = "s3://${aws_s3_bucket.processed_data.id}/rollups/event_rollups/year=$${year}/month=$${month}/day=$${day}/hour=$${hour}"
+  }
+
+  storage_descriptor {
+    location      = "s3://${aws_s3_bucket.processed_data.id}/rollups/event_rollups/"
+    input_format  = "org.apache.hadoop.hive.ql.io.parquet.MapredParquetInputFormat"
+    output_format = "org.apache.hadoop.hive.ql.io.parquet.MapredParquetOutputFormat"
+
+    ser_de_info {
+      serialization_library = "org.apache.hadoop.hive.ql.io.parquet.serde.ParquetHiveSerDe"
+    }
+
+    columns {
+      name = "rollup_level"
+      type = "string"
+    }
+
+    columns {
+      name = "event_type"
+      type = "string"
+    }
+
+    columns {
+      name = "device_type"
+      type = "string"
+    }
+
+    columns {
+      name = "country"
+      type = "string"
+    }
+
+    columns {
+      name = "event_count"
+      type = "bigint"
+    }
+
+    columns {
+      name = "purchases"
+      type = "bigint"
+    }
+
+    columns {
+      name = "revenue"
+      type = "double"
+    }
+
+    columns {
+      name = "null_user_events"
+      type = "bigint"
+    }
+
+    columns {
+      name = "users_hll"
+      type = "string"
+    }
+
+    columns {
+      name = "users_estimate"
+      type = "bigint"
+    }
+  }
+
+  partition_keys {
+    name = "year"
+    type = "int"
+  }
+
+  partition_keys {
+    name = "month"
+    type = "int"
+  }
+
+  partition_keys {
+    name = "day"
+    type = "int"
+  }
+
+  partition_keys {
+    name = "hour"
+    type = "int"
+  }
+}
+
+# Glue Python shell job that refreshes event_rollups for recent hours
+# (rollup_tables.py; the analytics library set provides pyarrow)
+resource "aws_glue_job" "event_rollups" {
+  name         = "${var.project_name}-event-rollups"
+  role_arn     = aws_iam_role.glue_role.arn
+  glue_version = "3.0"
+
+  command {
+    name            = "pythonshell"
+    script_location = "s3://${aws_s3_bucket.processed_data.id}/scripts/rollup_job.py"
+    python_version  = "3.9"
+  }
+
+  default_arguments = {
+    "--job-language"    = "python"
+    "library-set"       = "analytics"
+    "--extra-py-files"  = join(",", [for name in ["rollup_tables.py", "compaction.py", "watermarks.py", "sketches.py", "event_sources.py"] : "s3://${aws_s3_bucket.processed_data.id}/scripts/${name}"])
+    "--BUCKET"          = aws_s3_bucket.processed_data.id
+    "--LOOKBACK_HOURS"  = var.rollup_lookback_hours
+  }
+
+  max_capacity = 0.0625
+  timeout      = 30
+}
+
 # Glue Crawler for automatic schema detection
 resource "aws_glue_crawler" "processed_data_crawler" {
   database_name = aws_glue_catalog_database.processed_db.name
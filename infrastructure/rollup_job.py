@@ -0,0 +1,19 @@
+import sys
+import json
+import boto3
+from awsglue.utils import getResolvedOptions
+
+from watermarks import WatermarkManifest
+from rollup_tables import ROLLUP_PREFIX, RollupBuilder, S3Files
+
+# Glue Python shell job: refresh event_rollups for recent hours of events_processed
+args = getResolvedOptions(sys.argv, ['BUCKET', 'LOOKBACK_HOURS'])
+
+files = S3Files(boto3.client('s3'), args['BUCKET'])
+builder = RollupBuilder(files, manifest=WatermarkManifest(files.manifests, ROLLUP_PREFIX))
+result = builder.run(lookback_hours=float(args['LOOKBACK_HOURS']))
+
+for report in result['partitions']:
+    if report['built']:
+        print(f"Built {report['partition']}: {report['source_rows']} events -> {report['rollup_rows']} rows")
+print(json.dumps(result['totals']))
@@ -42,10 +42,10 @@ def run_athena_query(query, database, output_location):
         return {'error': response['QueryExecution']['Status'].get('StateChangeReason')}
 
 if __name__ == "__main__":
-    # Example usage
+    # Example usage: today's events by type from the processed Parquet table
     query = """
     SELECT event_type, COUNT(*) as count
-    FROM events
+    FROM events_processed
     WHERE year = YEAR(CURRENT_DATE)
       AND month = MONTH(CURRENT_DATE)
       AND day = DAY(CURRENT_DATE)
@@ -55,11 +55,33 @@ if __name__ == "__main__":
     
     # Get bucket name from Terraform
     import subprocess
-    result = subprocess.run(['terraform', 'output', '-raw', 'athena_results_bucket'], 
-                          capture_output=True, text=True, cwd='infrastructure')
-    output_bucket = result.stdout.strip()
-    
-    results = run_athena_query(query, 'clickstream_demo_db', output_bucket)
+    def terraform_output(name):
+        result = subprocess.run(['terraform', 'output', '-raw', name],
+                                capture_output=True, text=True, cwd='infrastructure')
+        return result.stdout.strip()
+
+    output_bucket = terraform_output('athena_results_bucket')
+
+    # Queries on events_processed read completed hours from event_rollups (same
+    # database, same source data)
+    import os
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from datetime import datetime, timezone
+    from rollup_tables import ROLLUP_TABLE, RollupBuilder, S3Files, rewrite_query
+
+    processed_bucket = terraform_output('processed_bucket_name')
+    processed_database = terraform_output('processed_database_name')
+    if processed_bucket:
+        # Only hours whose rollup still matches its source files count; the query covers today
+        files = S3Files(boto3.client('s3', region_name='eu-west-2'), processed_bucket)
+        today = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+        cutoff = RollupBuilder(files, file_format='parquet').verified_cutoff(since=today)
+        rewritten = rewrite_query(query, cutoff, ROLLUP_TABLE, since=today)
+        if rewritten:
+            print(f"🧮 Reading rollups up to {cutoff:%Y-%m-%d %H}:00 UTC")
+            query = rewritten
+
+    results = run_athena_query(query, processed_database, output_bucket)
     
     if 'error' in results:
         print(f"Query failed: {results['error']}")
@@ -11,6 +11,18 @@ variable "glue_job_schedule" {
   default     = "rate(2 hours)"
 }
 
+variable "rollup_schedule" {
+  description = "Schedule for the event_rollups build job"
+  type        = string
+  default     = "rate(1 hour)"
+}
+
+variable "rollup_lookback_hours" {
+  description = "Hours of events_processed each rollup build re-checks for new or late data"
+  type        = string
+  default     = "48"
+}
+
 variable "monthly_budget_limit" {
   description = "Monthly budget limit in USD"
   type        = string
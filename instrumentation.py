@@ -0,0 +1,276 @@
+import sys
+import time
+import threading
+import traceback
+
+SUB_BUCKET_BITS = 6                 # 64 sub-buckets per power of two, ~1.6% relative error
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+MAX_EXPONENT = 40                   # Covers up to ~2^46 ns (about 20 hours)
+
+
+class LatencyHistogram:
+    """HDR-style log-linear histogram of nanosecond latencies
+
+    Values below 2 * SUB_BUCKETS are exact; above that each power of two is
+    split into SUB_BUCKETS linear buckets, so every recorded value is kept
+    within ~1.6% using a fixed array of counts.
+    """
+
+    def __init__(self):
+        self.counts = [0] * (2 * SUB_BUCKETS + MAX_EXPONENT * SUB_BUCKETS)
+        self.total = 0
+        self.sum_ns = 0
+        self.max_ns = 0
+        self._last_index = len(self.counts) - 1
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _index(value):
+        if value < 2 * SUB_BUCKETS:
+            return value
+        shift = value.bit_length() - SUB_BUCKET_BITS - 1
+        return 2 * SUB_BUCKETS + (shift - 1) * SUB_BUCKETS + (value >> shift) - SUB_BUCKETS
+
+    @staticmethod
+    def _value_at(index):
+        """Upper edge of a bucket, in nanoseconds"""
+        if index < 2 * SUB_BUCKETS:
+            return index
+        offset = index - 2 * SUB_BUCKETS
+        shift = offset // SUB_BUCKETS + 1
+        return ((offset % SUB_BUCKETS + SUB_BUCKETS + 1) << shift) - 1
+
+    def record(self, value_ns):
+        if value_ns < 2 * SUB_BUCKETS:
+            index = value_ns if value_ns > 0 else 0
+        else:
+            # Same as _index(), inlined because this runs on every timed stage
+            shift = value_ns.bit_length() - SUB_BUCKET_BITS - 1
+            index = (shift << SUB_BUCKET_BITS) + (value_ns >> shift)
+            if index > self._last_index:
+                index = self._last_index
+        with self._lock:
+            self.counts[index] += 1
+            self.total += 1
+            self.sum_ns += value_ns
+            if value_ns > self.max_ns:
+                self.max_ns = value_ns
+
+    def percentile(self, p):
+        """Latency in nanoseconds at percentile p (0-100)"""
+        if not self.total:
+            return 0
+        target = max(1, int(self.total * p / 100 + 0.5))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if count:
+                seen += count
+                if seen >= target:
+                    return min(self._value_at(index), self.max_ns)
+        return self.max_ns
+
+    def snapshot(self):
+        return {
+            'count': self.total,
+            'mean_ms': self.sum_ns / self.total / 1e6 if self.total else 0,
+            'p50_ms': self.percentile(50) / 1e6,
+            'p90_ms': self.percentile(90) / 1e6,
+            'p99_ms': self.percentile(99) / 1e6,
+            'max_ms': self.max_ns / 1e6
+        }
+
+
+class _Stage:
+    __slots__ = ('histogram', 'start')
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.record(time.perf_counter_ns() - self.start)
+        return False
+
+
+class Instrumentation:
+    """Stage latency histograms and counters with Prometheus text output"""
+
+    def __init__(self, prefix='clickstream'):
+        self.prefix = prefix
+        self.histograms = {}   # (name, label value) -> LatencyHistogram
+        self.counters = {}     # (name, frozenset of labels) -> value
+        self.gauges = {}       # (name, frozenset of labels) -> last value
+        self.enabled = True
+        self._lock = threading.Lock()
+        self.record_cost_ns = self._calibrate()
+
+    def _histogram(self, name, label):
+        key = (name, label)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = self.histograms.setdefault(key, LatencyHistogram())
+        return histogram
+
+    def stage(self, stage, name='stage_latency'):
+        """`with instrumentation.stage('parse'):` times one step of a request"""
+        return _Stage(self._histogram(name, stage))
+
+    def record(self, stage, duration_ns, name='stage_latency'):
+        if self.enabled:
+            self._histogram(name, stage).record(duration_ns)
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def gauge(self, name, value, **labels):
+        self.gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def _calibrate(self, iterations=2000):
+        """Measure what one timed stage costs so overhead can be reported"""
+        histogram = LatencyHistogram()
+        for _ in range(200):  # Warm up before measuring
+            with _Stage(histogram):
+                pass
+        start = time.perf_counter_ns()
+        for _ in range(iterations):
+            with _Stage(histogram):
+                pass
+        return (time.perf_counter_ns() - start) / iterations
+
+    def overhead(self):
+        """Estimated instrumentation time as a share of recorded request time"""
+        stage_records = sum(h.total for (name, _), h in self.histograms.items() if name == 'stage_latency')
+        request_ns = sum(h.sum_ns for (name, _), h in self.histograms.items() if name == 'request_latency')
+        request_count = sum(h.total for (name, _), h in self.histograms.items() if name == 'request_latency')
+        spent_ns = (stage_records + request_count) * self.record_cost_ns
+        return {
+            'record_cost_ns': round(self.record_cost_ns, 1),
+            'overhead_ratio': spent_ns / request_ns if request_ns else 0
+        }
+
+    def snapshot(self):
+        return {
+            'latency': {f'{name}:{label}': h.snapshot() for (name, label), h in sorted(self.histograms.items())},
+            'counters': {
+                name + (''.join(f',{k}={v}' for k, v in labels)): value
+                for (name, labels), value in sorted(self.counters.items())
+            },
+            'gauges': {
+                name + (''.join(f',{k}={v}' for k, v in labels)): value
+                for (name, labels), value in sorted(self.gauges.items())
+            },
+            'overhead': self.overhead()
+        }
+
+    def render_prometheus(self):
+        """Prometheus text exposition format (version 0.0.4)"""
+        lines = []
+
+        counter_names = sorted({name for name, _ in self.counters})
+        for name in counter_names:
+            metric = f'{self.prefix}_{name}_total'
+            lines.append(f'# TYPE {metric} counter')
+            for (counter_name, labels), value in sorted(self.counters.items()):
+                if counter_name == name:
+                    lines.append(f'{metric}{_labels(labels)} {value}')
+
+        gauge_names = sorted({name for name, _ in self.gauges})
+        for name in gauge_names:
+            metric = f'{self.prefix}_{name}'
+            lines.append(f'# TYPE {metric} gauge')
+            for (gauge_name, labels), value in sorted(self.gauges.items()):
+                if gauge_name == name:
+                    lines.append(f'{metric}{_labels(labels)} {value}')
+
+        histogram_names = sorted({name for name, _ in self.histograms})
+        for name in histogram_names:
+            metric = f'{self.prefix}_{name}_seconds'
+            label_name = 'stage' if name == 'stage_latency' else 'endpoint'
+            lines.append(f'# TYPE {metric} summary')
+            for (histogram_name, label), h in sorted(self.histograms.items()):
+                if histogram_name != name:
+                    continue
+                for quantile in (0.5, 0.9, 0.99):
+                    value = h.percentile(quantile * 100) / 1e9
+                    lines.append(f'{metric}{_labels([(label_name, label), ("quantile", quantile)])} {value:.9f}')
+                lines.append(f'{metric}_sum{_labels([(label_name, label)])} {h.sum_ns / 1e9:.9f}')
+                lines.append(f'{metric}_count{_labels([(label_name, label)])} {h.total}')
+
+        overhead = self.overhead()
+        lines.append(f'# TYPE {self.prefix}_instrumentation_overhead_ratio gauge')
+        lines.append(f'{self.prefix}_instrumentation_overhead_ratio {overhead["overhead_ratio"]:.6f}')
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in labels) + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class SamplingProfiler:
+    """Wall-clock sampling profiler that can be switched on and off at runtime
+
+    A background thread snapshots every other thread's stack each
+    `interval` seconds and counts collapsed stacks (the input format for
+    flamegraph tools). It costs nothing while stopped.
+    """
+
+    def __init__(self, interval=0.005, max_depth=40):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.stacks = {}
+        self.samples = 0
+        self._thread = None
+        self._stop = threading.Event()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return False
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+        self._thread.start()
+        return True
+
+    def stop(self):
+        if not self.running:
+            return False
+        self._stop.set()
+        self._thread.join()
+        return True
+
+    def reset(self):
+        self.stacks = {}
+        self.samples = 0
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                summary = traceback.extract_stack(frame, limit=self.max_depth)
+                stack = ';'.join(f'{f.name} ({f.filename.rsplit("/", 1)[-1]}:{f.lineno})' for f in summary)
+                self.stacks[stack] = self.stacks.get(stack, 0) + 1
+            self.samples += 1
+
+    def collapsed(self, limit=None):
+        """Stacks in 'frame;frame;frame count' format, hottest first"""
+        items = sorted(self.stacks.items(), key=lambda kv: kv[1], reverse=True)
+        if limit:
+            items = items[:limit]
+        return '\n'.join(f'{stack} {count}' for stack, count in items) + '\n'
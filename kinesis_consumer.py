@@ -0,0 +1,527 @@
+import os
+import json
+import time
+import random
+import sqlite3
+import argparse
+import threading
+import multiprocessing
+from multiprocessing.managers import BaseManager
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from sessionizer import Sessionizer
+from event_sources import event_time
+
+# Per-shard read limits of the real service
+READ_CALLS_PER_SECOND = 5
+READ_BYTES_PER_SECOND = 2 * 1024 * 1024
+
+SHARD_END = 'SHARD_END'
+LEASE_END = 'LEASE_END'
+SHUTDOWN = 'SHUTDOWN'
+
+
+class FileCheckpointStore:
+    """One small JSON file per shard, replaced atomically, so workers never share a file"""
+
+    def __init__(self, directory, application='clickstream-consumer'):
+        self.directory = os.path.join(directory, application)
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, shard_id):
+        return os.path.join(self.directory, f'{shard_id}.json')
+
+    def get(self, shard_id):
+        """(sequence number or None, finished)"""
+        try:
+            with open(self._path(shard_id)) as f:
+                checkpoint = json.load(f)
+        except FileNotFoundError:
+            return None, False
+        return checkpoint.get('sequence'), checkpoint.get('finished', False)
+
+    def put(self, shard_id, sequence, finished=False):
+        path = self._path(shard_id)
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'sequence': sequence, 'finished': finished, 'updated_at': time.time()}, f)
+        os.replace(tmp, path)
+
+    def all(self):
+        checkpoints = {}
+        for name in os.listdir(self.directory):
+            if name.endswith('.json'):
+                shard_id = name[:-5]
+                checkpoints[shard_id] = self.get(shard_id)
+        return checkpoints
+
+
+class SQLiteCheckpointStore:
+    """Checkpoints in one SQLite table; each process opens its own connection"""
+
+    def __init__(self, path, application='clickstream-consumer'):
+        self.path = path
+        self.application = application
+        self._db = None
+        with self.db:
+            self.db.execute(
+                'CREATE TABLE IF NOT EXISTS checkpoints ('
+                'application TEXT, shard_id TEXT, sequence TEXT, finished INTEGER, updated_at REAL, '
+                'PRIMARY KEY (application, shard_id))'
+            )
+
+    @property
+    def db(self):
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, timeout=30)
+            self._db.execute('PRAGMA journal_mode=WAL')
+        return self._db
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['_db'] = None  # Connections do not cross process boundaries
+        return state
+
+    def get(self, shard_id):
+        row = self.db.execute(
+            'SELECT sequence, finished FROM checkpoints WHERE application = ? AND shard_id = ?',
+            (self.application, shard_id)
+        ).fetchone()
+        return (row[0], bool(row[1])) if row else (None, False)
+
+    def put(self, shard_id, sequence, finished=False):
+        with self.db:
+            self.db.execute(
+                'INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?, ?)',
+                (self.application, shard_id, sequence, int(finished), time.time())
+            )
+
+    def all(self):
+        rows = self.db.execute(
+            'SELECT shard_id, sequence, finished FROM checkpoints WHERE application = ?', (self.application,)
+        )
+        return {shard_id: (sequence, bool(finished)) for shard_id, sequence, finished in rows}
+
+
+def create_checkpoint_store(location, application='clickstream-consumer'):
+    """`*.db` / `*.sqlite` paths use SQLite, anything else is a checkpoint directory"""
+    if location.endswith(('.db', '.sqlite')):
+        return SQLiteCheckpointStore(location, application)
+    return FileCheckpointStore(location, application)
+
+
+class ReadThrottle:
+    """Keeps one shard's GetRecords calls under the per-shard call and byte limits"""
+
+    def __init__(self, calls_per_second=READ_CALLS_PER_SECOND, bytes_per_second=READ_BYTES_PER_SECOND):
+        self.min_interval = 1.0 / calls_per_second
+        self.bytes_per_second = bytes_per_second
+        self.next_call = 0.0
+
+    def wait(self, stop):
+        delay = self.next_call - time.monotonic()
+        if delay > 0:
+            stop.wait(delay)
+
+    def record(self, nbytes):
+        # The byte limit is a rolling budget: a big batch pushes the next call back
+        now = time.monotonic()
+        self.next_call = now + max(self.min_interval, nbytes / self.bytes_per_second)
+
+
+def _is_throttle(error):
+    code = getattr(error, 'response', {}).get('Error', {}).get('Code')
+    return 'ProvisionedThroughputExceeded' in (code or type(error).__name__)
+
+
+def consume_shard(task):
+    """Worker process body: read one shard from its checkpoint until shard end, lease end or stop"""
+    shard_id = task['shard_id']
+    stream_name = task['stream_name']
+    client = task['client_factory']()
+    checkpoints = task['checkpoints']
+    stop = task['stop']
+    processor = task['processor_factory']()
+    if hasattr(processor, 'initialize'):
+        processor.initialize(shard_id)
+
+    sequence, _ = checkpoints.get(shard_id)
+    if sequence:
+        iterator = client.get_shard_iterator(
+            StreamName=stream_name, ShardId=shard_id,
+            ShardIteratorType='AFTER_SEQUENCE_NUMBER', StartingSequenceNumber=sequence
+        )['ShardIterator']
+    else:
+        iterator = client.get_shard_iterator(
+            StreamName=stream_name, ShardId=shard_id, ShardIteratorType=task['initial_position']
+        )['ShardIterator']
+
+    throttle = ReadThrottle(task['calls_per_second'], task['bytes_per_second'])
+    deadline = time.monotonic() + task['lease_seconds'] if task['lease_seconds'] else None
+    stats = {'records': 0, 'bytes': 0, 'batches': 0, 'undecodable': 0, 'throttled': 0, 'millis_behind': None}
+    backoff = 0.1
+    reason = LEASE_END
+    while iterator:
+        if stop.is_set():
+            reason = SHUTDOWN
+            break
+        if (deadline and time.monotonic() >= deadline) or task['release'].is_set():
+            break
+        throttle.wait(stop)
+        try:
+            response = client.get_records(ShardIterator=iterator, Limit=task['batch_size'])
+        except Exception as e:
+            if not _is_throttle(e):
+                raise
+            stats['throttled'] += 1
+            stop.wait(backoff + random.random() * backoff)
+            backoff = min(backoff * 2, 5.0)
+            continue
+        backoff = 0.1
+        records = response['Records']
+        iterator = response.get('NextShardIterator')
+        stats['millis_behind'] = response.get('MillisBehindLatest')
+        nbytes = sum(len(record['Data']) for record in records)
+        throttle.record(nbytes)
+        if not records:
+            if iterator and not response.get('MillisBehindLatest'):
+                stop.wait(task['idle_seconds'])
+            continue
+
+        if task['decode']:
+            batch = []
+            for record in records:
+                try:
+                    batch.append(json.loads(record['Data']))
+                except ValueError:
+                    stats['undecodable'] += 1
+        else:
+            batch = records
+        processor.process(shard_id, batch)
+        # At-least-once: checkpoint only after the processor accepted the batch
+        sequence = records[-1]['SequenceNumber']
+        checkpoints.put(shard_id, sequence)
+        stats['records'] += len(records)
+        stats['bytes'] += nbytes
+        stats['batches'] += 1
+
+    if iterator is None:
+        reason = SHARD_END
+        checkpoints.put(shard_id, sequence, finished=True)
+    result = processor.close(shard_id, reason) if hasattr(processor, 'close') else None
+    stats.update({'shard_id': shard_id, 'reason': reason, 'result': result})
+    return stats
+
+
+class ShardConsumer:
+    """Reads every shard of a stream in parallel, one pool worker per shard
+
+    The coordinator lists shards, and hands each eligible shard to a worker
+    process that reads from its checkpoint, passes batches to a processor
+    built by `processor_factory` and checkpoints after each batch. A shard
+    is eligible once all its parents (after a split or merge) are read to
+    the end, so records of one key are processed in order across
+    resharding. New shards are picked up on the next scan. While there
+    are at least as many workers as eligible shards, a worker keeps its
+    shard, so stateful processors such as SessionProcessor are not cut
+    off every lease. Once shards outnumber workers, those holders are
+    released and every lease lasts at most `lease_seconds`, so all shards
+    make progress.
+
+    Processors need `process(shard_id, records)` and may define
+    `initialize(shard_id)` and `close(shard_id, reason)`; whatever close
+    returns is passed to `on_result`. Factories must be picklable.
+    """
+
+    def __init__(self, client_factory, stream_name, processor_factory, checkpoints, max_workers=None,
+                 batch_size=1000, initial_position='TRIM_HORIZON', lease_seconds=60, scan_interval=5.0,
+                 idle_seconds=1.0, decode=True, calls_per_second=READ_CALLS_PER_SECOND,
+                 bytes_per_second=READ_BYTES_PER_SECOND, on_result=None):
+        self.client_factory = client_factory
+        self.stream_name = stream_name
+        self.processor_factory = processor_factory
+        self.checkpoints = checkpoints
+        self.max_workers = max_workers or os.cpu_count()
+        self.batch_size = batch_size
+        self.initial_position = initial_position
+        self.lease_seconds = lease_seconds
+        self.scan_interval = scan_interval
+        self.idle_seconds = idle_seconds
+        self.decode = decode
+        self.calls_per_second = calls_per_second
+        self.bytes_per_second = bytes_per_second
+        self.on_result = on_result
+        self.stats = {'records': 0, 'bytes': 0, 'leases': 0, 'shards_finished': 0, 'scans': 0}
+        self.shard_stats = {}
+
+    def eligible_shards(self, shards, checkpoints):
+        """Unfinished shards whose parents are finished (or gone from the listing)"""
+        listed = {shard['ShardId'] for shard in shards}
+        finished = {shard_id for shard_id, (_, done) in checkpoints.items() if done}
+        eligible = []
+        for shard in shards:
+            shard_id = shard['ShardId']
+            if shard_id in finished:
+                continue
+            parents = [shard.get('ParentShardId'), shard.get('AdjacentParentShardId')]
+            if all(p is None or p not in listed or p in finished for p in parents):
+                eligible.append(shard_id)
+        return eligible
+
+    def _task(self, shard_id, stop, release, lease_seconds):
+        return {
+            'shard_id': shard_id, 'stream_name': self.stream_name, 'client_factory': self.client_factory,
+            'processor_factory': self.processor_factory, 'checkpoints': self.checkpoints, 'stop': stop,
+            'release': release, 'batch_size': self.batch_size, 'initial_position': self.initial_position,
+            'lease_seconds': lease_seconds, 'idle_seconds': self.idle_seconds, 'decode': self.decode,
+            'calls_per_second': self.calls_per_second, 'bytes_per_second': self.bytes_per_second
+        }
+
+    def _collect(self, stats):
+        shard = self.shard_stats.setdefault(stats['shard_id'], {'records': 0, 'leases': 0})
+        shard['records'] += stats['records']
+        shard['leases'] += 1
+        shard['last_reason'] = stats['reason']
+        shard['millis_behind'] = stats['millis_behind']
+        self.stats['records'] += stats['records']
+        self.stats['bytes'] += stats['bytes']
+        self.stats['leases'] += 1
+        if stats['reason'] == SHARD_END:
+            self.stats['shards_finished'] += 1
+        if self.on_result:
+            self.on_result(stats)
+
+    def run(self, duration=None, until=None, exit_when_done=False):
+        """Consume until `duration` passes, `until()` is true, or (optionally) every shard has ended"""
+        client = self.client_factory()
+        started = time.monotonic()
+        with multiprocessing.Manager() as manager, ProcessPoolExecutor(self.max_workers) as pool:
+            stop = manager.Event()
+            running = {}  # future -> shard_id
+            held = {}  # future -> release event, for workers holding their shard without a lease limit
+            next_scan = 0.0
+            try:
+                while True:
+                    if (duration and time.monotonic() - started >= duration) or (until and until()):
+                        break
+                    if time.monotonic() >= next_scan:
+                        shards = client.list_shards(StreamName=self.stream_name)['Shards']
+                        eligible = self.eligible_shards(shards, self.checkpoints.all())
+                        self.stats['scans'] += 1
+                        busy = set(running.values())
+                        contended = len(eligible) > self.max_workers
+                        if contended:
+                            # Shards are waiting; held shards go back to timed leases
+                            for release in held.values():
+                                release.set()
+                            held.clear()
+                        # Least-leased first, so a timed-out shard doesn't win its worker straight back
+                        for shard_id in sorted(eligible, key=lambda s: self.shard_stats.get(s, {}).get('leases', 0)):
+                            if shard_id not in busy and len(running) < self.max_workers:
+                                release = manager.Event()
+                                lease_seconds = self.lease_seconds if contended else None
+                                future = pool.submit(consume_shard, self._task(shard_id, stop, release, lease_seconds))
+                                running[future] = shard_id
+                                if not contended:
+                                    held[future] = release
+                        if exit_when_done and not eligible and not running:
+                            break
+                        next_scan = time.monotonic() + self.scan_interval
+                    if not running:
+                        time.sleep(min(0.5, self.scan_interval))
+                        continue
+                    done, _ = wait(list(running), timeout=0.5, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        del running[future]
+                        held.pop(future, None)
+                        self._collect(future.result())
+                        next_scan = 0.0  # A finished shard may unblock its children
+            finally:
+                stop.set()
+                for future in list(running):
+                    self._collect(future.result())
+        return self.summary(time.monotonic() - started)
+
+    def summary(self, elapsed=None):
+        summary = dict(self.stats)
+        if elapsed:
+            summary['elapsed_seconds'] = round(elapsed, 2)
+            summary['records_per_second'] = round(self.stats['records'] / elapsed, 1)
+        summary['shards'] = self.shard_stats
+        return summary
+
+
+class EventCounter:
+    """Example processor: counts events per event_type"""
+
+    def __init__(self):
+        self.counts = {}
+
+    def process(self, shard_id, events):
+        for event in events:
+            event_type = event.get('event_type', 'unknown')
+            self.counts[event_type] = self.counts.get(event_type, 0) + 1
+
+    def close(self, shard_id, reason):
+        return self.counts
+
+
+class SessionProcessor:
+    """Runs the streaming sessionizer on one shard; returns closed sessions at close
+
+    Partitioning by user_id keeps a user's events on one shard, so sessions
+    computed per shard are complete. Sessions still open at close are
+    flushed; ShardConsumer only ends a lease early for shard end, shutdown,
+    or when there are more shards than workers.
+    """
+
+    def __init__(self, gap_seconds=1800, allowed_lateness=60):
+        self.sessionizer = Sessionizer(gap_seconds=gap_seconds, allowed_lateness=allowed_lateness)
+        self.sessions = 0
+
+    def process(self, shard_id, events):
+        for event in events:
+            if event_time(event) is not None:
+                self.sessionizer.process(event)
+        self.sessions += len(self.sessionizer.drain())
+
+    def close(self, shard_id, reason):
+        self.sessionizer.flush()
+        self.sessions += len(self.sessionizer.drain())
+        return {'sessions': self.sessions}
+
+
+class _StreamServerManager(BaseManager):
+    pass
+
+
+class _StreamClientManager(BaseManager):
+    pass
+
+
+_StreamClientManager.register('stream')
+
+
+class LocalStreamServer:
+    """Serves an in-process LocalKinesisStream to consumer worker processes
+
+    Runs a multiprocessing manager server on a thread of this process, so
+    producers here and workers elsewhere see the same stream object.
+    """
+
+    def __init__(self, stream, authkey=None):
+        self.authkey = authkey or os.urandom(16)
+        manager = _StreamServerManager(address=('127.0.0.1', 0), authkey=self.authkey)
+        manager.register('stream', callable=lambda: stream)
+        self.server = manager.get_server()
+        self.address = self.server.address
+        self.thread = threading.Thread(target=self.server.serve_forever, name='local-stream-server', daemon=True)
+        self.thread.start()
+
+    def client_factory(self):
+        return LocalStreamClient(self.address, self.authkey)
+
+
+class LocalStreamClient:
+    """Picklable factory returning a proxy to a LocalStreamServer's stream"""
+
+    def __init__(self, address, authkey):
+        self.address = address
+        self.authkey = authkey
+
+    def __call__(self):
+        manager = _StreamClientManager(address=self.address, authkey=self.authkey)
+        manager.connect()
+        return manager.stream()
+
+
+class BotoClientFactory:
+    """Picklable factory for a real Kinesis client in each worker"""
+
+    def __init__(self, region_name=None):
+        self.region_name = region_name
+
+    def __call__(self):
+        import boto3
+        return boto3.client('kinesis', region_name=self.region_name)
+
+
+def _demo(args):
+    """Produce into a local stream, reshard mid-run, and check every record is consumed once"""
+    from local_kinesis import LocalKinesisStream
+    from sessionizer import generate_benchmark_events
+
+    stream = LocalKinesisStream(shard_count=args.shards)
+    server = LocalStreamServer(stream)
+    events = generate_benchmark_events(args.events)
+
+    def produce():
+        half = len(events) // 2
+        for i in range(0, len(events), 500):
+            batch = events[i:i + 500]
+            stream.put_records([{'Data': json.dumps(e), 'PartitionKey': e['user_id']} for e in batch])
+            if i <= half < i + 500:
+                first = stream.open_shards()[0]
+                stream.split_shard(first.shard_id, str((first.starting_hash_key + first.ending_hash_key) // 2))
+                print(f"✂️  Split {first.shard_id}")
+            time.sleep(0.01)
+        shards = sorted(stream.open_shards(), key=lambda s: s.starting_hash_key)
+        for left, right in zip(shards, shards[1:]):
+            if left.ending_hash_key + 1 == right.starting_hash_key:
+                stream.merge_shards(left.shard_id, right.shard_id)
+                print(f"🔗 Merged {left.shard_id} + {right.shard_id}")
+                break
+
+    counts = {}
+
+    def on_result(stats):
+        for event_type, count in (stats['result'] or {}).items():
+            counts[event_type] = counts.get(event_type, 0) + count
+
+    checkpoints = create_checkpoint_store(args.checkpoints)
+    consumer = ShardConsumer(
+        server.client_factory(), stream.stream_name, EventCounter, checkpoints, max_workers=args.workers,
+        lease_seconds=args.lease or 2, scan_interval=1.0, idle_seconds=0.2, on_result=on_result
+    )
+
+    def caught_up():
+        # Workers that hold their shard only report at shutdown, so watch the checkpoints instead
+        if producer.is_alive():
+            return False
+        done = checkpoints.all()
+        return all(done.get(shard.shard_id, (None,))[0] == shard.records[-1]['SequenceNumber']
+                   for shard in stream.shards if shard.records)
+
+    producer = threading.Thread(target=produce)
+    producer.start()
+    summary = consumer.run(duration=args.duration, until=caught_up)
+    producer.join()
+    print(json.dumps({k: v for k, v in summary.items() if k != 'shards'}, indent=2))
+    print(f"📊 Consumed {sum(counts.values())} of {len(events)} events: {counts}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Parallel Kinesis shard consumer')
+    parser.add_argument('--stream', default='clickstream-demo-stream', help='Stream to consume (real Kinesis)')
+    parser.add_argument('--region', default=None)
+    parser.add_argument('--checkpoints', default='checkpoints', help='Checkpoint directory or .db file')
+    parser.add_argument('--workers', type=int, default=None, help='Worker processes (default: CPU count)')
+    parser.add_argument('--lease', type=float, default=None, help='Seconds a worker holds a shard when shards outnumber workers (default 60, 2 for --demo)')
+    parser.add_argument('--duration', type=float, default=None, help='Stop after this many seconds')
+    parser.add_argument('--operator', choices=['count', 'sessions'], default='count')
+    parser.add_argument('--demo', action='store_true', help='Run against a local stream with a split and a merge')
+    parser.add_argument('--shards', type=int, default=4, help='Shards for --demo')
+    parser.add_argument('--events', type=int, default=20000, help='Events for --demo')
+    args = parser.parse_args()
+
+    if args.demo:
+        _demo(args)
+    else:
+        consumer = ShardConsumer(
+            BotoClientFactory(args.region), args.stream,
+            EventCounter if args.operator == 'count' else SessionProcessor,
+            create_checkpoint_store(args.checkpoints), max_workers=args.workers, lease_seconds=args.lease or 60,
+            on_result=lambda stats: print(f"📦 {stats['shard_id']}: {stats['records']} records ({stats['reason']}) {stats['result']}")
+        )
+        print(f"🚀 Consuming {args.stream} with checkpoints in {args.checkpoints}")
+        print(json.dumps(consumer.run(duration=args.duration), indent=2))
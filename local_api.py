@@ -1,12 +1,99 @@
-from flask import Flask, request, jsonify
-from datetime import datetime
+from flask import Flask, request, jsonify, g, Response
+from datetime import datetime, timezone
 import json
+import time
+import zlib
 import os
 
+from funnel import FunnelEngine
+from sketches import SketchStore
+from rollups import RollupStore
+from event_index import EventIndex
+from instrumentation import Instrumentation, SamplingProfiler
+from dedup import EventDeduplicator
+from admission import AdmissionController
+from bulk import BulkReader, is_ndjson, NDJSON_CONTENT_TYPES
+from wire import decode_records, media_type, supported_types, WireFormatError, UnsupportedContentType, JSON_TYPE
+from anomaly import VolumeAnomalyDetector
+from enrichment import create_enricher
+from local_firehose import create_firehose
+from snapshots import EventStore, create_snapshot_manager
+
 app = Flask(__name__)
 
-# Store events in memory for testing
-events_buffer = []
+# Ingested events: memory-mapped snapshot segments, then the in-memory tail
+events_buffer = EventStore()
+
+# Per-session conversion funnel, updated inline with ingest
+funnel = FunnelEngine()
+
+# Constant-memory unique users/sessions and top-K items per hour
+sketches = SketchStore()
+
+# Per-second/minute/hour series for dashboard charts
+rollups = RollupStore()
+
+# Posting lists from user_id/session_id/event_type to events_buffer offsets
+index = EventIndex()
+
+# Per-minute volume baselines (overall and per event_type); alerts on drops/spikes
+volume = VolumeAnomalyDetector(on_alert=lambda alert: print(f"🚨 Volume {alert['kind']}: {alert}"))
+
+# Product/country/user-agent dimensions from a local reference store, LRU/TTL cached
+enricher = create_enricher(
+    cache_size=int(os.environ.get('ENRICHMENT_CACHE_SIZE', 10000)),
+    ttl=float(os.environ.get('ENRICHMENT_TTL_SECONDS', 300)),
+    refresh_seconds=float(os.environ.get('ENRICHMENT_REFRESH_SECONDS', 60))
+)
+
+# Drop client retries (same event_id) seen in the last hour, in bounded memory
+deduplicator = EventDeduplicator(
+    horizon_seconds=int(os.environ.get('DEDUP_HORIZON_SECONDS', 3600)),
+    fp_rate=float(os.environ.get('DEDUP_FP_RATE', 1e-5))
+)
+
+# Stage latency histograms, counters and an on-demand sampling profiler
+instrumentation = Instrumentation()
+profiler = SamplingProfiler()
+
+# Per-client token buckets and an in-flight cap; 429 + Retry-After when exceeded
+admission = AdmissionController(
+    records_per_second=float(os.environ.get('ADMISSION_RECORDS_PER_SECOND', 500)),
+    max_in_flight=int(os.environ.get('ADMISSION_MAX_IN_FLIGHT', 16)),
+    target_latency=float(os.environ.get('ADMISSION_TARGET_LATENCY_MS', 1000)) / 1000
+)
+# /events/bulk batches draw on a separate, larger per-client budget (the in-flight cap stays shared)
+bulk_admission = AdmissionController(
+    records_per_second=float(os.environ.get('ADMISSION_BULK_RECORDS_PER_SECOND', 5000)),
+    max_in_flight=0,
+    target_latency=float(os.environ.get('ADMISSION_TARGET_LATENCY_MS', 1000)) / 1000
+)
+
+# Periodic snapshots of events and aggregates plus an event log, for fast restarts
+persistence = create_snapshot_manager(
+    interval_seconds=float(os.environ.get('SNAPSHOT_INTERVAL_SECONDS', 300)),
+    min_events=int(os.environ.get('SNAPSHOT_MIN_EVENTS', 10000)),
+    fsync=os.environ.get('SNAPSHOT_FSYNC', '').lower() in ('1', 'true', 'yes')
+)
+
+# Optional offline delivery to a Firehose-style clickstream-data/ tree
+firehose = create_firehose(
+    os.environ['LOCAL_FIREHOSE_DIR'],
+    buffer_seconds=float(os.environ.get('LOCAL_FIREHOSE_BUFFER_SECONDS', 60)),
+    buffer_mb=float(os.environ.get('LOCAL_FIREHOSE_BUFFER_MB', 5)),
+    compression=os.environ.get('LOCAL_FIREHOSE_COMPRESSION', 'gzip')
+) if os.environ.get('LOCAL_FIREHOSE_DIR') else None
+
+@app.before_request
+def start_request_timer():
+    g.request_start_ns = time.perf_counter_ns()
+
+@app.after_request
+def record_request_latency(response):
+    endpoint = request.endpoint or 'unknown'
+    instrumentation.record(endpoint, time.perf_counter_ns() - g.request_start_ns, name='request_latency')
+    instrumentation.inc('requests', endpoint=endpoint, status=response.status_code)
+    return response
 
 @app.route('/')
 def home():
@@ -14,55 +101,356 @@ def home():
         "status": "running",
         "message": "Clickstream API is ready!",
         "endpoints": {
-            "POST /events": "Send clickstream events",
-            "GET /stats": "View statistics"
+            "POST /events": "Send clickstream events (JSON, or a smaller but slower-to-parse binary batch by Content-Type)",
+            "POST /events/bulk": "Send NDJSON events (optionally gzip); per-line errors",
+            "GET /stats": "View statistics",
+            "GET /funnel": "Conversion funnel per minute/hour",
+            "GET /sketches": "Serialized hourly sketches for merging",
+            "GET /series": "Time series: ?metric=&from=&to=&step=",
+            "GET /users/<user_id>/events": "User timeline: ?from=&to=&event_type=&limit=&cursor=&order=",
+            "GET /sessions/<session_id>": "Session events and summary: ?limit=&cursor=",
+            "GET /anomalies": "Volume baselines and recent drop/spike alerts",
+            "GET /metrics": "Prometheus metrics",
+            "POST /debug/profiler": "Start/stop the sampling profiler"
         }
     })
 
 @app.route('/events', methods=['POST'])
 def receive_events():
+    rejection = admission.enter()
+    if rejection:
+        return reject(rejection)
     try:
-        # Get JSON data from request
-        data = request.get_json()
+        return ingest_events()
+    finally:
+        admission.exit()
+
+def reject(rejection, extra=None):
+    """429 (or 413 for a batch that can never fit) with Retry-After"""
+    instrumentation.inc('rejected', reason=rejection.reason)
+    body = rejection.to_dict()
+    if extra:
+        body.update(extra)
+    response = jsonify(body)
+    if rejection.retry_after is None:
+        response.status_code = 413
+    else:
+        response.status_code = 429
+        response.headers['Retry-After'] = str(rejection.retry_after)
+    return response
+
+def client_id():
+    return request.headers.get('X-Api-Key') or request.remote_addr or 'unknown'
+
+def ingest_events():
+    try:
+        started = time.perf_counter()
+        
+        # Get JSON (default) or a binary batch, by Content-Type
+        with instrumentation.stage('parse'):
+            if media_type(request.content_type) == JSON_TYPE:
+                data = request.get_json()
+            else:
+                try:
+                    data = {'records': decode_records(request.get_data(), request.content_type)}
+                except UnsupportedContentType as e:
+                    return jsonify({"error": str(e), "supported": supported_types()}), 415
+                except WireFormatError as e:
+                    return jsonify({"error": str(e)}), 400
         
         if not data:
             return jsonify({"error": "No data provided"}), 400
         
         events = data.get('records', [])
+        rejection = admission.check_rate(client_id(), max(len(events), 1))
+        if rejection:
+            return reject(rejection)
+        instrumentation.inc('events', len(events))
+        instrumentation.inc('bytes', request.content_length or 0)
         
-        # Process each event
-        for event in events:
-            event['received_at'] = datetime.utcnow().isoformat()
-            events_buffer.append(event)
+        events, duplicates = process_events(events)
         
         # Save after receiving new events
-        save_events()  # <-- This is where save_events() should be called
+        with instrumentation.stage('save_events'):
+            save_events()  # <-- This is where save_events() should be called
+        
+        admission.record_downstream(len(events), latency=time.perf_counter() - started)
         
         print(f"✅ Received {len(events)} events. Total stored: {len(events_buffer)}")
         
         return jsonify({
             'status': 'accepted',
-            'processed': len(events)
+            'processed': len(events),
+            'duplicates': len(duplicates)
         }), 202
         
     except Exception as e:
         print(f"❌ Error: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
+def process_events(events):
+    """Dedup, enrich, buffer, log, index, deliver and aggregate one batch: (accepted, duplicates)"""
+    # One batch at a time, so a snapshot sees events and aggregates that agree
+    with persistence.lock:
+        with instrumentation.stage('dedup'):
+            # Ids are remembered only once the batch is delivered, so a retry after an error is not dropped
+            events, duplicates = deduplicator.filter_events(events, commit=False)
+        instrumentation.inc('duplicates', len(duplicates))
+        
+        # Process each event
+        with instrumentation.stage('enrich'):
+            received_at = datetime.utcnow().isoformat()
+            for event in events:
+                event['received_at'] = received_at
+            enricher.enrich(events)
+        instrumentation.gauge('enrichment_cache_hit_ratio', round(enricher.hit_ratio(), 4))
+        
+        with instrumentation.stage('buffer_append'):
+            first_offset = len(events_buffer)
+            events_buffer.extend(events)
+        
+        with instrumentation.stage('log'):
+            persistence.append(events)
+        
+        with instrumentation.stage('index'):
+            index.add_many(first_offset, events)
+        
+        if firehose:
+            with instrumentation.stage('firehose'):
+                firehose.put_events(events)
+        deduplicator.commit(events)
+        
+        with instrumentation.stage('aggregate'):
+            for event in events:
+                funnel.process(event)
+                sketches.update(event)
+                rollups.update(event)
+                volume.observe(event.get('event_type'))
+    return events, duplicates
+
+@app.route('/events/bulk', methods=['POST'])
+def receive_bulk_events():
+    rejection = admission.enter()
+    if rejection:
+        return reject(rejection)
+    try:
+        return ingest_bulk()
+    finally:
+        admission.exit()
+
+def ingest_bulk():
+    """NDJSON body (optionally gzip), parsed and processed in batches as it is read"""
+    if not is_ndjson(request.content_type):
+        return jsonify({"error": f"Expected one of {', '.join(NDJSON_CONTENT_TYPES)}"}), 415
+    
+    started = time.perf_counter()
+    reader = BulkReader(
+        request.stream,
+        content_encoding=request.headers.get('Content-Encoding'),
+        batch_size=int(os.environ.get('BULK_BATCH_SIZE', 500))
+    )
+    processed = 0
+    duplicates = 0
+    rejection = None
+    resume_line = None
+    error = None
+    try:
+        for batch in reader.batches():
+            rejection = bulk_admission.check_rate(client_id(), len(batch))
+            if rejection:
+                # Stop reading; the client resends from this line after Retry-After
+                resume_line = batch[0][0]
+                break
+            events = [record for _, record in batch]
+            instrumentation.inc('events', len(events))
+            events, dropped = process_events(events)
+            processed += len(events)
+            duplicates += len(dropped)
+    except (ValueError, zlib.error) as e:
+        # Batches before the bad bytes are already in; say how far we got
+        error = f"Unreadable body: {e}"
+    instrumentation.inc('bytes', request.content_length or 0)
+    
+    if processed:
+        with instrumentation.stage('save_events'):
+            save_events()
+        latency = time.perf_counter() - started
+        admission.record_downstream(processed, latency=latency)
+        bulk_admission.record_downstream(processed, latency=latency)
+    
+    print(f"✅ Bulk: {processed} events from {reader.lines} lines ({reader.invalid} invalid). Total stored: {len(events_buffer)}")
+    
+    result = reader.summary()
+    result.update({'status': 'accepted', 'processed': processed, 'duplicates': duplicates})
+    if error:
+        result.update({'status': 'partial' if processed else 'failed', 'error': error})
+        return jsonify(result), 400
+    if rejection:
+        result['status'] = 'partial'
+        result['resume_from_line'] = resume_line
+        return reject(rejection, result)
+    return jsonify(result), 202
+
 @app.route('/stats', methods=['GET'])
 def get_stats():
-    # Calculate some basic statistics
-    event_types = {}
-    for event in events_buffer:
-        event_type = event.get('event_type', 'unknown')
-        event_types[event_type] = event_types.get(event_type, 0) + 1
+    # Counts per type come from the index, not a scan of every event
+    event_types = {event_type: posting_list.count for event_type, posting_list in index.postings['event_type'].items()}
+    untyped = len(events_buffer) - sum(event_types.values())
+    if untyped:
+        event_types['unknown'] = event_types.get('unknown', 0) + untyped
     
     return jsonify({
         'total_events': len(events_buffer),
         'events_by_type': event_types,
+        'funnel': funnel.summary(),
+        'dedup': deduplicator.summary(),
+        'admission': admission.summary(),
+        'bulk_admission': bulk_admission.summary(),
+        'anomalies': volume.summary()['active_alerts'],
+        'firehose': firehose.summary() if firehose else None,
+        'index': index.summary(),
+        'enrichment': enricher.summary(),
+        'persistence': persistence.summary(),
+        'sketches': {
+            'all_time': sketches.all_time.summary(),
+            'last_24h': sketches.rollup(start=time.time() - 86400).summary()
+        },
         'recent_events': events_buffer[-5:] if events_buffer else []
     })
 
+@app.route('/funnel', methods=['GET'])
+def get_funnel():
+    """Funnel totals plus per-minute or per-hour series"""
+    resolution = request.args.get('resolution', 'minute')
+    limit = request.args.get('limit', 60, type=int)
+
+    try:
+        series = funnel.series(resolution, limit)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    summary = funnel.summary()
+    summary['resolution'] = resolution
+    summary['series'] = series
+    return jsonify(summary)
+
+@app.route('/sketches', methods=['GET'])
+def get_sketches():
+    """Serialized sketches so other shards or daily rollups can merge them"""
+    return jsonify(sketches.to_dict())
+
+@app.route('/anomalies', methods=['GET'])
+def get_anomalies():
+    """Per-minute volume baselines, active alerts and recent alert history"""
+    volume.tick()
+    return jsonify(volume.summary())
+
+@app.route('/series', methods=['GET'])
+def get_series():
+    """Pre-aggregated time series; from/to are epoch seconds or ISO timestamps"""
+    metric = request.args.get('metric', 'events')
+    try:
+        start = parse_time_arg(request.args.get('from'))
+        end = parse_time_arg(request.args.get('to'))
+        step = request.args.get('step', type=int)
+        if metric not in ('events', 'revenue', 'active_users') and not metric.startswith('events.'):
+            return jsonify({"error": f"Unknown metric {metric}", "metrics": rollups.metrics()}), 400
+        return jsonify(rollups.query(metric, start, end, step))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+@app.route('/users/<user_id>/events', methods=['GET'])
+def get_user_events(user_id):
+    """A user's events from the secondary index, paged by offset cursor"""
+    where = {'event_type': request.args['event_type']} if request.args.get('event_type') else None
+    try:
+        return jsonify(timeline('user_id', user_id, where))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+@app.route('/sessions/<session_id>', methods=['GET'])
+def get_session(session_id):
+    """One session's events in arrival order, plus its span and event counts"""
+    if not index.count('session_id', session_id):
+        return jsonify({"error": f"Unknown session {session_id}"}), 404
+    try:
+        result = timeline('session_id', session_id)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    events = result['events']
+    times = [index.event_ts(event) for event in events]
+    counts = {}
+    for event in events:
+        event_type = event.get('event_type', 'unknown')
+        counts[event_type] = counts.get(event_type, 0) + 1
+    result['session'] = {
+        'user_id': events[0].get('user_id') if events else None,
+        'first_event': min(times) if times else None,
+        'last_event': max(times) if times else None,
+        'duration_seconds': round(max(times) - min(times), 3) if times else 0,
+        'events_by_type': counts
+    }
+    return jsonify(result)
+
+def timeline(field, value, where=None):
+    """One page of indexed events; from/to filter on event time, cursor is the last offset seen"""
+    start = parse_time_arg(request.args.get('from'))
+    end = parse_time_arg(request.args.get('to'))
+    cursor = request.args.get('cursor', type=int)
+    limit = min(max(request.args.get('limit', 100, type=int), 1), 1000)
+    descending = request.args.get('order', 'asc') == 'desc'
+
+    started = time.perf_counter()
+    page, next_cursor = index.lookup(events_buffer, field, value, start, end, cursor, limit, descending, where)
+    return {
+        field: value,
+        'total': index.count(field, value),
+        'returned': len(page),
+        'next_cursor': next_cursor,
+        'lookup_ms': round((time.perf_counter() - started) * 1000, 3),
+        'events': [event for _, event in page]
+    }
+
+def parse_time_arg(value):
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        dt = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        if dt.tzinfo is None:
+            dt = dt.replace(tzinfo=timezone.utc)
+        return dt.timestamp()
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus text-format metrics"""
+    return Response(instrumentation.render_prometheus(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/debug/profiler', methods=['GET', 'POST'])
+def debug_profiler():
+    """Toggle the sampling profiler (action=start|stop|reset) or dump collapsed stacks"""
+    action = request.args.get('action', 'status')
+    
+    if action == 'start':
+        profiler.start()
+    elif action == 'stop':
+        profiler.stop()
+    elif action == 'reset':
+        profiler.reset()
+    elif action == 'dump':
+        return Response(profiler.collapsed(request.args.get('limit', 50, type=int)), mimetype='text/plain')
+    elif action != 'status':
+        return jsonify({"error": f"Unknown action: {action}"}), 400
+    
+    return jsonify({
+        'running': profiler.running,
+        'samples': profiler.samples,
+        'distinct_stacks': len(profiler.stacks),
+        'instrumentation': instrumentation.overhead()
+    })
+
 @app.route('/export', methods=['GET'])
 def export_data():
     """Export events in different formats"""
@@ -73,7 +461,7 @@ def export_data():
         export_data = {
             'export_timestamp': datetime.utcnow().isoformat(),
             'total_events': len(events_buffer),
-            'events': events_buffer
+            'events': list(events_buffer)
         }
         
         # Save to file
@@ -90,9 +478,9 @@ def export_data():
     elif format_type == 'ndjson':
         # Newline-delimited JSON (better for streaming)
         filename = f'clickstream_export_{datetime.now().strftime("%Y%m%d_%H%M%S")}.ndjson'
-        with open(filename, 'w') as f:
-            for event in events_buffer:
-                f.write(json.dumps(event) + '\n')
+        with open(filename, 'wb') as f:
+            for line in events_buffer.iter_json():
+                f.write(line + b'\n')
         
         return jsonify({
             'status': 'exported',
@@ -101,21 +489,63 @@ def export_data():
         })
 
 def save_events():
-    """Save events to file"""
-    with open('events_backup.json', 'w') as f:
-        json.dump(events_buffer, f)
-    # Don't call save_events() here - that would be infinite recursion!
+    """Flush the event log; snapshots are written in the background"""
+    persistence.flush()
+
+def snapshot_state():
+    """Aggregates saved with each snapshot, restored instead of recomputed"""
+    return {
+        'funnel': funnel,
+        'sketches': sketches,
+        'rollups': rollups,
+        'index': index,
+        'deduplicator': deduplicator
+    }
+
+def replay(batch):
+    """Re-apply logged events to the buffer and aggregates (already deduped and enriched)"""
+    deduplicator.filter_events(batch)  # Resent batches stay duplicates after a restart
+    index.add_many(len(events_buffer), batch)
+    events_buffer.extend(batch)
+    for event in batch:
+        funnel.process(event)
+        sketches.update(event)
+        rollups.update(event)
 
 def load_events():
-    """Load events from file"""
-    global events_buffer
-    if os.path.exists('events_backup.json'):
+    """Map the latest snapshot and replay the event log written after it"""
+    global events_buffer, funnel, sketches, rollups, index, deduplicator
+    started = time.perf_counter()
+    store, state, tail = persistence.recover()
+    if state:
+        funnel, sketches, rollups, index, deduplicator = (
+            state['funnel'], state['sketches'], state['rollups'], state['index'], state['deduplicator']
+        )
+    events_buffer = store
+    for batch in tail:
+        replay(batch)
+    if state or events_buffer:
+        print(f"📥 Recovered {len(events_buffer)} events ({persistence.stats['replayed_events']} from the log) "
+              f"in {time.perf_counter() - started:.2f}s")
+    elif os.path.exists('events_backup.json'):
+        # One-time migration from the old whole-buffer JSON backup
         with open('events_backup.json', 'r') as f:
-            events_buffer = json.load(f)
-            print(f"📥 Loaded {len(events_buffer)} events from backup")
+            backup = json.load(f)
+        for start in range(0, len(backup), 10000):
+            batch = backup[start:start + 10000]
+            replay(batch)
+            persistence.append(batch)
+        persistence.snapshot(events_buffer, snapshot_state, force=True)
+        print(f"📥 Loaded {len(events_buffer)} events from backup into {persistence.directory}")
 
 if __name__ == '__main__':
     print("🚀 Starting Clickstream API on http://localhost:3000")
     print("📊 View stats at http://localhost:3000/stats")
-    load_events()  # Load previous events when starting
+    load_events()  # Map the last snapshot and replay the log tail
+    persistence.start(events_buffer, snapshot_state)  # Snapshot every SNAPSHOT_INTERVAL_SECONDS
+    volume.start()  # Close silent minutes so outages alert too
+    enricher.start()  # Bulk-refresh cached dimension rows before they expire
+    if firehose:
+        firehose.start()
+        print(f"🚚 Delivering to {firehose.root}/{firehose.prefix}")
     app.run(debug=True, port=3000)
\ No newline at end of file
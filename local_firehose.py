@@ -0,0 +1,304 @@
+import os
+import gzip
+import json
+import time
+import uuid
+import argparse
+import threading
+from datetime import datetime, timezone
+
+from event_sources import event_time
+from watermarks import LocalManifestStore, WatermarkManifest, partition_path
+
+try:
+    import zstandard
+except ImportError:  # zstd is optional; gzip matches the deployed stream
+    zstandard = None
+
+MB = 1024 * 1024
+MAX_BATCH_RECORDS = 500   # put_record_batch limit
+MAX_RECORD_BYTES = 1000 * 1024
+
+
+def compress(data, compression):
+    if compression == 'gzip':
+        return gzip.compress(data), '.gz'
+    if compression == 'zstd':
+        if zstandard is None:
+            raise RuntimeError('zstandard is required for zstd compression')
+        return zstandard.ZstdCompressor(level=3).compress(data), '.zst'
+    if compression in (None, 'none', 'uncompressed'):
+        return data, ''
+    raise ValueError(f'Unknown compression {compression}')
+
+
+class LocalFirehose:
+    """In-process stand-in for the clickstream Firehose delivery stream
+
+    Mirrors aws_kinesis_firehose_delivery_stream.clickstream_firehose: one
+    buffer flushed when it reaches `buffer_mb` or its oldest record is
+    `buffer_seconds` old, objects written under
+    clickstream-data/year=/month=/day=/hour= of the oldest record's arrival
+    time, records concatenated back-to-back as Firehose does. An optional
+    transform(data) -> bytes | None plays the part of a transformation
+    Lambda: None drops the record, an exception sends it to the error prefix.
+    """
+
+    def __init__(self, root, name='clickstream-demo-firehose', prefix='clickstream-data/',
+                 error_prefix='clickstream-errors/', buffer_seconds=60, buffer_mb=5, compression='gzip',
+                 transform=None, manifest=None, clock=time.time):
+        self.root = root
+        self.name = name
+        self.prefix = prefix
+        self.error_prefix = error_prefix
+        self.buffer_seconds = buffer_seconds
+        self.buffer_bytes = int(buffer_mb * MB)
+        self.compression = compression
+        self.transform = transform
+        self.manifest = manifest  # Optional watermarks.WatermarkManifest for the raw table
+        self.clock = clock
+        compress(b'', compression)  # Fail fast on an unusable codec
+
+        self._buffer = []
+        self._buffer_size = 0
+        self._oldest_arrival = None
+        self._lock = threading.Lock()
+        self._timer = None
+        self._stop = threading.Event()
+        self.started_at = clock()
+        self.stats = {
+            'records_in': 0, 'bytes_in': 0, 'records_delivered': 0, 'records_dropped': 0,
+            'records_failed': 0, 'objects_written': 0, 'bytes_written': 0,
+            'flushes': {'size': 0, 'interval': 0, 'forced': 0}
+        }
+
+    def put_record(self, Record, DeliveryStreamName=None):
+        response = self.put_record_batch([Record])
+        return response['RequestResponses'][0]
+
+    def put_record_batch(self, Records, DeliveryStreamName=None):
+        """Same request/response shape as firehose.put_record_batch"""
+        if len(Records) > MAX_BATCH_RECORDS:
+            raise ValueError(f'put_record_batch accepts at most {MAX_BATCH_RECORDS} records')
+        now = self.clock()
+        responses = []
+        failed = 0
+        flush_needed = False
+        with self._lock:
+            for record in Records:
+                data = record['Data']
+                if isinstance(data, str):
+                    data = data.encode('utf-8')
+                if len(data) > MAX_RECORD_BYTES:
+                    failed += 1
+                    responses.append({'ErrorCode': 'ValidationException',
+                                      'ErrorMessage': 'Record size exceeds 1000 KiB'})
+                    continue
+                if self._oldest_arrival is None:
+                    self._oldest_arrival = now
+                self._buffer.append(data)
+                self._buffer_size += len(data)
+                self.stats['records_in'] += 1
+                self.stats['bytes_in'] += len(data)
+                responses.append({'RecordId': uuid.uuid4().hex})
+                if self._buffer_size >= self.buffer_bytes:
+                    flush_needed = True
+        if flush_needed:
+            self.flush('size')
+        else:
+            self.tick(now)
+        return {'FailedPutCount': failed, 'Encrypted': False, 'RequestResponses': responses}
+
+    def put_events(self, events):
+        """Convenience for in-process producers: JSON-encode events and buffer them"""
+        for i in range(0, len(events), MAX_BATCH_RECORDS):
+            self.put_record_batch([{'Data': json.dumps(e)} for e in events[i:i + MAX_BATCH_RECORDS]])
+
+    def tick(self, now=None):
+        """Flush if the buffer interval has elapsed; call periodically or use start()"""
+        now = self.clock() if now is None else now
+        oldest = self._oldest_arrival
+        if oldest is not None and now - oldest >= self.buffer_seconds:
+            self.flush('interval')
+
+    def flush(self, reason='forced'):
+        """Deliver the current buffer as one object; returns its path or None"""
+        with self._lock:
+            if not self._buffer:
+                return None
+            buffer, self._buffer = self._buffer, []
+            self._buffer_size = 0
+            arrival, self._oldest_arrival = self._oldest_arrival, None
+
+        records, failed, dropped, max_ts = self._apply_transform(buffer)
+        arrived = datetime.fromtimestamp(arrival, timezone.utc)
+        path = None
+        if records:
+            partition = partition_path(arrived)
+            path = self._write(f'{self.prefix}{partition}/', arrived, records)
+            if self.manifest is not None:
+                max_event_time = datetime.fromtimestamp(max_ts, timezone.utc).isoformat() if max_ts else None
+                self.manifest.record_partition(partition, len(records), max_event_time, os.path.getsize(path))
+        if failed:
+            error_dir = f'{self.error_prefix}processing-failed/{arrived:%Y/%m/%d/%H}/'
+            self._write(error_dir, arrived, [json.dumps(f).encode('utf-8') for f in failed], errors=True)
+
+        with self._lock:
+            self.stats['records_delivered'] += len(records)
+            self.stats['records_failed'] += len(failed)
+            self.stats['records_dropped'] += dropped
+            self.stats['flushes'][reason] += 1
+        return path
+
+    def _apply_transform(self, buffer):
+        records = []
+        failed = []
+        max_ts = None
+        dropped = 0
+        for data in buffer:
+            if self.transform is not None:
+                try:
+                    data = self.transform(data)
+                except Exception as e:
+                    failed.append({'errorCode': 'Lambda.FunctionError', 'errorMessage': str(e),
+                                   'rawData': data.decode('utf-8', 'replace')})
+                    continue
+                if data is None:
+                    dropped += 1
+                    continue
+                if isinstance(data, str):
+                    data = data.encode('utf-8')
+            records.append(data)
+            try:
+                ts = event_time(json.loads(data))
+            except (ValueError, AttributeError):
+                ts = None
+            if ts is not None and (max_ts is None or ts > max_ts):
+                max_ts = ts
+        return records, failed, dropped, max_ts
+
+    def _write(self, key_prefix, arrived, records, errors=False):
+        body, extension = compress(b'\n'.join(records) if errors else b''.join(records), self.compression)
+        name = f'{self.name}-1-{arrived:%Y-%m-%d-%H-%M-%S}-{uuid.uuid4()}{extension}'
+        directory = os.path.join(self.root, key_prefix)
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, name)
+        tmp_path = os.path.join(directory, f'.{name}.tmp')
+        with open(tmp_path, 'wb') as f:
+            f.write(body)
+        os.replace(tmp_path, path)
+        if not errors:
+            with self._lock:
+                self.stats['objects_written'] += 1
+                self.stats['bytes_written'] += len(body)
+        return path
+
+    def start(self, interval=1.0):
+        """Background thread that applies the time-based flush"""
+        if self._timer is not None:
+            return
+        self._stop.clear()
+
+        def run():
+            while not self._stop.wait(interval):
+                self.tick()
+
+        self._timer = threading.Thread(target=run, name=f'{self.name}-flush', daemon=True)
+        self._timer.start()
+
+    def close(self):
+        """Stop the timer and deliver whatever is still buffered"""
+        if self._timer is not None:
+            self._stop.set()
+            self._timer.join()
+            self._timer = None
+        return self.flush('forced')
+
+    def summary(self):
+        elapsed = max(self.clock() - self.started_at, 1e-9)
+        summary = dict(self.stats)
+        summary['flushes'] = dict(self.stats['flushes'])
+        summary.update({
+            'buffered_records': len(self._buffer),
+            'buffered_bytes': self._buffer_size,
+            'records_per_second': self.stats['records_in'] / elapsed,
+            'mb_per_second': self.stats['bytes_in'] / MB / elapsed,
+            'compression_ratio': self.stats['bytes_in'] / self.stats['bytes_written'] if self.stats['bytes_written'] else None
+        })
+        return summary
+
+
+def deliver_from_kinesis(stream, firehose, batch_size=500, follow=False, poll_interval=1.0):
+    """Pump every shard of a (local) Kinesis stream into the delivery stream, as the
+    kinesis_source_configuration does; returns the number of records moved"""
+    shard_ids = [s['ShardId'] for s in stream.list_shards()['Shards']]
+    iterators = {
+        shard_id: stream.get_shard_iterator(ShardId=shard_id, ShardIteratorType='TRIM_HORIZON')['ShardIterator']
+        for shard_id in shard_ids
+    }
+    moved = 0
+    while iterators:
+        got_records = False
+        for shard_id in list(iterators):
+            response = stream.get_records(ShardIterator=iterators[shard_id], Limit=batch_size)
+            records = response['Records']
+            if records:
+                got_records = True
+                firehose.put_record_batch([{'Data': r['Data']} for r in records])
+                moved += len(records)
+            if response.get('NextShardIterator'):
+                iterators[shard_id] = response['NextShardIterator']
+            else:
+                del iterators[shard_id]
+        if not got_records:
+            if not follow:
+                break
+            firehose.tick()
+            time.sleep(poll_interval)
+    return moved
+
+
+def create_firehose(root, **kwargs):
+    """Local delivery stream that also keeps the clickstream-data watermark manifest"""
+    manifest = WatermarkManifest(LocalManifestStore(root), kwargs.get('prefix', 'clickstream-data/'))
+    return LocalFirehose(root, manifest=manifest, **kwargs)
+
+
+if __name__ == '__main__':
+    from event_sources import iter_replay_file
+
+    parser = argparse.ArgumentParser(description='Deliver clickstream events to a local Firehose-style directory tree')
+    parser.add_argument('source', help='Replay file or directory (export, snapshot directory, NDJSON)')
+    parser.add_argument('--root', default='./data/raw', help='Destination "bucket" directory')
+    parser.add_argument('--buffer-seconds', type=float, default=60, help='Buffering interval')
+    parser.add_argument('--buffer-mb', type=float, default=5, help='Buffering size')
+    parser.add_argument('--compression', default='gzip', choices=['gzip', 'zstd', 'none'])
+    parser.add_argument('--via-kinesis', type=int, metavar='SHARDS', help='Route through a local Kinesis stream first')
+
+    args = parser.parse_args()
+
+    firehose = create_firehose(args.root, buffer_seconds=args.buffer_seconds, buffer_mb=args.buffer_mb,
+                               compression=args.compression)
+    events = list(iter_replay_file(args.source))
+    print(f"🚚 Delivering {len(events)} events to {args.root}")
+
+    start = time.perf_counter()
+    if args.via_kinesis:
+        from local_kinesis import LocalKinesisStream
+        stream = LocalKinesisStream(shard_count=args.via_kinesis)
+        for i in range(0, len(events), 500):
+            stream.put_records(Records=[
+                {'Data': json.dumps(e), 'PartitionKey': e.get('user_id', 'anonymous')} for e in events[i:i + 500]
+            ])
+        deliver_from_kinesis(stream, firehose)
+    else:
+        firehose.put_events(events)
+    firehose.close()
+    elapsed = time.perf_counter() - start
+
+    summary = firehose.summary()
+    print(f"✅ {summary['records_delivered']} records in {summary['objects_written']} objects "
+          f"({elapsed:.2f}s, {summary['records_delivered'] / max(elapsed, 1e-9):,.0f} records/s)")
+    print(f"📦 {summary['bytes_in']:,} → {summary['bytes_written']:,} bytes"
+          + (f" ({summary['compression_ratio']:.1f}x)" if summary['compression_ratio'] else ''))
+    print(f"🔁 Flushes: {summary['flushes']}")
@@ -0,0 +1,260 @@
+import time
+import hashlib
+import threading
+from datetime import datetime, timezone
+
+MAX_HASH_KEY = 2 ** 128 - 1
+
+
+class ProvisionedThroughputExceededException(Exception):
+    """Raised by put_record when a shard's write limit is exceeded"""
+
+
+def partition_key_hash(partition_key):
+    """Kinesis maps partition keys to the 128-bit MD5 hash key space"""
+    return int.from_bytes(hashlib.md5(partition_key.encode('utf-8')).digest(), 'big')
+
+
+class LocalShard:
+    """One shard: a hash key range and an append-only record log"""
+
+    def __init__(self, shard_id, starting_hash_key, ending_hash_key, max_records=None):
+        self.shard_id = shard_id
+        self.starting_hash_key = starting_hash_key
+        self.ending_hash_key = ending_hash_key
+        self.max_records = max_records
+        self.records = []
+        self.trimmed = 0  # Number of records dropped from the front by retention
+        self.closed = False
+        self.parent_shard_id = None
+        self.adjacent_parent_shard_id = None
+        # Per-second write accounting for throttling
+        self._window_second = 0
+        self._window_records = 0
+        self._window_bytes = 0
+
+    def contains(self, hash_key):
+        return self.starting_hash_key <= hash_key <= self.ending_hash_key
+
+    def describe(self):
+        shard = {
+            'ShardId': self.shard_id,
+            'HashKeyRange': {
+                'StartingHashKey': str(self.starting_hash_key),
+                'EndingHashKey': str(self.ending_hash_key)
+            },
+            'SequenceNumberRange': {
+                'StartingSequenceNumber': self.records[0]['SequenceNumber'] if self.records else '0'
+            }
+        }
+        if self.closed and self.records:
+            shard['SequenceNumberRange']['EndingSequenceNumber'] = self.records[-1]['SequenceNumber']
+        if self.parent_shard_id:
+            shard['ParentShardId'] = self.parent_shard_id
+        if self.adjacent_parent_shard_id:
+            shard['AdjacentParentShardId'] = self.adjacent_parent_shard_id
+        return shard
+
+
+class LocalKinesisStream:
+    """In-process stand-in for a Kinesis data stream with a boto3-shaped API
+
+    Records are routed to shards by MD5 of the partition key (or an explicit
+    hash key), so key skew behaves like the real service. Optional per-shard
+    write limits reproduce ProvisionedThroughputExceeded failures.
+    """
+
+    def __init__(self, stream_name='clickstream-demo-stream', shard_count=1,
+                 max_records_per_shard=None, write_limit_records=None, write_limit_bytes=None):
+        self.stream_name = stream_name
+        self.max_records_per_shard = max_records_per_shard
+        self.write_limit_records = write_limit_records  # Real limit: 1000 records/s per shard
+        self.write_limit_bytes = write_limit_bytes      # Real limit: 1 MB/s per shard
+        self.shards = []
+        self._next_shard_number = 0
+        self._sequence = 0
+        self._lock = threading.Lock()
+
+        step = (MAX_HASH_KEY + 1) // shard_count
+        for i in range(shard_count):
+            start = i * step
+            end = MAX_HASH_KEY if i == shard_count - 1 else (i + 1) * step - 1
+            self._add_shard(start, end)
+
+    def _add_shard(self, start, end):
+        shard = LocalShard(f'shardId-{self._next_shard_number:012d}', start, end, self.max_records_per_shard)
+        self._next_shard_number += 1
+        self.shards.append(shard)
+        return shard
+
+    def _get_shard(self, shard_id):
+        for shard in self.shards:
+            if shard.shard_id == shard_id:
+                return shard
+        raise KeyError(f'Shard {shard_id} not found')
+
+    def open_shards(self):
+        return [s for s in self.shards if not s.closed]
+
+    def _route(self, hash_key):
+        for shard in self.shards:
+            if not shard.closed and shard.contains(hash_key):
+                return shard
+        raise ValueError(f'No open shard covers hash key {hash_key}')
+
+    def _throttled(self, shard, size, now):
+        second = int(now)
+        if shard._window_second != second:
+            shard._window_second = second
+            shard._window_records = 0
+            shard._window_bytes = 0
+        if self.write_limit_records is not None and shard._window_records + 1 > self.write_limit_records:
+            return True
+        if self.write_limit_bytes is not None and shard._window_bytes + size > self.write_limit_bytes:
+            return True
+        shard._window_records += 1
+        shard._window_bytes += size
+        return False
+
+    def _append(self, data, partition_key, explicit_hash_key, now):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        hash_key = int(explicit_hash_key) if explicit_hash_key is not None else partition_key_hash(partition_key)
+        shard = self._route(hash_key)
+
+        if self._throttled(shard, len(data) + len(partition_key), now):
+            return {
+                'ErrorCode': 'ProvisionedThroughputExceededException',
+                'ErrorMessage': f'Rate exceeded for shard {shard.shard_id} in stream {self.stream_name}'
+            }
+
+        self._sequence += 1
+        sequence_number = f'{self._sequence:056d}'
+        shard.records.append({
+            'SequenceNumber': sequence_number,
+            'ApproximateArrivalTimestamp': datetime.fromtimestamp(now, timezone.utc),
+            'Data': data,
+            'PartitionKey': partition_key
+        })
+        if shard.max_records and len(shard.records) > shard.max_records:
+            drop = len(shard.records) - shard.max_records
+            del shard.records[:drop]
+            shard.trimmed += drop
+        return {'SequenceNumber': sequence_number, 'ShardId': shard.shard_id}
+
+    def put_record(self, Data, PartitionKey, StreamName=None, ExplicitHashKey=None):
+        with self._lock:
+            result = self._append(Data, PartitionKey, ExplicitHashKey, time.time())
+        if 'ErrorCode' in result:
+            raise ProvisionedThroughputExceededException(result['ErrorMessage'])
+        return result
+
+    def put_records(self, Records, StreamName=None):
+        """Same request/response shape as kinesis.put_records"""
+        now = time.time()
+        results = []
+        with self._lock:
+            for record in Records:
+                results.append(self._append(
+                    record['Data'], record['PartitionKey'], record.get('ExplicitHashKey'), now
+                ))
+        failed = sum(1 for r in results if 'ErrorCode' in r)
+        return {'FailedRecordCount': failed, 'Records': results}
+
+    def split_shard(self, ShardToSplit, NewStartingHashKey, StreamName=None):
+        """Close a shard and hand its hash range to two children, like kinesis.split_shard"""
+        with self._lock:
+            parent = self._get_shard(ShardToSplit)
+            new_start = int(NewStartingHashKey)
+            if parent.closed:
+                raise ValueError(f'Shard {ShardToSplit} is already closed')
+            if not parent.starting_hash_key < new_start <= parent.ending_hash_key:
+                raise ValueError(f'NewStartingHashKey {new_start} is outside shard {ShardToSplit}')
+            parent.closed = True
+            for start, end in ((parent.starting_hash_key, new_start - 1), (new_start, parent.ending_hash_key)):
+                child = self._add_shard(start, end)
+                child.parent_shard_id = parent.shard_id
+
+    def merge_shards(self, ShardToMerge, AdjacentShardToMerge, StreamName=None):
+        """Close two adjacent shards and open one covering both, like kinesis.merge_shards"""
+        with self._lock:
+            shard = self._get_shard(ShardToMerge)
+            adjacent = self._get_shard(AdjacentShardToMerge)
+            if shard.closed or adjacent.closed:
+                raise ValueError('Both shards must be open to merge')
+            if shard.ending_hash_key + 1 != adjacent.starting_hash_key and \
+                    adjacent.ending_hash_key + 1 != shard.starting_hash_key:
+                raise ValueError(f'Shards {ShardToMerge} and {AdjacentShardToMerge} are not adjacent')
+            shard.closed = True
+            adjacent.closed = True
+            child = self._add_shard(
+                min(shard.starting_hash_key, adjacent.starting_hash_key),
+                max(shard.ending_hash_key, adjacent.ending_hash_key)
+            )
+            child.parent_shard_id = shard.shard_id
+            child.adjacent_parent_shard_id = adjacent.shard_id
+
+    def list_shards(self, StreamName=None):
+        with self._lock:
+            return {'Shards': [s.describe() for s in self.shards]}
+
+    def describe_stream(self, StreamName=None):
+        with self._lock:
+            return {'StreamDescription': {
+                'StreamName': self.stream_name,
+                'StreamStatus': 'ACTIVE',
+                'Shards': [s.describe() for s in self.shards],
+                'HasMoreShards': False
+            }}
+
+    def get_shard_iterator(self, ShardId, ShardIteratorType='TRIM_HORIZON', StreamName=None,
+                           StartingSequenceNumber=None):
+        """Iterators are plain 'shard_id:absolute_offset' strings"""
+        with self._lock:
+            shard = self._get_shard(ShardId)
+            if ShardIteratorType == 'TRIM_HORIZON':
+                offset = shard.trimmed
+            elif ShardIteratorType == 'LATEST':
+                offset = shard.trimmed + len(shard.records)
+            elif ShardIteratorType in ('AT_SEQUENCE_NUMBER', 'AFTER_SEQUENCE_NUMBER'):
+                offset = self._offset_of(shard, StartingSequenceNumber)
+                if ShardIteratorType == 'AFTER_SEQUENCE_NUMBER':
+                    offset += 1
+            else:
+                raise ValueError(f'Unsupported iterator type {ShardIteratorType}')
+        return {'ShardIterator': f'{ShardId}:{offset}'}
+
+    def _offset_of(self, shard, sequence_number):
+        target = int(sequence_number)
+        # Sequence numbers increase within a shard, so bisect the log
+        lo, hi = 0, len(shard.records)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if int(shard.records[mid]['SequenceNumber']) < target:
+                lo = mid + 1
+            else:
+                hi = mid
+        return shard.trimmed + lo
+
+    def get_records(self, ShardIterator, Limit=10000):
+        shard_id, offset = ShardIterator.rsplit(':', 1)
+        offset = int(offset)
+        with self._lock:
+            shard = self._get_shard(shard_id)
+            start = max(offset, shard.trimmed) - shard.trimmed
+            records = shard.records[start:start + Limit]
+            next_offset = shard.trimmed + start + len(records)
+            at_end = next_offset >= shard.trimmed + len(shard.records)
+
+        if records and at_end:
+            behind = 0
+        elif records:
+            behind = int((time.time() - records[-1]['ApproximateArrivalTimestamp'].timestamp()) * 1000)
+        else:
+            behind = 0
+
+        response = {'Records': records, 'MillisBehindLatest': max(behind, 0)}
+        # A closed shard that has been fully read returns no further iterator
+        if not (shard.closed and at_end):
+            response['NextShardIterator'] = f'{shard_id}:{next_offset}'
+        return response
@@ -0,0 +1,180 @@
+import os
+import sys
+import json
+import time
+import threading
+from datetime import datetime, timezone
+
+EMF_MAX_METRICS = 100      # CloudWatch EMF limit per log line
+EMF_MAX_VALUES = 100       # Distinct values per metric in one EMF document
+PUT_METRIC_BATCH = 20
+
+
+class _Histogram:
+    """Distinct values with counts, the shape both EMF and put_metric_data accept"""
+
+    __slots__ = ('unit', 'values')
+
+    def __init__(self, unit):
+        self.unit = unit
+        self.values = {}
+
+    def add(self, value):
+        # Two significant digits keeps the distinct-value count small
+        value = float(f'{value:.2g}') if value else 0.0
+        self.values[value] = self.values.get(value, 0) + 1
+
+
+class EMFSink:
+    """Writes CloudWatch Embedded Metric Format lines; the Lambda log agent does the rest"""
+
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stdout
+
+    def write(self, namespace, dimensions, counters, histograms, timestamp):
+        metrics = [(name, unit, value) for name, (unit, value) in counters.items()]
+        metrics += [
+            (name, h.unit, {'Values': list(h.values), 'Counts': list(h.values.values())})
+            for name, h in histograms.items()
+        ]
+
+        for i in range(0, len(metrics), EMF_MAX_METRICS):
+            chunk = metrics[i:i + EMF_MAX_METRICS]
+            document = {
+                '_aws': {
+                    'Timestamp': int(timestamp * 1000),
+                    'CloudWatchMetrics': [{
+                        'Namespace': namespace,
+                        'Dimensions': [list(dimensions)],
+                        'Metrics': [{'Name': name, 'Unit': unit} for name, unit, _ in chunk]
+                    }]
+                }
+            }
+            document.update(dimensions)
+            for name, _, value in chunk:
+                document[name] = value
+            self.stream.write(json.dumps(document) + '\n')
+        self.stream.flush()
+
+
+class PutMetricDataSink:
+    """Sends aggregated metrics with batched put_metric_data calls"""
+
+    def __init__(self, cloudwatch=None):
+        if cloudwatch is None:
+            import boto3
+            cloudwatch = boto3.client('cloudwatch')
+        self.cloudwatch = cloudwatch
+
+    def write(self, namespace, dimensions, counters, histograms, timestamp):
+        ts = datetime.fromtimestamp(timestamp, timezone.utc)
+        dims = [{'Name': name, 'Value': str(value)} for name, value in dimensions.items()]
+
+        metric_data = [
+            {'MetricName': name, 'Value': value, 'Unit': unit, 'Timestamp': ts, 'Dimensions': dims}
+            for name, (unit, value) in counters.items()
+        ]
+        metric_data += [
+            {'MetricName': name, 'Values': list(h.values), 'Counts': list(h.values.values()),
+             'Unit': h.unit, 'Timestamp': ts, 'Dimensions': dims}
+            for name, h in histograms.items()
+        ]
+
+        for i in range(0, len(metric_data), PUT_METRIC_BATCH):
+            self.cloudwatch.put_metric_data(Namespace=namespace, MetricData=metric_data[i:i + PUT_METRIC_BATCH])
+
+
+class LocalSink:
+    """Keeps flushed metrics in memory for tests and local runs"""
+
+    def __init__(self):
+        self.flushes = []
+
+    def write(self, namespace, dimensions, counters, histograms, timestamp):
+        self.flushes.append({
+            'namespace': namespace,
+            'dimensions': dict(dimensions),
+            'counters': {name: value for name, (unit, value) in counters.items()},
+            'histograms': {name: dict(h.values) for name, h in histograms.items()},
+            'timestamp': timestamp
+        })
+
+    def totals(self):
+        """Counter sums across every flush"""
+        totals = {}
+        for flush in self.flushes:
+            for name, value in flush['counters'].items():
+                totals[name] = totals.get(name, 0) + value
+        return totals
+
+
+class _Timer:
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.metrics.observe(self.name, (time.perf_counter() - self.start) * 1000, 'Milliseconds')
+        return False
+
+
+class Metrics:
+    """In-process counters and histograms flushed in one go
+
+    Recording a value is a dict update; nothing leaves the process until
+    flush(), so the hot path never waits on CloudWatch. Call flush() at the
+    end of each Lambda invocation (or periodically in long-running services).
+    """
+
+    def __init__(self, namespace, dimensions=None, sink=None):
+        self.namespace = namespace
+        self.dimensions = dict(dimensions or {})
+        self.sink = sink or EMFSink()
+        self._counters = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def count(self, name, value=1, unit='Count'):
+        with self._lock:
+            current = self._counters.get(name)
+            self._counters[name] = (unit, (current[1] if current else 0) + value)
+
+    def gauge(self, name, value, unit='None'):
+        """Record a point-in-time value; the last one before flush wins"""
+        with self._lock:
+            self._counters[name] = (unit, value)
+
+    def observe(self, name, value, unit='None'):
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = _Histogram(unit)
+            histogram.add(value)
+            full = len(histogram.values) >= EMF_MAX_VALUES
+        if full:
+            self.flush()
+
+    def timer(self, name):
+        """Context manager recording elapsed milliseconds into a histogram"""
+        return _Timer(self, name)
+
+    def flush(self):
+        with self._lock:
+            counters, self._counters = self._counters, {}
+            histograms, self._histograms = self._histograms, {}
+        if counters or histograms:
+            self.sink.write(self.namespace, self.dimensions, counters, histograms, time.time())
+
+
+def create_sink(mode=None, cloudwatch=None):
+    """Pick a sink from METRICS_SINK: emf (default), put_metric_data or local"""
+    mode = mode or os.environ.get('METRICS_SINK', 'emf')
+    if mode == 'put_metric_data':
+        return PutMetricDataSink(cloudwatch)
+    if mode == 'local':
+        return LocalSink()
+    return EMFSink()
@@ -0,0 +1,232 @@
+import time
+import json
+import random
+import argparse
+from collections import Counter
+
+from sketches import TopK
+from local_kinesis import LocalKinesisStream, partition_key_hash
+
+SALT_SEPARATOR = '#'
+SALT_FIELD = 'partition_salt'
+
+
+def logical_key(partition_key):
+    """Strip the salt from a partition key so consumers can re-group sub-keys"""
+    return partition_key.split(SALT_SEPARATOR, 1)[0]
+
+
+def open_shard_ranges(kinesis, stream_name):
+    """(start, end) hash key ranges of the open shards, in hash key order"""
+    ranges = []
+    for shard in kinesis.list_shards(StreamName=stream_name)['Shards']:
+        if 'EndingSequenceNumber' in shard.get('SequenceNumberRange', {}):
+            continue  # Closed by a split or merge
+        key_range = shard['HashKeyRange']
+        ranges.append((int(key_range['StartingHashKey']), int(key_range['EndingHashKey'])))
+    return sorted(ranges)
+
+
+class AdaptivePartitioner:
+    """Chooses Kinesis partition keys, spreading hot keys over several shards
+
+    Per-key rates come from a heavy-hitter sketch over a short window, so
+    tracking stays bounded however many users there are. A key whose rate
+    passes `hot_records_per_second` is salted: its records rotate over
+    `key#0 .. key#n-1`, with n sized to the observed rate, and the salt is
+    written into the record (`partition_salt`) so consumers can re-group on
+    the logical key. Salting gives up per-key ordering across sub-keys.
+
+    With shard ranges set, salted records also get an ExplicitHashKey in the
+    middle of a distinct shard, so n sub-keys land on n shards exactly
+    instead of wherever MD5 happens to put them. Fewer than two salts (a
+    single-shard stream, or max_salts=1) turns salting off.
+    """
+
+    def __init__(self, hot_records_per_second=500, max_salts=16, window_seconds=10,
+                 always_hot=('anonymous',), shard_ranges=None, k=32, clock=time.time):
+        self.hot_rate = hot_records_per_second
+        self.max_salts = max_salts
+        self._configured_max_salts = max_salts
+        self.window_seconds = window_seconds
+        self.always_hot = set(always_hot)
+        self.k = k
+        self.clock = clock
+        self.shard_ranges = None
+        self.hot_keys = {}     # key -> number of sub-keys
+        self._next_salt = {}   # key -> round-robin position
+        self._window = TopK(k)
+        self._window_start = clock()
+        self.stats = {'records': 0, 'salted': 0, 'window_rotations': 0}
+        if shard_ranges:
+            self.set_shard_ranges(shard_ranges)
+
+    def set_shard_ranges(self, shard_ranges):
+        self.shard_ranges = sorted(shard_ranges)
+        # Salts beyond the shard count would only double up on shards
+        self.max_salts = min(self._configured_max_salts, len(self.shard_ranges)) or self._configured_max_salts
+        self.hot_keys = {key: min(salts, self.max_salts) for key, salts in self.hot_keys.items()
+                         if self.max_salts >= 2}
+
+    def _salts_for(self, rate):
+        salts = int(-(-rate // self.hot_rate))  # ceil
+        # max_salts wins over the minimum of two, so the shard clamp holds
+        return min(max(2, salts), self.max_salts)
+
+    def _rotate(self, now):
+        """Re-derive the hot set from the window that just closed"""
+        elapsed = max(now - self._window_start, 1e-9)
+        hot = {}
+        # One shard (or salting capped off): every sub-key would land together
+        if self.max_salts >= 2:
+            for entry in self._window.top():
+                rate = entry['count'] / elapsed
+                if rate > self.hot_rate:
+                    hot[entry['item']] = self._salts_for(rate)
+            for key in self.always_hot:
+                hot[key] = self.max_salts
+        self.hot_keys = hot
+        self._window = TopK(self.k)
+        self._window_start = now
+        self.stats['window_rotations'] += 1
+
+    def partition_key(self, key, now=None):
+        """(partition key, salt or None, explicit hash key or None) for one record"""
+        now = self.clock() if now is None else now
+        if now - self._window_start >= self.window_seconds:
+            self._rotate(now)
+        self._window.add(key)
+        self.stats['records'] += 1
+
+        salts = self.hot_keys.get(key)
+        if salts is None:
+            if self.max_salts < 2:
+                return key, None, None
+            if key in self.always_hot:
+                salts = self.hot_keys[key] = self.max_salts
+            else:
+                # Promote mid-window once a key alone would cover a full window's budget
+                elapsed = now - self._window_start
+                if elapsed > 1 and self._window.candidates.get(key, 0) / elapsed > self.hot_rate:
+                    salts = self.hot_keys[key] = self._salts_for(self._window.candidates[key] / elapsed)
+                else:
+                    return key, None, None
+
+        salt = self._next_salt.get(key, 0) % salts
+        self._next_salt[key] = salt + 1
+        self.stats['salted'] += 1
+
+        explicit_hash_key = None
+        if self.shard_ranges:
+            # Start from the key's own shard so an unsalted key and sub-key 0 agree
+            base = self._shard_index(partition_key_hash(key))
+            start, end = self.shard_ranges[(base + salt) % len(self.shard_ranges)]
+            explicit_hash_key = str((start + end) // 2)
+        return f'{key}{SALT_SEPARATOR}{salt}', salt, explicit_hash_key
+
+    def _shard_index(self, hash_key):
+        for i, (start, end) in enumerate(self.shard_ranges):
+            if start <= hash_key <= end:
+                return i
+        return 0
+
+    def kinesis_record(self, record, data=None, now=None):
+        """put_records entry for an event; records the salt on the event itself"""
+        key, salt, explicit_hash_key = self.partition_key(record.get('user_id', 'anonymous'), now)
+        if salt is not None:
+            record[SALT_FIELD] = salt
+        entry = {'Data': data if data is not None else json.dumps(record), 'PartitionKey': key}
+        if explicit_hash_key is not None:
+            entry['ExplicitHashKey'] = explicit_hash_key
+        return entry
+
+    def summary(self):
+        summary = dict(self.stats)
+        summary['hot_keys'] = dict(self.hot_keys)
+        summary['balanced_shards'] = len(self.shard_ranges) if self.shard_ranges else None
+        return summary
+
+
+def skewed_keys(users=5000, anonymous_share=0.3, bot_share=0.2, seed=42):
+    """Endless user_id stream: an anonymous bucket, one bot and a Zipf-ish long tail"""
+    rng = random.Random(seed)
+    population = [f'user_{i:06d}' for i in range(users)]
+    weights = [1 / (i + 1) for i in range(users)]
+    while True:
+        roll = rng.random()
+        if roll < anonymous_share:
+            yield None
+        elif roll < anonymous_share + bot_share:
+            yield 'bot_crawler_01'
+        else:
+            yield rng.choices(population, weights)[0]
+
+
+def simulate(strategy, seconds=3, offered_per_second=3400, shard_count=4, shard_limit=1000, seed=42):
+    """Offer a skewed load to a throttled local stream and report accepted throughput"""
+    stream = LocalKinesisStream(shard_count=shard_count, write_limit_records=shard_limit)
+    partitioner = None
+    if strategy != 'user_id':
+        partitioner = AdaptivePartitioner(hot_records_per_second=shard_limit / 2, window_seconds=1, clock=lambda: 0)
+        if strategy == 'explicit':
+            partitioner.set_shard_ranges(open_shard_ranges(stream, stream.stream_name))
+
+    keys = skewed_keys(seed=seed)
+    accepted = 0
+    throttled = 0
+    per_shard = Counter()
+    for second in range(seconds):
+        # Align with the stream's one-second throttling windows
+        time.sleep(1 - time.time() % 1)
+        sent = 0
+        while sent < offered_per_second:
+            batch = []
+            for _ in range(min(500, offered_per_second - sent)):
+                user_id = next(keys)
+                record = {'event_type': 'page_view'}
+                if user_id:
+                    record['user_id'] = user_id
+                if partitioner:
+                    # Rates are tracked on a simulated clock, as if arrivals were spread evenly
+                    now = second + (sent + len(batch)) / offered_per_second
+                    batch.append(partitioner.kinesis_record(record, now=now))
+                else:
+                    batch.append({'Data': json.dumps(record), 'PartitionKey': record.get('user_id', 'anonymous')})
+            sent += len(batch)
+            response = stream.put_records(Records=batch)
+            throttled += response['FailedRecordCount']
+            for result in response['Records']:
+                if 'ShardId' in result:
+                    accepted += 1
+                    per_shard[result['ShardId']] += 1
+
+    offered = seconds * offered_per_second
+    return {
+        'strategy': strategy,
+        'offered': offered,
+        'accepted': accepted,
+        'throttled': throttled,
+        'accepted_per_second': accepted / seconds,
+        'per_shard': dict(sorted(per_shard.items())),
+        'hot_keys': partitioner.summary()['hot_keys'] if partitioner else {}
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Simulate partition key strategies against a throttled local stream')
+    parser.add_argument('--seconds', type=int, default=3, help='Seconds per strategy')
+    parser.add_argument('--rate', type=int, default=3400, help='Offered records per second')
+    parser.add_argument('--shards', type=int, default=4, help='Shard count')
+    parser.add_argument('--shard-limit', type=int, default=1000, help='Records/s each shard accepts')
+
+    args = parser.parse_args()
+
+    print(f"🔀 {args.rate} records/s offered to {args.shards} shards x {args.shard_limit} records/s")
+    for strategy in ('user_id', 'salted', 'explicit'):
+        result = simulate(strategy, args.seconds, args.rate, args.shards, args.shard_limit)
+        share = result['accepted'] / result['offered'] * 100
+        print(f"\n📊 {strategy}: {result['accepted_per_second']:.0f} records/s accepted "
+              f"({share:.1f}%), {result['throttled']} throttled")
+        print(f"   per shard: {result['per_shard']}")
+        if result['hot_keys']:
+            print(f"   hot keys: {result['hot_keys']}")
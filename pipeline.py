@@ -0,0 +1,655 @@
+import os
+import json
+import time
+import asyncio
+import inspect
+import argparse
+import threading
+from collections import deque
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+MODES = ('thread', 'asyncio', 'process')
+SAMPLE_SECONDS = 0.1
+
+# Returned by Channel.get once every producer has closed and the queue is drained
+EOS = object()
+
+
+def _size(item):
+    """Records in an item: batches count their events"""
+    return len(item) if isinstance(item, (list, tuple)) else 1
+
+
+def _timed_call(func, item):
+    # Runs in a pool process; the busy time comes back with the result
+    started = time.perf_counter()
+    result = func(item)
+    return result, time.perf_counter() - started
+
+
+class Channel:
+    """Bounded queue between stages with credit-based backpressure
+
+    A producer spends a credit per item and blocks when none are left; the
+    consumer returns the credit only after it has finished with the item,
+    including handing any output downstream. Credits therefore bound the
+    items queued plus in process, and a slow stage stalls its producers
+    instead of letting a queue grow.
+    """
+
+    def __init__(self, name, capacity=8):
+        self.name = name
+        self.capacity = capacity
+        self.producers = 0
+        self._closed = 0
+        self._items = deque()
+        self._credits = threading.Semaphore(capacity)
+        self._ready = threading.Condition()
+        self.stats = {'puts': 0, 'records': 0, 'max_depth': 0, 'put_wait_seconds': 0.0,
+                      'depth_samples': 0, 'depth_total': 0, 'full_samples': 0}
+
+    def put(self, item):
+        started = time.perf_counter()
+        self._credits.acquire()
+        waited = time.perf_counter() - started
+        with self._ready:
+            self._items.append(item)
+            self.stats['puts'] += 1
+            self.stats['records'] += _size(item)
+            self.stats['put_wait_seconds'] += waited
+            if len(self._items) > self.stats['max_depth']:
+                self.stats['max_depth'] = len(self._items)
+            self._ready.notify()
+
+    def get(self):
+        """Next item, or EOS once all producers closed and nothing is left"""
+        with self._ready:
+            while not self._items:
+                if self._closed >= self.producers:
+                    return EOS
+                self._ready.wait()
+            return self._items.popleft()
+
+    def done(self):
+        """Return the credit for one item taken with get()"""
+        self._credits.release()
+
+    def close(self):
+        """One producer is finished"""
+        with self._ready:
+            self._closed += 1
+            self._ready.notify_all()
+
+    def depth(self):
+        return len(self._items)
+
+    def in_flight(self):
+        return self.capacity - self._credits._value
+
+    def sample(self):
+        depth = len(self._items)
+        self.stats['depth_samples'] += 1
+        self.stats['depth_total'] += depth
+        if self.in_flight() >= self.capacity:
+            self.stats['full_samples'] += 1
+
+    def summary(self):
+        samples = self.stats['depth_samples']
+        return {
+            'capacity': self.capacity,
+            'depth': self.depth(),
+            'in_flight': self.in_flight(),
+            'max_depth': self.stats['max_depth'],
+            'avg_depth': round(self.stats['depth_total'] / samples, 2) if samples else 0,
+            'full_ratio': round(self.stats['full_samples'] / samples, 3) if samples else 0,
+            'put_wait_seconds': round(self.stats['put_wait_seconds'], 3),
+            'items': self.stats['puts'],
+            'records': self.stats['records']
+        }
+
+
+class Stage:
+    """One node of the pipeline DAG
+
+    Sources are called as func(stop_event) and yield items until the
+    event is set or they run dry. Other stages are called as func(item)
+    for each input item and return the output item, or None to emit
+    nothing; outputs go to every downstream stage. `mode` picks where func
+    runs: worker threads, tasks on a private asyncio loop (coroutine
+    functions are awaited) or a process pool (func and items must pickle,
+    and state does not survive between calls). If func has a close()
+    method it is called once the stage has drained; what it returns is
+    emitted as a last item.
+    """
+
+    def __init__(self, name, func, mode='thread', workers=1, source=False):
+        if mode not in MODES:
+            raise ValueError(f'Unknown mode {mode!r}; use one of {", ".join(MODES)}')
+        if source and mode == 'process':
+            raise ValueError(f'Source stage {name!r} cannot run in a process pool')
+        self.name = name
+        self.func = func
+        self.mode = mode
+        self.workers = workers
+        self.source = source
+        self.input = None
+        self.outputs = []
+        self.upstream = []
+        self._threads = []
+        self._running = 0
+        self._lock = threading.Lock()
+        self.stats = {'items_in': 0, 'records_in': 0, 'items_out': 0, 'records_out': 0,
+                      'busy_seconds': 0.0, 'errors': 0}
+        self.last_error = None
+        self.started_at = None
+        self.finished_at = None
+
+    def _record(self, item, result, seconds):
+        with self._lock:
+            self.stats['busy_seconds'] += seconds
+            if item is not None:
+                self.stats['items_in'] += 1
+                self.stats['records_in'] += _size(item)
+            if result is not None:
+                self.stats['items_out'] += 1
+                self.stats['records_out'] += _size(result)
+
+    def _error(self, e):
+        with self._lock:
+            self.stats['errors'] += 1
+            self.last_error = f'{type(e).__name__}: {e}'
+
+    def _emit(self, result):
+        if result is not None:
+            for channel in self.outputs:
+                channel.put(result)
+
+    def _finish(self):
+        """Called by each worker as it exits; the last one closes outputs"""
+        with self._lock:
+            self._running -= 1
+            last = self._running == 0
+        if not last:
+            return
+        close = getattr(self.func, 'close', None)
+        if close:
+            try:
+                self._emit(close())
+            except Exception as e:
+                self._error(e)
+        for channel in self.outputs:
+            channel.close()
+        self.finished_at = time.perf_counter()
+
+    def start(self, stop):
+        self.started_at = time.perf_counter()
+        if self.source:
+            targets = [lambda: self._run_source(stop)]
+        elif self.mode == 'thread':
+            targets = [self._run_thread] * self.workers
+        elif self.mode == 'asyncio':
+            targets = [lambda: asyncio.run(self._run_async())]
+        else:
+            targets = [self._run_process]
+        self._running = len(targets)
+        for i, target in enumerate(targets):
+            thread = threading.Thread(target=target, name=f'{self.name}-{i}', daemon=True)
+            self._threads.append(thread)
+            thread.start()
+
+    def join(self, timeout=None):
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def alive(self):
+        return any(thread.is_alive() for thread in self._threads)
+
+    def _run_source(self, stop):
+        try:
+            items = iter(self.func(stop))
+            while not stop.is_set():
+                # Rate-limited sources report time spent pacing as idle_seconds
+                idle = getattr(self.func, 'idle_seconds', 0.0)
+                started = time.perf_counter()
+                item = next(items, EOS)
+                if item is EOS:
+                    break
+                idle = getattr(self.func, 'idle_seconds', 0.0) - idle
+                self._record(None, item, time.perf_counter() - started - idle)
+                self._emit(item)
+        except Exception as e:
+            self._error(e)
+        finally:
+            self._finish()
+
+    def _run_thread(self):
+        try:
+            while True:
+                item = self.input.get()
+                if item is EOS:
+                    break
+                try:
+                    started = time.perf_counter()
+                    result = self.func(item)
+                    self._record(item, result, time.perf_counter() - started)
+                    self._emit(result)
+                except Exception as e:
+                    self._error(e)
+                finally:
+                    self.input.done()
+        finally:
+            self._finish()
+
+    async def _run_async(self):
+        loop = asyncio.get_running_loop()
+
+        async def worker():
+            while True:
+                item = await loop.run_in_executor(None, self.input.get)
+                if item is EOS:
+                    return
+                try:
+                    started = time.perf_counter()
+                    result = self.func(item)
+                    if inspect.isawaitable(result):
+                        result = await result
+                    self._record(item, result, time.perf_counter() - started)
+                    await loop.run_in_executor(None, self._emit, result)
+                except Exception as e:
+                    self._error(e)
+                finally:
+                    self.input.done()
+
+        try:
+            await asyncio.gather(*(worker() for _ in range(self.workers)))
+        finally:
+            self._finish()
+
+    def _run_process(self):
+        pending = {}  # future -> item
+
+        def collect(done):
+            for future in done:
+                item = pending.pop(future)
+                try:
+                    result, seconds = future.result()
+                    self._record(item, result, seconds)
+                    self._emit(result)
+                except Exception as e:
+                    self._error(e)
+                finally:
+                    self.input.done()
+
+        try:
+            with ProcessPoolExecutor(max_workers=self.workers) as pool:
+                while True:
+                    item = self.input.get()
+                    if item is EOS:
+                        break
+                    pending[pool.submit(_timed_call, self.func, item)] = item
+                    # Two items per process keeps workers busy without hoarding credits
+                    if len(pending) >= 2 * self.workers:
+                        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                        collect(done)
+                if pending:
+                    collect(wait(pending)[0])
+        except Exception as e:
+            self._error(e)
+        finally:
+            self._finish()
+
+    def summary(self, now):
+        end = self.finished_at or now
+        elapsed = max(end - (self.started_at or end), 1e-9)
+        summary = dict(self.stats)
+        summary['busy_seconds'] = round(summary['busy_seconds'], 3)
+        summary.update({
+            'mode': self.mode,
+            'workers': self.workers,
+            'records_per_second': round((self.stats['records_out'] if self.source else self.stats['records_in']) / elapsed, 1),
+            # Share of worker time spent inside func; near 1.0 marks the bottleneck
+            'utilization': round(self.stats['busy_seconds'] / (elapsed * self.workers), 3),
+            'running': self.finished_at is None and self.started_at is not None,
+            'last_error': self.last_error
+        })
+        if self.input is not None:
+            summary['queue'] = self.input.summary()
+        return summary
+
+
+class Pipeline:
+    """Stages wired as a DAG of bounded channels, run on one machine
+
+    Each non-source stage owns one input channel that all its upstream
+    stages write to; a stage with several downstream stages sends each of
+    them every output item. Stopping stops the sources; the rest of the
+    graph drains and shuts down in order as channels close.
+    """
+
+    def __init__(self, capacity=8):
+        self.capacity = capacity
+        self.stages = {}
+        self._stop = threading.Event()
+        self.started_at = None
+
+    def add(self, name, func, after=(), mode='thread', workers=1, capacity=None):
+        """Add a stage; with no `after` it is a source"""
+        if name in self.stages:
+            raise ValueError(f'Duplicate stage {name!r}')
+        if isinstance(after, str):
+            after = (after,)
+        stage = Stage(name, func, mode=mode, workers=workers, source=not after)
+        for upstream_name in after:
+            if upstream_name not in self.stages:
+                raise ValueError(f'Stage {name!r} runs after unknown stage {upstream_name!r}')
+        if after:
+            stage.input = Channel(name, capacity or self.capacity)
+            for upstream_name in after:
+                upstream = self.stages[upstream_name]
+                upstream.outputs.append(stage.input)
+                stage.upstream.append(upstream)
+                stage.input.producers += 1
+        self.stages[name] = stage
+        return stage
+
+    def configure(self, name, mode=None, workers=None):
+        stage = self.stages[name]
+        if mode is not None:
+            if mode not in MODES or (stage.source and mode == 'process'):
+                raise ValueError(f'Stage {name!r} cannot run in mode {mode!r}')
+            stage.mode = mode
+        if workers is not None:
+            stage.workers = workers
+
+    def start(self):
+        self._stop.clear()
+        self.started_at = time.perf_counter()
+        # Consumers first, so nothing is produced into a channel nobody reads yet
+        for stage in reversed(list(self.stages.values())):
+            stage.start(self._stop)
+
+    def stop(self):
+        self._stop.set()
+
+    def done(self):
+        return not any(stage.alive() for stage in self.stages.values())
+
+    def sample(self):
+        for stage in self.stages.values():
+            if stage.input is not None:
+                stage.input.sample()
+
+    def run(self, duration=None, report_every=None, report=print):
+        """Run until the sources finish or `duration` seconds pass; returns summary()"""
+        self.start()
+        deadline = None if duration is None else self.started_at + duration
+        next_report = None if report_every is None else self.started_at + report_every
+        try:
+            while not self.done():
+                time.sleep(SAMPLE_SECONDS)
+                self.sample()
+                now = time.perf_counter()
+                if deadline is not None and now >= deadline:
+                    self.stop()
+                if next_report is not None and now >= next_report:
+                    report(self.status_line())
+                    next_report += report_every
+        except KeyboardInterrupt:
+            self.stop()
+            for stage in self.stages.values():
+                stage.join()
+        return self.summary()
+
+    def bottleneck(self, stages=None):
+        """Busiest stage: highest utilization, then the fullest input queue"""
+        stages = stages or self.summary(with_bottleneck=False)['stages']
+        if not stages:
+            return None
+        return max(stages, key=lambda name: (
+            stages[name]['utilization'], stages[name].get('queue', {}).get('full_ratio', 0)
+        ))
+
+    def status_line(self):
+        now = time.perf_counter()
+        parts = []
+        for name, stage in self.stages.items():
+            summary = stage.summary(now)
+            queue = f" q={summary['queue']['depth']}/{summary['queue']['capacity']}" if 'queue' in summary else ''
+            parts.append(f"{name} {summary['records_per_second']:,.0f}/s{queue}")
+        return '⏱️  ' + ' | '.join(parts)
+
+    def summary(self, with_bottleneck=True):
+        now = time.perf_counter()
+        stages = {name: stage.summary(now) for name, stage in self.stages.items()}
+        summary = {
+            'elapsed_seconds': round(now - self.started_at, 3) if self.started_at else 0,
+            'stages': stages
+        }
+        if with_bottleneck:
+            summary['bottleneck'] = self.bottleneck(stages)
+        return summary
+
+
+# Local clickstream pipeline: generator -> ingest -> stream -> delivery
+#                                                          -> aggregate -> dashboard
+
+def ingest_batch(batch):
+    """Validate and stamp a batch as the API does; stateless, so it can run in a process pool"""
+    from quarantine import validate_record
+
+    received_at = datetime.utcnow().isoformat()
+    accepted = []
+    for event in batch:
+        if validate_record(event) is None:
+            event['received_at'] = received_at
+            accepted.append(event)
+    return accepted or None
+
+
+class GeneratorSource:
+    """Batches of generator-shaped events (wire.sample_events), optionally rate limited"""
+
+    def __init__(self, batch_size=500, events_per_second=None, total=None):
+        self.batch_size = batch_size
+        self.events_per_second = events_per_second
+        self.total = total
+        self.idle_seconds = 0.0
+
+    def __call__(self, stop):
+        from wire import sample_events
+
+        started = time.monotonic()
+        produced = 0
+        while not stop.is_set() and (self.total is None or produced < self.total):
+            count = self.batch_size if self.total is None else min(self.batch_size, self.total - produced)
+            yield sample_events(count)
+            produced += count
+            if self.events_per_second:
+                ahead = produced / self.events_per_second - (time.monotonic() - started)
+                if ahead > 0:
+                    stop.wait(ahead)
+                    self.idle_seconds += ahead
+
+
+class StreamStage:
+    """Dedup, then put_records into a local Kinesis stand-in; passes on what was accepted"""
+
+    def __init__(self, shard_count=2, max_records_per_shard=10000):
+        from dedup import EventDeduplicator
+        from local_kinesis import LocalKinesisStream
+
+        self.deduplicator = EventDeduplicator()
+        self.stream = LocalKinesisStream(shard_count=shard_count, max_records_per_shard=max_records_per_shard)
+
+    def __call__(self, batch):
+        events, _ = self.deduplicator.filter_events(batch)
+        accepted = []
+        for start in range(0, len(events), 500):
+            chunk = events[start:start + 500]
+            response = self.stream.put_records(Records=[{
+                'Data': json.dumps(event),
+                'PartitionKey': str(event.get('user_id') or event.get('session_id') or 'anonymous')
+            } for event in chunk])
+            accepted.extend(event for event, result in zip(chunk, response['Records']) if 'ErrorCode' not in result)
+        return accepted or None
+
+
+class DeliveryStage:
+    """Firehose-style delivery to a local directory; compacts partitions on close if asked"""
+
+    def __init__(self, root, buffer_seconds=60, buffer_mb=5, compact=False):
+        from local_firehose import create_firehose
+
+        self.root = root
+        self.compact = compact
+        self.firehose = create_firehose(root, buffer_seconds=buffer_seconds, buffer_mb=buffer_mb)
+
+    def __call__(self, batch):
+        self.firehose.put_events(batch)
+        self.firehose.tick()
+        return None
+
+    def close(self):
+        self.firehose.close()
+        if self.compact:
+            from compaction import PartitionCompactor
+
+            PartitionCompactor(self.root, self.firehose.prefix, manifest=self.firehose.manifest).run()
+        return None
+
+
+class AggregateStage:
+    """Funnel, sketches and rollups as local_api keeps them; emits a summary every interval"""
+
+    def __init__(self, interval=1.0):
+        from funnel import FunnelEngine
+        from sketches import SketchStore
+        from rollups import RollupStore
+
+        self.funnel = FunnelEngine()
+        self.sketches = SketchStore()
+        self.rollups = RollupStore()
+        self.interval = interval
+        self.events = 0
+        self.event_types = {}
+        self._last_emit = 0.0
+
+    def __call__(self, batch):
+        for event in batch:
+            self.funnel.process(event)
+            self.sketches.update(event)
+            self.rollups.update(event)
+            event_type = event.get('event_type', 'unknown')
+            self.event_types[event_type] = self.event_types.get(event_type, 0) + 1
+        self.events += len(batch)
+        now = time.monotonic()
+        if now - self._last_emit < self.interval:
+            return None
+        self._last_emit = now
+        return self.snapshot()
+
+    def close(self):
+        return self.snapshot()
+
+    def snapshot(self):
+        return {
+            'total_events': self.events,
+            'events_by_type': dict(self.event_types),
+            'funnel': self.funnel.summary(),
+            'sketches': {'all_time': self.sketches.all_time.summary()}
+        }
+
+
+class DashboardFeed:
+    """Latest aggregate summary, optionally written to a JSON file the dashboard can poll"""
+
+    def __init__(self, path=None):
+        self.path = path
+        self.latest = None
+        self.updates = 0
+
+    async def __call__(self, summary):
+        self.latest = summary
+        self.updates += 1
+        if self.path:
+            await asyncio.get_running_loop().run_in_executor(None, self._write, summary)
+        return None
+
+    def _write(self, summary):
+        tmp = f'{self.path}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(summary, f)
+        os.replace(tmp, self.path)
+
+
+def build_local_pipeline(batch_size=500, events_per_second=None, total=None, capacity=8,
+                         delivery_dir=None, compact=False, feed_path=None, shard_count=2):
+    aggregate = AggregateStage()
+    feed = DashboardFeed(feed_path)
+    pipeline = Pipeline(capacity=capacity)
+    pipeline.add('generator', GeneratorSource(batch_size, events_per_second, total))
+    pipeline.add('ingest', ingest_batch, after='generator')
+    pipeline.add('stream', StreamStage(shard_count), after='ingest')
+    if delivery_dir:
+        pipeline.add('delivery', DeliveryStage(delivery_dir, compact=compact), after='stream')
+    pipeline.add('aggregate', aggregate, after='stream')
+    pipeline.add('dashboard', feed, after='aggregate', mode='asyncio')
+    return pipeline, aggregate, feed
+
+
+def parse_stage_options(values, cast=str):
+    """['ingest=process', 'stream=thread'] -> {'ingest': 'process', 'stream': 'thread'}"""
+    options = {}
+    for value in values or []:
+        for part in value.split(','):
+            name, _, setting = part.partition('=')
+            if not setting:
+                raise argparse.ArgumentTypeError(f'Expected stage=value, got {part!r}')
+            options[name.strip()] = cast(setting.strip())
+    return options
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the local clickstream pipeline in one process')
+    parser.add_argument('--duration', type=float, default=10, help='Seconds to run (sources stop, the rest drains)')
+    parser.add_argument('--events', type=int, help='Stop after this many generated events instead')
+    parser.add_argument('--rate', type=float, help='Generated events per second (default: as fast as possible)')
+    parser.add_argument('--batch-size', type=int, default=500, help='Events per generated batch')
+    parser.add_argument('--capacity', type=int, default=8, help='Credits (batches in flight) per channel')
+    parser.add_argument('--shards', type=int, default=2, help='Shards in the local stream')
+    parser.add_argument('--mode', action='append', help='stage=thread|asyncio|process, e.g. ingest=process')
+    parser.add_argument('--workers', action='append', help='stage=N, e.g. ingest=4')
+    parser.add_argument('--delivery-dir', help='Deliver Firehose-style objects under this directory')
+    parser.add_argument('--compact', action='store_true', help='Compact delivered partitions at the end')
+    parser.add_argument('--feed', help='Write the latest dashboard summary to this JSON file')
+    parser.add_argument('--report-every', type=float, default=2, help='Seconds between progress lines')
+    parser.add_argument('--json', action='store_true', help='Print the final summary as JSON')
+    args = parser.parse_args()
+
+    pipeline, aggregate, feed = build_local_pipeline(
+        batch_size=args.batch_size, events_per_second=args.rate, total=args.events, capacity=args.capacity,
+        delivery_dir=args.delivery_dir, compact=args.compact, feed_path=args.feed, shard_count=args.shards
+    )
+    for name, mode in parse_stage_options(args.mode).items():
+        pipeline.configure(name, mode=mode)
+    for name, workers in parse_stage_options(args.workers, int).items():
+        pipeline.configure(name, workers=workers)
+
+    print(f"🚀 Pipeline: {' → '.join(pipeline.stages)}")
+    summary = pipeline.run(duration=None if args.events else args.duration, report_every=args.report_every)
+
+    if args.json:
+        print(json.dumps(summary, indent=2))
+    else:
+        print("=" * 60)
+        for name, stage in summary['stages'].items():
+            queue = stage.get('queue')
+            waits = f", queue max {queue['max_depth']}/{queue['capacity']}, full {queue['full_ratio']:.0%}" if queue else ''
+            errors = f", ❌ {stage['errors']} errors ({stage['last_error']})" if stage['errors'] else ''
+            print(f"{name:10} {stage['mode']:7} x{stage['workers']}: {stage['records_per_second']:>10,.0f} events/s, "
+                  f"busy {stage['utilization']:.0%}{waits}{errors}")
+        print("=" * 60)
+        print(f"🐢 Bottleneck: {summary['bottleneck']}")
+        print(f"📊 Aggregated {aggregate.events:,} events in {summary['elapsed_seconds']:.1f}s, "
+              f"{feed.updates} dashboard updates")
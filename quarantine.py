@@ -0,0 +1,283 @@
+import os
+import gzip
+import json
+import time
+import uuid
+import argparse
+import threading
+from datetime import datetime, timezone
+
+from partitioning import AdaptivePartitioner, open_shard_ranges, SALT_FIELD
+
+QUARANTINE_PREFIX = 'quarantine/'
+REPLAYED_PREFIX = 'quarantine-replayed/'
+
+# Reason codes
+NOT_AN_OBJECT = 'NOT_AN_OBJECT'
+MISSING_EVENT_TYPE = 'MISSING_EVENT_TYPE'
+INVALID_JSON = 'INVALID_JSON'
+THROTTLED = 'THROTTLED'
+PUT_FAILED = 'PUT_FAILED'
+
+# Failures that may succeed if the record is simply sent again
+RETRYABLE_REASONS = (THROTTLED, PUT_FAILED)
+
+
+def validate_record(record):
+    """Reason code if a record can't be forwarded, else None"""
+    if not isinstance(record, dict):
+        return NOT_AN_OBJECT
+    if not record.get('event_type'):
+        return MISSING_EVENT_TYPE
+    return None
+
+
+def reason_for_error(error_code):
+    """Map a put_records ErrorCode to a quarantine reason"""
+    if error_code == 'ProvisionedThroughputExceededException':
+        return THROTTLED
+    return PUT_FAILED
+
+
+class LocalSegmentBackend:
+    """Segments as files under a local directory standing in for a bucket"""
+
+    def __init__(self, root):
+        self.root = root
+
+    def put(self, key, data):
+        path = os.path.join(self.root, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def get(self, key):
+        with open(os.path.join(self.root, key), 'rb') as f:
+            return f.read()
+
+    def list(self, prefix):
+        base = os.path.join(self.root, prefix)
+        keys = []
+        for dirpath, dirnames, filenames in os.walk(base):
+            for name in filenames:
+                if not name.endswith('.tmp'):
+                    keys.append(os.path.relpath(os.path.join(dirpath, name), self.root).replace(os.sep, '/'))
+        return sorted(keys)
+
+    def move(self, key, new_key):
+        new_path = os.path.join(self.root, new_key)
+        os.makedirs(os.path.dirname(new_path), exist_ok=True)
+        os.replace(os.path.join(self.root, key), new_path)
+
+
+class S3SegmentBackend:
+    """Segments in an S3 (or S3-compatible) bucket"""
+
+    def __init__(self, s3, bucket):
+        self.s3 = s3
+        self.bucket = bucket
+
+    def put(self, key, data):
+        self.s3.put_object(Bucket=self.bucket, Key=key, Body=data, ContentType='application/x-ndjson',
+                           ContentEncoding='gzip')
+
+    def get(self, key):
+        return self.s3.get_object(Bucket=self.bucket, Key=key)['Body'].read()
+
+    def list(self, prefix):
+        keys = []
+        paginator = self.s3.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+            keys.extend(obj['Key'] for obj in page.get('Contents', []))
+        return sorted(keys)
+
+    def move(self, key, new_key):
+        self.s3.copy_object(Bucket=self.bucket, Key=new_key, CopySource={'Bucket': self.bucket, 'Key': key})
+        self.s3.delete_object(Bucket=self.bucket, Key=key)
+
+
+class QuarantineStore:
+    """Buffers rejected records and writes them as gzip NDJSON segments
+
+    Segments are keyed quarantine/reason=<code>/dt=<YYYY-MM-DD>/<segment>,
+    so a replay can pick out one failure class. Each line keeps the
+    original record with its reason, error message and source.
+    """
+
+    def __init__(self, backend, max_records=5000, max_bytes=4 * 1024 * 1024, source='ingest'):
+        self.backend = backend
+        self.max_records = max_records
+        self.max_bytes = max_bytes
+        self.source = source
+        self._buffers = {}   # reason -> list of encoded lines
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.stats = {'quarantined': 0, 'segments_written': 0}
+
+    def add(self, record, reason, error=None):
+        line = json.dumps({
+            'reason': reason,
+            'error': error,
+            'source': self.source,
+            'quarantined_at': datetime.now(timezone.utc).isoformat(),
+            'record': record
+        }, default=str)
+        with self._lock:
+            self._buffers.setdefault(reason, []).append(line)
+            self._bytes += len(line)
+            self.stats['quarantined'] += 1
+            full = self._bytes >= self.max_bytes or sum(len(b) for b in self._buffers.values()) >= self.max_records
+        if full:
+            self.flush()
+
+    def flush(self):
+        """Write one segment per reason; returns the keys written"""
+        with self._lock:
+            buffers, self._buffers = self._buffers, {}
+            self._bytes = 0
+
+        keys = []
+        now = datetime.now(timezone.utc)
+        for reason, lines in buffers.items():
+            key = (f'{QUARANTINE_PREFIX}reason={reason}/dt={now:%Y-%m-%d}/'
+                   f'segment-{now:%H%M%S}-{uuid.uuid4().hex[:8]}.ndjson.gz')
+            self.backend.put(key, gzip.compress(('\n'.join(lines) + '\n').encode('utf-8')))
+            keys.append(key)
+            self.stats['segments_written'] += 1
+        return keys
+
+    def segments(self, reasons=None):
+        keys = self.backend.list(QUARANTINE_PREFIX)
+        if reasons:
+            keys = [k for k in keys if any(f'/reason={r}/' in f'/{k}' for r in reasons)]
+        return keys
+
+    def read_segment(self, key):
+        text = gzip.decompress(self.backend.get(key)).decode('utf-8')
+        return [json.loads(line) for line in text.splitlines() if line]
+
+
+def to_kinesis_record(record, partitioner=None):
+    """Same shaping as the ingestion Lambda so replays take the producer path
+
+    A salt from the original send is dropped first; the partitioner picks a
+    fresh one from the current rates, as it would for a new record.
+    """
+    record.pop(SALT_FIELD, None)
+    if partitioner:
+        return partitioner.kinesis_record(record)
+    return {
+        'Data': json.dumps(record),
+        'PartitionKey': record.get('user_id', 'anonymous')
+    }
+
+
+class QuarantineReplayer:
+    """Re-injects quarantined records into Kinesis at a bounded rate
+
+    Only retryable reasons are replayed by default. Records still failing
+    validation, and records the stream rejects again, go back into
+    quarantine. Finished segments are moved
+    under quarantine-replayed/ so a replay never runs twice. With a
+    partitioner, replayed records get the same keys the ingestion Lambda
+    would give them.
+    """
+
+    def __init__(self, store, kinesis, stream_name, records_per_second=500, batch_size=500, partitioner=None):
+        self.store = store
+        self.kinesis = kinesis
+        self.stream_name = stream_name
+        self.partitioner = partitioner
+        self.records_per_second = records_per_second
+        self.batch_size = min(batch_size, 500)  # put_records limit
+        self.stats = {'segments': 0, 'replayed': 0, 'requeued': 0, 'skipped_invalid': 0}
+
+    def replay(self, reasons=RETRYABLE_REASONS, dry_run=False):
+        for key in self.store.segments(reasons):
+            entries = self.store.read_segment(key)
+            records = []
+            for entry in entries:
+                if validate_record(entry['record']) is None:
+                    records.append(entry['record'])
+                else:
+                    self.stats['skipped_invalid'] += 1
+                    if not dry_run:
+                        self.store.add(entry['record'], entry['reason'], entry.get('error'))
+
+            if not dry_run:
+                for i in range(0, len(records), self.batch_size):
+                    self._send(records[i:i + self.batch_size])
+                self.store.flush()
+                self.store.backend.move(key, REPLAYED_PREFIX + key[len(QUARANTINE_PREFIX):])
+            self.stats['segments'] += 1
+        return self.stats
+
+    def _send(self, batch):
+        started = time.monotonic()
+        response = self.kinesis.put_records(
+            Records=[to_kinesis_record(record, self.partitioner) for record in batch],
+            StreamName=self.stream_name
+        )
+        for record, result in zip(batch, response['Records']):
+            if 'ErrorCode' in result:
+                self.store.add(record, reason_for_error(result['ErrorCode']), result.get('ErrorMessage'))
+                self.stats['requeued'] += 1
+            else:
+                self.stats['replayed'] += 1
+
+        # Pace batches to the configured rate
+        min_duration = len(batch) / self.records_per_second
+        elapsed = time.monotonic() - started
+        if elapsed < min_duration:
+            time.sleep(min_duration - elapsed)
+
+
+def create_store(source='ingest'):
+    """Quarantine store from QUARANTINE_BUCKET (S3) or QUARANTINE_DIR (local)"""
+    bucket = os.environ.get('QUARANTINE_BUCKET')
+    if bucket:
+        import boto3
+        return QuarantineStore(S3SegmentBackend(boto3.client('s3'), bucket), source=source)
+    return QuarantineStore(LocalSegmentBackend(os.environ.get('QUARANTINE_DIR', './data')), source=source)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Inspect or replay quarantined clickstream records')
+    parser.add_argument('command', choices=['list', 'replay'])
+    parser.add_argument('--root', help='Local quarantine directory (default: QUARANTINE_BUCKET/QUARANTINE_DIR)')
+    parser.add_argument('--reason', action='append', help='Only segments with this reason code (replay default: THROTTLED, PUT_FAILED)')
+    parser.add_argument('--stream', default='clickstream-demo-stream', help='Kinesis stream to replay into')
+    parser.add_argument('--rate', type=int, default=500, help='Records per second')
+    parser.add_argument('--local-kinesis', action='store_true', help='Replay into an in-process local stream')
+    parser.add_argument('--dry-run', action='store_true', help='Read segments without sending')
+
+    args = parser.parse_args()
+
+    store = QuarantineStore(LocalSegmentBackend(args.root)) if args.root else create_store()
+
+    if args.command == 'list':
+        segments = store.segments(args.reason)
+        print(f"🧪 {len(segments)} quarantined segments")
+        for key in segments:
+            print(f"  • {key} ({len(store.read_segment(key))} records)")
+    else:
+        if args.local_kinesis:
+            from local_kinesis import LocalKinesisStream
+            kinesis = LocalKinesisStream(args.stream)
+        else:
+            import boto3
+            kinesis = boto3.client('kinesis')
+
+        # Same partitioning settings as the ingestion Lambda
+        partitioner = AdaptivePartitioner(
+            hot_records_per_second=float(os.environ.get('PARTITION_HOT_RATE', 100)),
+            max_salts=int(os.environ.get('PARTITION_MAX_SALTS', 8))
+        ) if os.environ.get('PARTITIONING', 'adaptive') == 'adaptive' else None
+        if partitioner and os.environ.get('PARTITION_BALANCE', 'hash') == 'explicit':
+            partitioner.set_shard_ranges(open_shard_ranges(kinesis, args.stream))
+
+        replayer = QuarantineReplayer(store, kinesis, args.stream, records_per_second=args.rate, partitioner=partitioner)
+        stats = replayer.replay(args.reason or RETRYABLE_REASONS, dry_run=args.dry_run)
+        print(f"🔁 Replay complete: {stats}")
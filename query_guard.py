@@ -0,0 +1,313 @@
+import os
+import re
+import json
+import time
+import argparse
+from datetime import datetime, timedelta, timezone
+
+from watermarks import LocalManifestStore, WatermarkManifest, PARTITION_PATTERN, partition_start
+
+MB = 1024 * 1024
+TB = 1024 * 1024 * MB
+PRICE_PER_TB = 5.0
+MIN_BILLED_BYTES = 10 * MB  # Athena bills at least 10 MB per query
+
+# Athena table -> watermark manifest table holding its partition statistics (also its prefix in the bucket)
+DEFAULT_TABLES = {'events_processed': 'events'}
+TIME_COLUMNS = ('processed_at', 'timestamp')
+PARTITION_COLUMNS = ('year', 'month', 'day', 'hour')
+
+_TABLE = re.compile(r'\b(?:FROM|JOIN)\s+([\w."]+)', re.IGNORECASE)
+_RELATIVE_FILTER = re.compile(
+    r"\b(?P<column>\w+)\s*(?:>=|>)\s*(?:current_timestamp|now\s*\(\s*\))\s*-\s*"
+    r"interval\s*'(?P<amount>\d+)'\s*(?P<unit>minute|hour|day)s?\b",
+    re.IGNORECASE
+)
+_PARTITION_PREDICATE = re.compile(
+    r'\b(year|month|day|hour)\s*(=|<=|>=|<|>)\s*'
+    r'(\d+|(?:year|month|day|hour)\s*\(\s*current_(?:date|timestamp)\s*\))',
+    re.IGNORECASE
+)
+_PARTITION_REFERENCE = re.compile(r'\b(?:year|month|day|hour)\b(?!\s*\()', re.IGNORECASE)
+_LITERAL = re.compile(r"interval\s*'[^']*'\s*\w+|'[^']*'", re.IGNORECASE)
+_WHERE = re.compile(r'\bWHERE\b', re.IGNORECASE)
+_OR = re.compile(r'\bOR\b', re.IGNORECASE)
+_NOT = re.compile(r'\bNOT\s*\(?\s*$', re.IGNORECASE)
+_OPERATORS = {
+    '=': lambda a, b: a == b, '<': lambda a, b: a < b, '<=': lambda a, b: a <= b,
+    '>': lambda a, b: a > b, '>=': lambda a, b: a >= b
+}
+
+
+class QueryBudgetExceeded(Exception):
+    """A query's estimated scan is over the guard's byte budget"""
+
+    def __init__(self, analysis):
+        self.analysis = analysis
+        super().__init__(
+            f"Estimated scan of {analysis['estimated_bytes'] / MB:,.0f} MB exceeds the "
+            f"{analysis['max_bytes'] / MB:,.0f} MB budget"
+        )
+
+
+def partition_filter(start, end):
+    """Predicate on year/month/day/hour selecting every partition from start's hour through end"""
+    start = start.replace(minute=0, second=0, microsecond=0)
+    clauses = []
+    day = start.replace(hour=0)
+    while day <= max(end, start):
+        clause = f'year = {day.year} AND month = {day.month} AND day = {day.day}'
+        if day == start.replace(hour=0) and start.hour:
+            clause += f' AND hour >= {start.hour}'
+        clauses.append(f'({clause})')
+        day += timedelta(days=1)
+    return '(' + ' OR '.join(clauses) + ')'
+
+
+def _listed_partitions(objects):
+    """{partition path: bytes} from (key, size) pairs, skipping what Athena skips
+
+    That is _SUCCESS markers, _staging/ directories and other _ or .
+    names, plus the *_$folder$ placeholders that some writers leave behind.
+    """
+    partitions = {}
+    for key, size in objects:
+        parts = key.split('/')
+        if not parts[-1] or any(part.startswith(('_', '.')) for part in parts) or key.endswith('$folder$'):
+            continue
+        match = PARTITION_PATTERN.search(key)
+        if match:
+            partitions[match.group(0)] = partitions.get(match.group(0), 0) + size
+    return partitions
+
+
+class LocalPartitionSizes:
+    """Partition bytes from a local directory standing in for the bucket"""
+
+    def __init__(self, root):
+        self.root = root
+
+    def partition_bytes(self, prefix):
+        base = os.path.join(self.root, prefix)
+        objects = []
+        for dirpath, dirnames, filenames in os.walk(base):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                objects.append((os.path.relpath(path, self.root).replace(os.sep, '/'), os.path.getsize(path)))
+        return _listed_partitions(objects)
+
+
+class S3PartitionSizes:
+    """Partition bytes from listing a table's prefix; one ListObjectsV2 page per 1000 objects"""
+
+    def __init__(self, s3, bucket):
+        self.s3 = s3
+        self.bucket = bucket
+
+    def partition_bytes(self, prefix):
+        pages = self.s3.get_paginator('list_objects_v2').paginate(Bucket=self.bucket, Prefix=prefix)
+        return _listed_partitions((obj['Key'], obj['Size']) for page in pages for obj in page.get('Contents', []))
+
+
+def _interval(amount, unit):
+    return timedelta(**{f'{unit.lower()}s': int(amount)})
+
+
+def _predicate_value(value, now):
+    if value.isdigit():
+        return int(value)
+    return getattr(now, value.split('(')[0].strip().lower())
+
+
+class QueryGuard:
+    """Pre-execution partition-pruning and cost checks for Athena queries
+
+    analyze() finds the partitioned tables a query reads and whether it
+    filters on year/month/day/hour. Relative time filters on an event or
+    processing timestamp (`processed_at >= current_timestamp - interval
+    '1' hour`) get an equivalent partition predicate ANDed in, widened by
+    slack_hours for rows that land in an earlier partition than their
+    timestamp suggests. The scan is estimated from the per-partition
+    bytes in the table's watermark manifest or, where no writer keeps
+    one (the Glue ETL output), from listing the table's prefix through
+    `sizes`; either is an upper bound, since Parquet column pruning
+    usually reads less.
+
+    Over max_bytes a query is flagged ('warn') or refused ('refuse').
+    With neither statistics source the size is unknown: the query runs
+    with a warning and the budget is not enforced.
+    """
+
+    def __init__(self, store, tables=None, max_bytes=1024 * MB, mode='warn', slack_hours=2,
+                 time_columns=TIME_COLUMNS, bytes_per_row=200, stats_ttl=300, clock=time.monotonic, sizes=None):
+        if mode not in ('warn', 'refuse'):
+            raise ValueError(f'Unknown guard mode: {mode}')
+        self.store = store
+        self.tables = dict(DEFAULT_TABLES if tables is None else tables)
+        self.max_bytes = max_bytes
+        self.mode = mode
+        self.slack = timedelta(hours=slack_hours)
+        self.time_columns = tuple(column.lower() for column in time_columns)
+        self.bytes_per_row = bytes_per_row
+        self.stats_ttl = stats_ttl
+        self.clock = clock
+        self.sizes = sizes  # Optional LocalPartitionSizes/S3PartitionSizes for tables without a manifest
+        self._stats = {}  # manifest table -> (loaded at, manifest or None)
+
+    def stats(self, table):
+        """Watermark manifest (or a listing in the same shape) for an Athena table, cached for stats_ttl seconds"""
+        manifest_table = self.tables[table]
+        cached = self._stats.get(manifest_table)
+        if cached is not None and self.clock() - cached[0] < self.stats_ttl:
+            return cached[1]
+        manifest = WatermarkManifest(self.store, manifest_table)
+        # Statistics are advisory; a missing bucket or permission must not block queries
+        try:
+            loaded = self.store.get(manifest.key)
+        except Exception:
+            loaded = None
+        if loaded is None and self.sizes is not None:
+            try:
+                listed = self.sizes.partition_bytes(f'{manifest_table}/')
+            except Exception:
+                listed = None
+            if listed:
+                loaded = {'source': 'listing', 'partitions': {p: {'bytes': n} for p, n in listed.items()}}
+        self._stats[manifest_table] = (self.clock(), loaded)
+        return loaded
+
+    def inject_partition_filters(self, sql, now):
+        """ANDs a partition predicate onto each relative time filter; returns (sql, injected)"""
+        injected = []
+        pieces = []
+        position = 0
+        for match in _RELATIVE_FILTER.finditer(sql):
+            if match.group('column').lower() not in self.time_columns or _NOT.search(sql[:match.start()]):
+                continue
+            window = _interval(match.group('amount'), match.group('unit'))
+            start = now - window - self.slack
+            predicate = partition_filter(start, now)
+            pieces.append(sql[position:match.end()])
+            pieces.append(f' AND {predicate}')
+            position = match.end()
+            injected.append({'column': match.group('column'), 'since': start.isoformat(), 'predicate': predicate})
+        pieces.append(sql[position:])
+        return ''.join(pieces), injected
+
+    def estimate(self, table, constraints, since):
+        """(bytes, partitions) read from table under the given constraints, or (None, None)"""
+        manifest = self.stats(table)
+        if manifest is None:
+            return None, None
+        partitions = manifest.get('partitions') or {}
+        known_rows = sum(entry.get('rows', 0) for entry in partitions.values())
+        known_bytes = sum(entry.get('bytes', 0) for entry in partitions.values())
+        bytes_per_row = known_bytes / known_rows if known_bytes and known_rows else self.bytes_per_row
+
+        scanned = 0
+        matched = 0
+        for partition, entry in partitions.items():
+            start = partition_start(partition)
+            values = dict(zip(PARTITION_COLUMNS, (start.year, start.month, start.day, start.hour)))
+            span = timedelta(hours=1)
+            if 'hour=' not in partition:
+                # Day-level partitions (the Glue ETL's layout) can't be pruned by hour
+                del values['hour']
+                span = timedelta(days=1)
+            if since is not None and start + span <= since:
+                continue
+            if not all(_OPERATORS[op](values[column], value) for column, op, value in constraints
+                       if column in values):
+                continue
+            matched += 1
+            scanned += entry.get('bytes') or entry.get('rows', 0) * bytes_per_row
+        if since is None and not constraints:
+            # Partitions past the manifest's retention still count toward a full scan
+            scanned += max(manifest.get('total_rows', 0) - known_rows, 0) * bytes_per_row
+        return int(scanned), matched
+
+    def analyze(self, sql, now=None):
+        now = now or datetime.now(timezone.utc)
+        query, injected = self.inject_partition_filters(sql, now)
+        tables = [name.strip('"').split('.')[-1].strip('"').lower() for name in _TABLE.findall(sql)]
+        guarded = [table for table in tables if table in self.tables]
+
+        # Literals are blanked so "interval '1' hour" or 'day' strings don't read as partition columns
+        where = _LITERAL.sub("''", _WHERE.split(sql, 1)[1]) if _WHERE.search(sql) else ''
+        constraints = [(column.lower(), op, _predicate_value(value, now))
+                       for column, op, value in _PARTITION_PREDICATE.findall(where)]
+        partition_filtered = bool(injected or _PARTITION_REFERENCE.search(where))
+
+        warnings = []
+        if _OR.search(where):
+            # Predicates under an OR may not prune anything; estimate conservatively
+            constraints, since = [], None
+        else:
+            since = min((datetime.fromisoformat(i['since']) for i in injected), default=None)
+        for table in guarded:
+            if not partition_filtered:
+                warnings.append(f'{table}: no year/month/day/hour predicate, full table scan')
+
+        estimated_bytes = 0
+        partitions = 0
+        for table in guarded:
+            scanned, matched = self.estimate(table, constraints, since)
+            if scanned is None:
+                warnings.append(f'{table}: no partition statistics, scan size unknown and budget not enforced')
+                estimated_bytes = partitions = None
+                break
+            estimated_bytes += scanned
+            partitions += matched
+
+        action = 'run'
+        if estimated_bytes is not None and estimated_bytes > self.max_bytes:
+            action = 'refuse' if self.mode == 'refuse' else 'warn'
+            warnings.append(f'estimated {estimated_bytes / MB:,.1f} MB is over the {self.max_bytes / MB:,.0f} MB budget')
+
+        billed = None if estimated_bytes is None else max(estimated_bytes, MIN_BILLED_BYTES) if guarded else 0
+        return {
+            'query': query,
+            'tables': guarded,
+            'partition_filtered': partition_filtered,
+            'injected': injected,
+            'estimated_bytes': estimated_bytes,
+            'estimated_partitions': partitions,
+            'estimated_cost_usd': None if billed is None else round(billed / TB * PRICE_PER_TB, 6),
+            'max_bytes': self.max_bytes,
+            'warnings': warnings,
+            'action': action
+        }
+
+    def check(self, sql, now=None):
+        """analyze(), raising QueryBudgetExceeded when the query should not run"""
+        analysis = self.analyze(sql, now)
+        if analysis['action'] == 'refuse':
+            raise QueryBudgetExceeded(analysis)
+        return analysis
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Estimate Athena scan size and add partition predicates')
+    parser.add_argument('sql', help='Query to analyze')
+    parser.add_argument('--root', default='./data/processed', help='Local directory standing in for the S3 bucket')
+    parser.add_argument('--budget-mb', type=float, default=1024, help='Byte budget per query, in MB')
+    parser.add_argument('--mode', choices=['warn', 'refuse'], default='warn', help='What to do over budget')
+    parser.add_argument('--slack-hours', type=float, default=2, help='Extra partitions before a relative time window')
+    parser.add_argument('--json', action='store_true', help='Print the full analysis as JSON')
+    args = parser.parse_args()
+
+    guard = QueryGuard(LocalManifestStore(args.root), max_bytes=int(args.budget_mb * MB), mode=args.mode,
+                       slack_hours=args.slack_hours, sizes=LocalPartitionSizes(args.root))
+    analysis = guard.analyze(args.sql)
+    if args.json:
+        print(json.dumps(analysis, indent=2))
+    else:
+        icon = {'run': '✅', 'warn': '⚠️ ', 'refuse': '⛔'}[analysis['action']]
+        size = 'unknown' if analysis['estimated_bytes'] is None else f"{analysis['estimated_bytes'] / MB:,.1f} MB"
+        print(f"{icon} {analysis['action']}: {size} across {analysis['estimated_partitions']} partitions "
+              f"(~${analysis['estimated_cost_usd']})")
+        for warning in analysis['warnings']:
+            print(f"   - {warning}")
+        if analysis['injected']:
+            print("🔧 Rewritten query:")
+            print(analysis['query'])
@@ -0,0 +1,567 @@
+import os
+import re
+import zlib
+import base64
+import shutil
+import hashlib
+import argparse
+import tempfile
+from datetime import datetime, timedelta, timezone
+
+from sketches import HyperLogLog, hash64
+from watermarks import (LocalManifestStore, S3ManifestStore, WatermarkManifest, PARTITION_PATTERN, partition_path,
+                        partition_start)
+from compaction import (MB, STAGING_DIR, PartitionFileWriter, is_data_file, pa,
+                        read_records)
+
+SOURCE_TABLE = 'events_processed'
+ROLLUP_TABLE = 'event_rollups'
+ROLLUP_PREFIX = f'rollups/{ROLLUP_TABLE}/'
+MARKER_NAME = '_rollup.json'
+DIMENSIONS = ('event_type', 'device_type', 'country')
+SKETCH_P = 12
+# Matches the Glue event_rollups columns; an hour of anonymous events would otherwise write users_hll as null
+ROLLUP_COLUMNS = (
+    [('rollup_level', 'string')] + [(dimension, 'string') for dimension in DIMENSIONS] +
+    [('event_count', 'int64'), ('purchases', 'int64'), ('revenue', 'float64'), ('null_user_events', 'int64'),
+     ('users_hll', 'string'), ('users_estimate', 'int64')]
+)
+
+
+def rollup_partition(partition):
+    """Zero-padded rollup path for a source partition; the Glue ETL writes month=1/day=5/hour=3"""
+    return partition_path(partition_start(partition))
+
+
+def encode_sketch(sketch):
+    return base64.b64encode(zlib.compress(bytes(sketch.registers))).decode('ascii')
+
+
+def decode_sketch(value, p=SKETCH_P):
+    sketch = HyperLogLog(p)
+    sketch.registers = bytearray(zlib.decompress(base64.b64decode(value)))
+    return sketch
+
+
+def _revenue(event):
+    if event.get('event_type') != 'purchase':
+        return 0.0
+    return float((event.get('properties') or {}).get('total_amount') or 0)
+
+
+def summarize(events, p=SKETCH_P):
+    """Rollup rows for one partition's events
+
+    'cube' rows hold counts per event_type/device_type/country combination;
+    counts are additive, so a day query just sums them. Unique users are
+    not, so 'total' and per-dimension-value rows ('event_type', ...) each
+    hold a HyperLogLog that readers merge across hours.
+    """
+    cube = {}
+    sketches = {}
+    for event in events:
+        key = tuple(event.get(dimension) for dimension in DIMENSIONS)
+        row = cube.get(key)
+        if row is None:
+            row = cube[key] = {'event_count': 0, 'purchases': 0, 'revenue': 0.0, 'null_user_events': 0}
+        row['event_count'] += 1
+        if event.get('event_type') == 'purchase':
+            row['purchases'] += 1
+            row['revenue'] += _revenue(event)
+
+        user_id = event.get('user_id')
+        if user_id is None:
+            row['null_user_events'] += 1
+            continue
+        h = hash64(user_id)
+        for level, value in (('total', None),) + tuple(zip(DIMENSIONS, key)):
+            sketch = sketches.get((level, value))
+            if sketch is None:
+                sketch = sketches[(level, value)] = HyperLogLog(p)
+            sketch.add_hash(h)
+
+    rows = []
+    for key, counts in sorted(cube.items(), key=lambda item: tuple(str(v) for v in item[0])):
+        row = {'rollup_level': 'cube', **dict(zip(DIMENSIONS, key)), **counts}
+        row['revenue'] = round(row['revenue'], 2)
+        row.update({'users_hll': None, 'users_estimate': None})
+        rows.append(row)
+    for (level, value), sketch in sorted(sketches.items(), key=lambda item: (item[0][0], str(item[0][1]))):
+        row = {'rollup_level': level, **{dimension: None for dimension in DIMENSIONS}}
+        if level != 'total':
+            row[level] = value
+        row.update({'event_count': None, 'purchases': None, 'revenue': None, 'null_user_events': None,
+                    'users_hll': encode_sketch(sketch), 'users_estimate': sketch.count()})
+        rows.append(row)
+    return rows
+
+
+class LocalFiles:
+    """Rollup storage in a local directory standing in for the processed bucket"""
+
+    def __init__(self, root):
+        self.root = root
+        self.manifests = LocalManifestStore(root)
+
+    def _path(self, key):
+        return os.path.join(self.root, key)
+
+    def partitions(self, prefix):
+        """Relative paths of the hour= directories below prefix"""
+        base = self._path(prefix)
+        partitions = []
+        for dirpath, dirnames, filenames in os.walk(base):
+            dirnames[:] = sorted(d for d in dirnames if is_data_file(d))
+            if os.path.basename(dirpath).startswith('hour='):
+                partitions.append(os.path.relpath(dirpath, base).replace(os.sep, '/'))
+        return partitions
+
+    def files(self, prefix):
+        """{name: size} of the data files directly in prefix"""
+        directory = self._path(prefix)
+        if not os.path.isdir(directory):
+            return {}
+        return {
+            name: os.path.getsize(os.path.join(directory, name)) for name in sorted(os.listdir(directory))
+            if is_data_file(name) and os.path.isfile(os.path.join(directory, name))
+        }
+
+    def read(self, key):
+        return read_records(self._path(key))
+
+    def staging(self, prefix):
+        # Inside the target partition so publishing is a same-filesystem rename
+        staging = os.path.join(self._path(prefix), STAGING_DIR)
+        os.makedirs(staging, exist_ok=True)
+        return staging
+
+    def publish(self, path, key):
+        os.replace(path, self._path(key))
+
+    def delete(self, key):
+        os.remove(self._path(key))
+
+
+class S3Files:
+    """The LocalFiles interface over an S3 bucket; new files are staged in a temp directory"""
+
+    def __init__(self, s3, bucket):
+        self.s3 = s3
+        self.bucket = bucket
+        self.manifests = S3ManifestStore(s3, bucket)
+
+    def _pages(self, prefix, **kw):
+        return self.s3.get_paginator('list_objects_v2').paginate(Bucket=self.bucket, Prefix=prefix, **kw)
+
+    def partitions(self, prefix):
+        partitions = set()
+        for page in self._pages(prefix):
+            for obj in page.get('Contents', []):
+                directory = obj['Key'][len(prefix):].rpartition('/')[0]
+                if directory.rpartition('/')[2].startswith('hour=') and \
+                        all(is_data_file(part) for part in directory.split('/')):
+                    partitions.add(directory)
+        return sorted(partitions)
+
+    def files(self, prefix):
+        prefix = prefix.rstrip('/') + '/'
+        files = {}
+        for page in self._pages(prefix, Delimiter='/'):
+            for obj in page.get('Contents', []):
+                name = obj['Key'][len(prefix):]
+                if is_data_file(name):
+                    files[name] = obj['Size']
+        return dict(sorted(files.items()))
+
+    def read(self, key):
+        # read_records picks the format from the file name, so keep it in the temp path
+        fd, path = tempfile.mkstemp(suffix='-' + key.rpartition('/')[2])
+        os.close(fd)
+        try:
+            self.s3.download_file(self.bucket, key, path)
+            return read_records(path)
+        finally:
+            os.remove(path)
+
+    def staging(self, prefix):
+        return tempfile.mkdtemp(prefix='rollups-')
+
+    def publish(self, path, key):
+        self.s3.upload_file(path, self.bucket, key)
+        os.remove(path)
+
+    def delete(self, key):
+        self.s3.delete_object(Bucket=self.bucket, Key=key)
+
+
+class RollupBuilder:
+    """Builds one small rollup file per completed hour partition of the processed bucket
+
+    An hour is built once the lateness allowance has passed. Its
+    `_rollup.json` marker records a signature of the source files
+    (names and sizes), so reruns skip unchanged hours and rebuild only
+    those that received late data or were compacted; verified_cutoff()
+    uses the same check to decide how far queries may trust rollups.
+    Source hours may be zero-padded or not (Spark's partitionBy writes
+    month=1); rollups always use the padded path the event_rollups
+    projection expects. `files` is a LocalFiles or S3Files. Rollups are
+    Parquet when pyarrow is installed; the json.gz fallback is for local
+    runs only, since the Glue table expects Parquet.
+    """
+
+    def __init__(self, files, source_prefix='events/', rollup_prefix=ROLLUP_PREFIX, file_format=None,
+                 lateness_minutes=15, manifest=None):
+        self.files = files
+        self.source_prefix = source_prefix
+        self.rollup_prefix = rollup_prefix
+        self.file_format = file_format or ('parquet' if pa is not None else 'json.gz')
+        if isinstance(files, S3Files) and self.file_format != 'parquet':
+            raise RuntimeError('pyarrow is required to write rollups Athena can read')
+        self.lateness = timedelta(minutes=lateness_minutes)
+        self.manifest = manifest  # Optional WatermarkManifest for the rollup table
+
+    def source_partitions(self, since=None, now=None):
+        """Source hour partitions, only those in days from `since` onwards when given"""
+        if since is None:
+            partitions = self.files.partitions(self.source_prefix)
+        else:
+            # One listing per day keeps scheduled builds from walking the whole table
+            partitions = []
+            day = since.replace(hour=0, minute=0, second=0, microsecond=0)
+            while day <= (now or datetime.now(timezone.utc)):
+                # Padded (Firehose style) and unpadded (Spark partitionBy) spellings of the day
+                for day_path in dict.fromkeys((f'year={day:%Y}/month={day:%m}/day={day:%d}',
+                                               f'year={day.year}/month={day.month}/day={day.day}')):
+                    partitions.extend(f'{day_path}/{p}' for p in self.files.partitions(f'{self.source_prefix}{day_path}/'))
+                day += timedelta(days=1)
+        partitions = [p for p in partitions if PARTITION_PATTERN.search(p)]
+        return sorted(p for p in partitions if since is None or partition_start(p) + timedelta(hours=1) > since)
+
+    def completed_partitions(self, now=None, since=None):
+        now = now or datetime.now(timezone.utc)
+        cutoff = now - self.lateness
+        return [p for p in self.source_partitions(since, now) if partition_start(p) + timedelta(hours=1) <= cutoff]
+
+    def signature(self, partition, files=None):
+        if files is None:
+            files = self.files.files(f'{self.source_prefix}{partition}')
+        digest = hashlib.sha1()
+        for name, size in files.items():
+            digest.update(f'{name}:{size}\n'.encode('utf-8'))
+        return digest.hexdigest()
+
+    def load_marker(self, partition):
+        return self.files.manifests.get(f'{self.rollup_prefix}{rollup_partition(partition)}/{MARKER_NAME}')
+
+    def is_current(self, partition):
+        """True when the hour's rollup was built from its current source files"""
+        marker = self.load_marker(partition)
+        return marker is not None and marker.get('source_signature') == self.signature(partition)
+
+    def build_partition(self, partition, force=False):
+        """(Re)build the rollup for one source hour; returns a report"""
+        source = f'{self.source_prefix}{partition}'
+        source_files = self.files.files(source)
+        signature = self.signature(partition, source_files)
+        marker = self.load_marker(partition)
+        report = {'partition': partition, 'built': False, 'source_rows': None, 'rollup_rows': None,
+                  'source_bytes': None, 'rollup_bytes': None}
+        if marker and marker.get('source_signature') == signature and not force:
+            report.update({k: marker.get(k) for k in ('source_rows', 'rollup_rows', 'source_bytes', 'rollup_bytes')})
+            return report
+
+        events = []
+        for name in source_files:
+            events.extend(self.files.read(f'{source}/{name}'))
+        rows = summarize(events)
+
+        target = f'{self.rollup_prefix}{rollup_partition(partition)}'
+        staging = self.files.staging(target)
+        schema = pa.schema([(name, getattr(pa, kind)()) for name, kind in ROLLUP_COLUMNS]) if pa else None
+        writer = PartitionFileWriter(staging, signature[:12], 64 * MB, self.file_format, schema=schema)
+        for row in rows:
+            writer.write(row)
+        new_files = writer.close()
+        rollup_bytes = sum(os.path.getsize(os.path.join(staging, name)) for name in new_files)
+
+        # Publish the new file before dropping the old ones so readers never see an empty hour
+        old_files = [name for name in self.files.files(target) if name not in new_files]
+        for name in new_files:
+            self.files.publish(os.path.join(staging, name), f'{target}/{name}')
+        shutil.rmtree(staging, ignore_errors=True)
+        for name in old_files:
+            self.files.delete(f'{target}/{name}')
+
+        timestamps = [str(e['timestamp']) for e in events if e.get('timestamp')]
+        report.update({
+            'built': True,
+            'source_rows': len(events),
+            'rollup_rows': len(rows),
+            'source_bytes': sum(source_files.values()),
+            'rollup_bytes': rollup_bytes
+        })
+        marker = {'source_signature': signature, 'files': new_files, 'built_at': datetime.utcnow().isoformat(),
+                  **{k: report[k] for k in ('source_rows', 'rollup_rows', 'source_bytes', 'rollup_bytes')}}
+        self.files.manifests.put(f'{target}/{MARKER_NAME}', marker)
+
+        if self.manifest is not None:
+            self.manifest.record_partition(rollup_partition(partition), len(rows), max_event_time=max(timestamps) if timestamps else None,
+                                           bytes_written=report['rollup_bytes'], replace=True)
+        return report
+
+    def run(self, now=None, force=False, lookback_hours=None):
+        """Build every completed hour, or only those in the last lookback_hours"""
+        now = now or datetime.now(timezone.utc)
+        since = now - timedelta(hours=lookback_hours) if lookback_hours else None
+        reports = [self.build_partition(p, force) for p in self.completed_partitions(now, since)]
+        totals = {
+            'partitions': len(reports),
+            'partitions_built': sum(1 for r in reports if r['built']),
+            'source_bytes': sum(r['source_bytes'] or 0 for r in reports),
+            'rollup_bytes': sum(r['rollup_bytes'] or 0 for r in reports)
+        }
+        return {'partitions': reports, 'totals': totals}
+
+    def verified_cutoff(self, now=None, since=None):
+        """Newest hour up to which every completed source hour has a current rollup
+
+        Stops at the first hour that is unbuilt or has changed since its
+        rollup (late data, compaction), so a rewrite never serves a stale
+        hour from rollups. Hours before `since` are not checked. Returns
+        None when no hour qualifies.
+        """
+        cutoff = None
+        for partition in self.completed_partitions(now, since):
+            if not self.is_current(partition):
+                break
+            cutoff = partition_start(partition)
+        return cutoff
+
+
+class RollupReader:
+    """Answers dashboard aggregates from rollup files instead of raw events"""
+
+    def __init__(self, files, rollup_prefix=ROLLUP_PREFIX):
+        self.files = files
+        self.rollup_prefix = rollup_prefix
+        self.bytes_read = 0
+
+    def partitions(self, start=None, end=None):
+        """Rollup partitions whose hour starts in [start, end)"""
+        return [p for p in self.files.partitions(self.rollup_prefix) if PARTITION_PATTERN.search(p)
+                and (start is None or partition_start(p) >= start) and (end is None or partition_start(p) < end)]
+
+    def rows(self, start=None, end=None, level=None):
+        for partition in self.partitions(start, end):
+            prefix = f'{self.rollup_prefix}{partition}'
+            for name, size in self.files.files(prefix).items():
+                self.bytes_read += size
+                for row in self.files.read(f'{prefix}/{name}'):
+                    if level is None or row['rollup_level'] == level:
+                        yield row
+
+    def aggregate(self, start=None, end=None, by=(), where=None):
+        """Sum cube counts grouped by the given dimensions, filtered by {dimension: value}"""
+        groups = {}
+        for row in self.rows(start, end, 'cube'):
+            if where and any(row.get(dimension) != value for dimension, value in where.items()):
+                continue
+            key = tuple(row.get(dimension) for dimension in by)
+            totals = groups.setdefault(key, {'events': 0, 'purchases': 0, 'revenue': 0.0, 'null_user_events': 0})
+            totals['events'] += row['event_count']
+            totals['purchases'] += row['purchases']
+            totals['revenue'] += row['revenue']
+            totals['null_user_events'] += row['null_user_events']
+        return [{**dict(zip(by, key)), **totals, 'revenue': round(totals['revenue'], 2)}
+                for key, totals in sorted(groups.items(), key=lambda item: -item[1]['events'])]
+
+    def unique_users(self, start=None, end=None, dimension=None, value=None):
+        """Merged HyperLogLog estimate over the range, overall or for one dimension value"""
+        level = dimension or 'total'
+        merged = HyperLogLog(SKETCH_P)
+        for row in self.rows(start, end, level):
+            if dimension is None or row.get(dimension) == value:
+                merged.merge(decode_sketch(row['users_hll']))
+        return merged.count()
+
+
+_QUERY = re.compile(
+    r'^\s*SELECT\s+(?P<select>.+?)\s+FROM\s+(?P<table>(?:(?P<database>\w+|"[\w-]+")\.)?(?P<name>\w+|"\w+"))'
+    r'(?:\s+WHERE\s+(?P<where>.+?))?'
+    r'(?:\s+GROUP\s+BY\s+(?P<group>.+?))?'
+    r'(?:\s+ORDER\s+BY\s+(?P<order>[\w\s,]+?))?'
+    r'(?:\s+LIMIT\s+(?P<limit>\d+))?\s*;?\s*$',
+    re.IGNORECASE | re.DOTALL
+)
+_COUNT = re.compile(r'^COUNT\s*\(\s*\*\s*\)(?:\s+AS\s+(\w+))?$', re.IGNORECASE)
+_PARTITION_CONDITION = re.compile(r'^(year|month|day|hour)\s*(=|<=|>=|<|>)\s*[\w\s()+-]+$', re.IGNORECASE)
+_DIMENSION_CONDITION = re.compile(
+    r"^(%s)\s*(=\s*'[^']*'|IN\s*\(\s*'[^']*'(?:\s*,\s*'[^']*')*\s*\))$" % '|'.join(DIMENSIONS), re.IGNORECASE
+)
+_NULL_USER = re.compile(r'^user_id\s+IS\s+NULL$', re.IGNORECASE)
+
+
+def rewrite_query(sql, cutoff, rollup_table=ROLLUP_TABLE, database=None, source_database=None, since=None):
+    """Rewrite a COUNT(*) query on events_processed to read rollups up to `cutoff`
+
+    Supported: dimension columns plus COUNT(*) in the select list,
+    partition predicates, equality/IN filters on dimensions and
+    `user_id IS NULL`, joined by AND, with GROUP BY/ORDER BY/LIMIT. Hours up
+    to and including the cutoff hour come from the rollup table; later
+    hours still come from the raw table, so results match the original
+    query. When the cutoff was verified only from `since` on (see
+    verified_cutoff), hours before since's hour also stay on the raw table. Rollups are built from events_processed only, so any other
+    table is left alone; with source_database set, so is a query whose
+    table (qualified, or via `database`, the one it runs in) lives elsewhere.
+    Returns None when the query is not supported or there is no cutoff.
+    """
+    match = _QUERY.match(sql)
+    if cutoff is None or not match or match.group('name').strip('"').lower() != SOURCE_TABLE:
+        return None
+    if source_database is not None:
+        table_database = (match.group('database') or '').strip('"') or database
+        if table_database != source_database:
+            return None
+
+    dimensions = []
+    count_alias = None
+    for item in (part.strip() for part in match.group('select').split(',')):
+        count = _COUNT.match(item)
+        if count and count_alias is None:
+            count_alias = count.group(1) or 'count'
+        elif item.lower() in DIMENSIONS and item.lower() not in dimensions:
+            dimensions.append(item.lower())
+        else:
+            return None
+    if count_alias is None:
+        return None
+
+    group = [part.strip().lower() for part in (match.group('group') or '').split(',') if part.strip()]
+    if sorted(group) != sorted(dimensions):
+        return None
+
+    where = match.group('where')
+    raw_conditions = re.split(r'\s+AND\s+', where.strip(), flags=re.IGNORECASE) if where else []
+    conditions = []
+    measure = 'event_count'
+    for condition in raw_conditions:
+        if _NULL_USER.match(condition):
+            measure = 'null_user_events'
+        elif (_PARTITION_CONDITION.match(condition) or _DIMENSION_CONDITION.match(condition)) \
+                and not re.search(r'\bOR\b', condition, re.IGNORECASE):
+            conditions.append(condition)
+        else:
+            return None
+
+    hour_key = '(year * 1000000 + month * 10000 + day * 100 + hour)'
+    cutoff_key = f'{cutoff:%Y%m%d%H}'
+    select = ', '.join(dimensions + ['{} AS rollup_count'])
+    group_by = f"\n    GROUP BY {', '.join(dimensions)}" if dimensions else ''
+
+    rollup_range = [f'{hour_key} <= {cutoff_key}']
+    raw_range = f'{hour_key} > {cutoff_key}'
+    if since is not None:
+        since_key = f'{since:%Y%m%d%H}'
+        rollup_range.insert(0, f'{hour_key} >= {since_key}')
+        raw_range = f'({hour_key} < {since_key} OR {raw_range})'
+
+    rollup_where = ' AND '.join([f"rollup_level = 'cube'"] + conditions + rollup_range)
+    raw_where = ' AND '.join(raw_conditions + [raw_range])
+
+    outer_select = ', '.join(dimensions + [f'SUM(rollup_count) AS {count_alias}'])
+    query = (
+        f"SELECT {outer_select}\nFROM (\n"
+        f"    SELECT {select.format(f'SUM({measure})')}\n    FROM {rollup_table}\n    WHERE {rollup_where}{group_by}\n"
+        f"    UNION ALL\n"
+        f"    SELECT {select.format('COUNT(*)')}\n    FROM {match.group('table')}\n    WHERE {raw_where}{group_by}\n"
+        f")"
+    )
+    if dimensions:
+        query += f"\nGROUP BY {', '.join(dimensions)}"
+    if match.group('order'):
+        query += f"\nORDER BY {match.group('order').strip()}"
+    if match.group('limit'):
+        query += f"\nLIMIT {match.group('limit')}"
+    return query
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Hourly rollup tables for day-level analytics queries')
+    parser.add_argument('--root', default='./data/processed', help='Local directory standing in for the S3 bucket')
+    parser.add_argument('--bucket', help='Read and write this S3 bucket instead of --root')
+    parser.add_argument('--prefix', default='events/', help='Source table prefix inside the bucket')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build = subparsers.add_parser('build', help='Build rollups for completed hours')
+    build.add_argument('--lateness-minutes', type=float, default=15, help='Wait this long after an hour ends')
+    build.add_argument('--format', choices=['json.gz', 'parquet'], help='Rollup file format (default: parquet if available)')
+    build.add_argument('--force', action='store_true', help='Rebuild hours whose source did not change')
+    build.add_argument('--lookback-hours', type=float, help='Only check hours this recent (default: all)')
+
+    rewrite = subparsers.add_parser('rewrite', help='Show the rollup rewrite of an Athena query')
+    rewrite.add_argument('sql', help='Query to rewrite')
+    rewrite.add_argument('--cutoff', help="Newest rolled-up hour, e.g. 2024-06-01T13 (default: newest verified hour)")
+    rewrite.add_argument('--verify-hours', type=float,
+                         help='Only verify rollups this recent; older hours are read from the raw table (default: all)')
+    rewrite.add_argument('--rollup-table', default=ROLLUP_TABLE, help='Rollup table name, optionally database-qualified')
+
+    query = subparsers.add_parser('query', help='Day summary read from local rollups')
+    query.add_argument('--date', default=datetime.now(timezone.utc).strftime('%Y-%m-%d'), help='UTC day (YYYY-MM-DD)')
+
+    args = parser.parse_args()
+    if args.bucket:
+        import boto3
+        files = S3Files(boto3.client('s3'), args.bucket)
+    else:
+        files = LocalFiles(args.root)
+    manifest = WatermarkManifest(files.manifests, ROLLUP_PREFIX)
+
+    if args.command == 'build':
+        builder = RollupBuilder(files, args.prefix, file_format=args.format,
+                                lateness_minutes=args.lateness_minutes, manifest=manifest)
+        result = builder.run(force=args.force, lookback_hours=args.lookback_hours)
+        print("🧮 Rollup Build")
+        print("=" * 50)
+        for report in result['partitions']:
+            status = '✅' if report['built'] else '⏭️ '
+            print(f"{status} {report['partition']}: {report['source_rows']:,} events → "
+                  f"{report['rollup_rows']:,} rollup rows ({report['rollup_bytes']:,} bytes)")
+        totals = result['totals']
+        print("=" * 50)
+        print(f"Partitions built: {totals['partitions_built']}/{totals['partitions']}")
+        print(f"Bytes: {totals['source_bytes']:,} source → {totals['rollup_bytes']:,} rollup")
+
+    elif args.command == 'rewrite':
+        since = datetime.now(timezone.utc) - timedelta(hours=args.verify_hours) if args.verify_hours else None
+        if args.cutoff:
+            cutoff = datetime.strptime(args.cutoff, '%Y-%m-%dT%H').replace(tzinfo=timezone.utc)
+        else:
+            cutoff = RollupBuilder(files, args.prefix).verified_cutoff(since=since)
+        rewritten = rewrite_query(args.sql, cutoff, args.rollup_table, since=since)
+        if rewritten is None:
+            print("⚠️  Query not rewritten (unsupported shape or no rollups yet)")
+        else:
+            print(rewritten)
+
+    else:
+        start = datetime.strptime(args.date, '%Y-%m-%d').replace(tzinfo=timezone.utc)
+        end = start + timedelta(days=1)
+        reader = RollupReader(files)
+        totals = reader.aggregate(start, end)
+        by_type = reader.aggregate(start, end, by=('event_type',))
+        users = reader.unique_users(start, end)
+        builder = RollupBuilder(files, args.prefix)
+        markers = [builder.load_marker(p) or {} for p in reader.partitions(start, end)]
+        raw_bytes = sum(marker.get('source_bytes') or 0 for marker in markers)
+        rollup_bytes = sum(marker.get('rollup_bytes') or 0 for marker in markers)
+
+        print(f"📅 {args.date} from rollups")
+        print("=" * 50)
+        if not totals:
+            print("No rollups for this day; run the build command first")
+        else:
+            print(f"Events: {totals[0]['events']:,}  Purchases: {totals[0]['purchases']:,}  "
+                  f"Revenue: ${totals[0]['revenue']:,.2f}  Unique users: ~{users:,}")
+            for row in by_type:
+                print(f"  {row['event_type']}: {row['events']:,}")
+            print(f"Rollups for the day: {rollup_bytes:,} bytes, instead of {raw_bytes:,} bytes of events")
@@ -0,0 +1,199 @@
+import time
+import threading
+
+from sketches import HyperLogLog, hash64
+from event_sources import event_time
+
+# name -> (step seconds, slots kept, HyperLogLog precision for active users)
+DEFAULT_RESOLUTIONS = {
+    'second': (1, 3600, 8),
+    'minute': (60, 24 * 60, 10),
+    'hour': (3600, 24 * 30, 12)
+}
+DEFAULT_POINTS = 300
+MAX_POINTS = 10000
+
+
+class RingSeries:
+    """Fixed ring of time buckets at one resolution
+
+    Slot i holds the bucket starting at starts[i]; writing to a bucket that
+    maps onto an older one's slot clears it first, so retention is
+    `slots * step` seconds with no separate expiry pass.
+    """
+
+    def __init__(self, step, slots, hll_p=10):
+        self.step = step
+        self.slots = slots
+        self.hll_p = hll_p
+        self.starts = [-1] * slots
+        self.values = {}           # metric -> [value per slot]
+        self.users = [None] * slots
+
+    def _slot(self, ts):
+        start = int(ts) - int(ts) % self.step
+        index = (start // self.step) % self.slots
+        current = self.starts[index]
+        if current != start:
+            if current > start:
+                return None  # Older than retention
+            self.starts[index] = start
+            for values in self.values.values():
+                values[index] = 0
+            self.users[index] = None
+        return index
+
+    def add(self, ts, counts, user_hash=None):
+        index = self._slot(ts)
+        if index is None:
+            return False
+        values = self.values
+        for metric, value in counts:
+            series = values.get(metric)
+            if series is None:
+                series = values[metric] = [0] * self.slots
+            series[index] += value
+        if user_hash is not None:
+            users = self.users[index]
+            if users is None:
+                users = self.users[index] = HyperLogLog(self.hll_p)
+            users.add_hash(user_hash)
+        return True
+
+    def oldest(self, now):
+        """Start of the oldest bucket this ring can still hold"""
+        latest = int(now) - int(now) % self.step
+        return latest - (self.slots - 1) * self.step
+
+    def buckets(self, start, end):
+        """Slot indexes of the live buckets in [start, end), in time order"""
+        step = self.step
+        first = int(start) - int(start) % step
+        # Never walk more than one full ring, whatever range was asked for
+        floor = int(end) - self.slots * step
+        first = max(first, floor - floor % step)
+        for bucket_start in range(first, int(end), step):
+            index = (bucket_start // step) % self.slots
+            if self.starts[index] == bucket_start:
+                yield bucket_start, index
+
+
+class RollupStore:
+    """Pre-aggregated event counts, revenue and active users for charts
+
+    Every event updates one bucket per resolution (seconds, minutes, hours),
+    so ingest costs a few dict updates and a range query only touches the
+    buckets it returns, never the raw events. Metrics are `events`,
+    `events.<event_type>`, `revenue` and `active_users`.
+    """
+
+    def __init__(self, resolutions=None, clock=time.time):
+        self.resolutions = {
+            name: RingSeries(step, slots, hll_p)
+            for name, (step, slots, hll_p) in (resolutions or DEFAULT_RESOLUTIONS).items()
+        }
+        # Coarsest first, for resolution selection
+        self._by_step = sorted(self.resolutions.items(), key=lambda kv: kv[1].step, reverse=True)
+        self.clock = clock
+        self._lock = threading.Lock()
+        self.stats = {'events': 0, 'dropped_late': 0}
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def update(self, event, ts=None):
+        if ts is None:
+            ts = event_time(event)
+            if ts is None:
+                ts = self.clock()
+        event_type = event.get('event_type', 'unknown')
+        counts = [('events', 1), (f'events.{event_type}', 1)]
+        if event_type == 'purchase':
+            counts.append(('revenue', float((event.get('properties') or {}).get('total_amount') or 0)))
+        user_id = event.get('user_id')
+        user_hash = hash64(user_id) if user_id else None
+
+        with self._lock:
+            self.stats['events'] += 1
+            for series in self.resolutions.values():
+                if not series.add(ts, counts, user_hash):
+                    self.stats['dropped_late'] += 1
+
+    def metrics(self):
+        names = set()
+        for series in self.resolutions.values():
+            names.update(series.values)
+        return sorted(names) + ['active_users']
+
+    def choose_resolution(self, start, step, now=None):
+        """Coarsest resolution no wider than `step` that still holds `start`"""
+        now = self.clock() if now is None else now
+        fitting = [(name, s) for name, s in self._by_step if s.step <= step]
+        for name, series in fitting:
+            if series.oldest(now) <= start:
+                return name
+        # Nothing fine enough reaches back that far: use the finest that does
+        for name, series in reversed(self._by_step):
+            if series.oldest(now) <= start:
+                return name
+        return self._by_step[0][0]
+
+    def query(self, metric, start=None, end=None, step=None):
+        """Points of `metric` between start and end (epoch seconds), one per `step`"""
+        now = self.clock()
+        end = now if end is None else end
+        start = end - 3600 if start is None else start
+        if end <= start:
+            raise ValueError('from must be before to')
+        if step is None:
+            step = max(1, int((end - start) / DEFAULT_POINTS))
+
+        name = self.choose_resolution(start, step, now)
+        series = self.resolutions[name]
+        # Output buckets are whole multiples of the source resolution
+        step = max(series.step, int(step) - int(step) % series.step)
+        first = int(start) - int(start) % step
+        if (end - first) / step > MAX_POINTS:
+            raise ValueError(f'Range too large for step {step}s (max {MAX_POINTS} points)')
+        points = {t: None for t in range(first, int(end), step)}
+
+        with self._lock:
+            if metric == 'active_users':
+                merged = {}
+                for bucket_start, index in series.buckets(first, end):
+                    users = series.users[index]
+                    if users is None:
+                        continue
+                    point = bucket_start - (bucket_start - first) % step
+                    if point in merged:
+                        merged[point].merge(users)
+                    else:
+                        merged[point] = HyperLogLog(series.hll_p).merge(users)
+                values = {t: hll.count() for t, hll in merged.items()}
+            else:
+                values = {}
+                source = series.values.get(metric)
+                if source is not None:
+                    for bucket_start, index in series.buckets(first, end):
+                        point = bucket_start - (bucket_start - first) % step
+                        values[point] = values.get(point, 0) + source[index]
+
+        oldest = series.oldest(now)
+        for t in points:
+            if t + step > oldest:
+                # Inside retention: no bucket means nothing happened
+                points[t] = values.get(t, 0)
+        return {
+            'metric': metric,
+            'resolution': name,
+            'step': step,
+            'from': first,
+            'to': int(end),
+            'points': [[t, round(v, 2) if isinstance(v, float) else v] for t, v in points.items()]
+        }
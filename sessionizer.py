@@ -0,0 +1,325 @@
+import json
+import time
+import random
+import argparse
+from datetime import datetime, timezone
+
+from event_sources import event_time, iter_replay_file, iter_kinesis_events
+
+
+class Session:
+    """Running aggregate for one session window"""
+
+    __slots__ = ('key', 'user_id', 'session_id', 'start', 'end', 'event_count', 'page_views',
+                 'cart_adds', 'converted', 'revenue', 'landing_page', 'exit_page',
+                 'device_type', 'country')
+
+    def __init__(self, key, event, ts):
+        self.key = key
+        self.user_id = event.get('user_id')
+        self.session_id = event.get('session_id')
+        self.start = ts
+        self.end = ts
+        self.event_count = 0
+        self.page_views = 0
+        self.cart_adds = 0
+        self.converted = False
+        self.revenue = 0.0
+        self.landing_page = None
+        self.exit_page = None
+        self.device_type = event.get('device_type')
+        self.country = event.get('country')
+
+    def add(self, event, ts):
+        self.event_count += 1
+        event_type = event.get('event_type')
+
+        if event_type == 'page_view':
+            self.page_views += 1
+            page = (event.get('properties') or {}).get('page')
+            # Out-of-order arrival: only move landing/exit pages outward in time
+            if self.landing_page is None or ts <= self.start:
+                self.landing_page = page
+            if self.exit_page is None or ts >= self.end:
+                self.exit_page = page
+        elif event_type == 'add_to_cart':
+            self.cart_adds += 1
+        elif event_type == 'purchase':
+            self.converted = True
+            self.revenue += float((event.get('properties') or {}).get('total_amount') or 0)
+
+        if ts < self.start:
+            self.start = ts
+        if ts > self.end:
+            self.end = ts
+
+    def merge(self, other):
+        """Absorb a session that an out-of-order event bridged into this one"""
+        if other.start < self.start:
+            self.start = other.start
+            self.landing_page = other.landing_page or self.landing_page
+        if other.end > self.end:
+            self.end = other.end
+            self.exit_page = other.exit_page or self.exit_page
+        self.event_count += other.event_count
+        self.page_views += other.page_views
+        self.cart_adds += other.cart_adds
+        self.converted = self.converted or other.converted
+        self.revenue += other.revenue
+
+    def to_record(self, reason='gap'):
+        return {
+            'session_id': self.session_id,
+            'user_id': self.user_id,
+            'session_start': datetime.fromtimestamp(self.start, timezone.utc).isoformat(),
+            'session_end': datetime.fromtimestamp(self.end, timezone.utc).isoformat(),
+            'duration_seconds': round(self.end - self.start, 3),
+            'event_count': self.event_count,
+            'page_views': self.page_views,
+            'cart_adds': self.cart_adds,
+            'bounce': self.event_count == 1,
+            'converted': self.converted,
+            'revenue': round(self.revenue, 2),
+            'landing_page': self.landing_page,
+            'exit_page': self.exit_page,
+            'device_type': self.device_type,
+            'country': self.country,
+            'close_reason': reason
+        }
+
+
+class Sessionizer:
+    """Streaming session windows keyed by user_id/session_id
+
+    Sessions close after `gap_seconds` of inactivity in event-time. The
+    watermark trails the highest event-time seen by `allowed_lateness`
+    seconds; events behind it that cannot join an open session are late.
+    Expiry is driven by a timer wheel of one-second buckets, so closing
+    sessions costs O(1) per event and memory is bounded by the number of
+    sessions open inside the gap (capped at `max_open_sessions`).
+    """
+
+    def __init__(self, gap_seconds=1800, allowed_lateness=60, max_open_sessions=1000000,
+                 on_session=None, on_late_event=None):
+        self.gap = gap_seconds
+        self.allowed_lateness = allowed_lateness
+        self.max_open_sessions = max_open_sessions
+        self.on_session = on_session or self._collect
+        self.on_late_event = on_late_event
+
+        self.open = {}          # key -> list of Session (usually one)
+        self.open_count = 0
+        self.timers = {}        # expiry second -> set of keys
+        self.next_timer = None  # Lowest second not yet fired
+        self.max_event_time = None
+        self.watermark = float('-inf')
+        self.output = []
+
+        self.stats = {
+            'events': 0,
+            'late_events': 0,
+            'invalid_events': 0,
+            'sessions_emitted': 0,
+            'sessions_evicted': 0,
+            'sessions_merged': 0
+        }
+
+    def _collect(self, record):
+        self.output.append(record)
+
+    def drain(self):
+        """Return and clear sessions collected by the default sink"""
+        records, self.output = self.output, []
+        return records
+
+    def _schedule(self, key, session):
+        second = int(session.end + self.gap) + 1
+        keys = self.timers.get(second)
+        if keys is None:
+            self.timers[second] = {key}
+        else:
+            keys.add(key)
+        if self.next_timer is None or second < self.next_timer:
+            self.next_timer = second
+
+    def process(self, event):
+        ts = event_time(event)
+        if ts is None:
+            self.stats['invalid_events'] += 1
+            return
+        self.stats['events'] += 1
+
+        key = event.get('session_id') or event.get('user_id') or 'anonymous'
+        sessions = self.open.get(key)
+        gap = self.gap
+
+        if sessions is None:
+            if ts < self.watermark:
+                self._late(event)
+                return
+            session = Session(key, event, ts)
+            session.add(event, ts)
+            self.open[key] = [session]
+            self.open_count += 1
+        else:
+            # Find every open session this event falls within gap of
+            hits = [s for s in sessions if s.start - gap <= ts <= s.end + gap]
+            if not hits:
+                if ts < self.watermark:
+                    self._late(event)
+                    return
+                session = Session(key, event, ts)
+                sessions.append(session)
+                self.open_count += 1
+            else:
+                session = hits[0]
+                for other in hits[1:]:
+                    session.merge(other)
+                    sessions.remove(other)
+                    self.open_count -= 1
+                    self.stats['sessions_merged'] += 1
+            session.add(event, ts)
+
+        self._schedule(key, session)
+
+        if self.max_event_time is None or ts > self.max_event_time:
+            self.max_event_time = ts
+            watermark = ts - self.allowed_lateness
+            if watermark > self.watermark:
+                self.advance_watermark(watermark)
+
+        if self.open_count > self.max_open_sessions:
+            self._evict_oldest()
+
+    def _late(self, event):
+        self.stats['late_events'] += 1
+        if self.on_late_event:
+            self.on_late_event(event)
+
+    def advance_watermark(self, watermark):
+        """Fire every timer at or below the new watermark"""
+        self.watermark = watermark
+        if self.next_timer is None or self.next_timer > watermark:
+            return
+
+        limit = int(watermark)
+        if limit - self.next_timer > len(self.timers):
+            due = sorted(s for s in self.timers if s <= limit)
+        else:
+            due = range(self.next_timer, limit + 1)
+
+        for second in due:
+            keys = self.timers.pop(second, None)
+            if keys:
+                for key in keys:
+                    self._expire(key, watermark)
+
+        self.next_timer = min(self.timers) if self.timers else None
+
+    def _expire(self, key, watermark, reason='gap'):
+        sessions = self.open.get(key)
+        if not sessions:
+            return
+        remaining = []
+        for session in sessions:
+            if session.end + self.gap < watermark or reason != 'gap':
+                self._emit(session, reason)
+            else:
+                remaining.append(session)
+        if remaining:
+            self.open[key] = remaining
+        else:
+            del self.open[key]
+
+    def _emit(self, session, reason):
+        self.open_count -= 1
+        self.stats['sessions_emitted'] += 1
+        if reason == 'evicted':
+            self.stats['sessions_evicted'] += 1
+        self.on_session(session.to_record(reason))
+
+    def _evict_oldest(self):
+        """Memory cap reached: close sessions in expiry order before their gap elapses"""
+        while self.open_count > self.max_open_sessions and self.timers:
+            second = min(self.timers)
+            for key in self.timers.pop(second):
+                self._expire(key, self.watermark, reason='evicted')
+        self.next_timer = min(self.timers) if self.timers else None
+
+    def flush(self):
+        """Close all open sessions, e.g. at the end of a replay"""
+        for key in list(self.open):
+            self._expire(key, float('inf'), reason='flush')
+        self.timers.clear()
+        self.next_timer = None
+
+
+def generate_benchmark_events(count, users=10000, events_per_second=2000):
+    """Synthetic, slightly out-of-order events for throughput testing"""
+    event_types = ['page_view', 'click', 'search', 'add_to_cart', 'checkout', 'purchase']
+    weights = [0.5, 0.25, 0.1, 0.08, 0.04, 0.03]
+    start = time.time() - count / events_per_second
+    events = []
+    for i in range(count):
+        user = random.randint(1, users)
+        ts = start + i / events_per_second - random.random() * 5  # Up to 5s out of order
+        event_type = random.choices(event_types, weights)[0]
+        events.append({
+            'event_type': event_type,
+            'user_id': f'user_{user}',
+            'session_id': f'session_{user}',
+            'timestamp': datetime.fromtimestamp(ts, timezone.utc).isoformat(),
+            'properties': {'page': '/', 'total_amount': 10.0} if event_type in ('page_view', 'purchase') else {}
+        })
+    return events
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Streaming sessionization of clickstream events')
+    parser.add_argument('--replay', help='Replay file or directory (export, snapshot directory, Firehose output)')
+    parser.add_argument('--benchmark', type=int, help='Run a throughput benchmark with N synthetic events')
+    parser.add_argument('--gap', type=int, default=1800, help='Inactivity gap in seconds')
+    parser.add_argument('--lateness', type=int, default=60, help='Allowed lateness in seconds')
+    parser.add_argument('--output', help='Write session records to this NDJSON file')
+
+    args = parser.parse_args()
+
+    if args.benchmark:
+        events = generate_benchmark_events(args.benchmark)
+        sessionizer = Sessionizer(gap_seconds=args.gap, allowed_lateness=args.lateness, on_session=lambda r: None)
+        start = time.perf_counter()
+        for event in events:
+            sessionizer.process(event)
+        sessionizer.flush()
+        elapsed = time.perf_counter() - start
+        print(f"⚡ {len(events):,} events in {elapsed:.2f}s → {len(events) / elapsed:,.0f} events/sec")
+        print(f"📊 {sessionizer.stats}")
+    else:
+        if args.replay:
+            source = iter_replay_file(args.replay)
+        else:
+            from local_kinesis import LocalKinesisStream
+            print("ℹ️  No --replay given; reading from an empty local Kinesis stream")
+            source = iter_kinesis_events(LocalKinesisStream())
+
+        sessionizer = Sessionizer(gap_seconds=args.gap, allowed_lateness=args.lateness)
+        for event in source:
+            sessionizer.process(event)
+        sessionizer.flush()
+        sessions = sessionizer.drain()
+
+        if args.output:
+            with open(args.output, 'w') as f:
+                for record in sessions:
+                    f.write(json.dumps(record) + '\n')
+            print(f"💾 Wrote {len(sessions)} sessions to {args.output}")
+
+        print(f"👥 Sessions: {len(sessions)}")
+        if sessions:
+            bounces = sum(1 for s in sessions if s['bounce'])
+            conversions = sum(1 for s in sessions if s['converted'])
+            print(f"⏱️  Avg duration: {sum(s['duration_seconds'] for s in sessions) / len(sessions):.1f}s")
+            print(f"📄 Avg pages/session: {sum(s['page_views'] for s in sessions) / len(sessions):.2f}")
+            print(f"↩️  Bounce rate: {bounces / len(sessions) * 100:.1f}%")
+            print(f"💰 Conversion rate: {conversions / len(sessions) * 100:.1f}%")
+        print(f"📊 {sessionizer.stats}")
@@ -0,0 +1,303 @@
+import math
+import heapq
+import base64
+import hashlib
+from array import array
+from collections import OrderedDict
+
+from event_sources import event_time
+
+MASK64 = (1 << 64) - 1
+
+
+def hash64(value):
+    """Stable 64-bit hash, identical across processes so sketches can merge"""
+    return int.from_bytes(hashlib.blake2b(str(value).encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+def _encode(buffer):
+    return base64.b64encode(buffer.tobytes() if hasattr(buffer, 'tobytes') else bytes(buffer)).decode('ascii')
+
+
+class HyperLogLog:
+    """Distinct-count estimator in 2^p one-byte registers (~1.04/sqrt(2^p) error)"""
+
+    def __init__(self, p=14):
+        self.p = p
+        self.m = 1 << p
+        self.registers = bytearray(self.m)
+        self._shift = 64 - p
+        self._low_mask = (1 << self._shift) - 1
+
+    def add(self, value):
+        self.add_hash(hash64(value))
+
+    def add_hash(self, h):
+        index = h >> self._shift
+        rank = self._shift - (h & self._low_mask).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def count(self):
+        m = self.m
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        # Linear counting is more accurate while many registers are empty
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+    def merge(self, other):
+        if other.p != self.p:
+            raise ValueError('Cannot merge HyperLogLogs with different precision')
+        registers = self.registers
+        for i, r in enumerate(other.registers):
+            if r > registers[i]:
+                registers[i] = r
+        return self
+
+    def to_dict(self):
+        return {'type': 'hll', 'p': self.p, 'registers': _encode(self.registers)}
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(data['p'])
+        sketch.registers = bytearray(base64.b64decode(data['registers']))
+        return sketch
+
+
+class CountMinSketch:
+    """Frequency estimates that never undercount, in depth x width counters"""
+
+    def __init__(self, width=1024, depth=4):
+        self.width = width
+        self.depth = depth
+        self.counters = array('q', bytes(8 * width * depth))
+        self.total = 0
+
+    def _cells(self, h):
+        # Kirsch-Mitzenmacher: derive every row's index from two halves of one hash
+        h1 = h & 0xffffffff
+        h2 = h >> 32
+        width = self.width
+        return [row * width + (h1 + row * h2) % width for row in range(self.depth)]
+
+    def add_hash(self, h, count=1):
+        """Add and return the new estimate"""
+        counters = self.counters
+        estimate = None
+        for cell in self._cells(h):
+            value = counters[cell] + count
+            counters[cell] = value
+            if estimate is None or value < estimate:
+                estimate = value
+        self.total += count
+        return estimate
+
+    def add(self, value, count=1):
+        return self.add_hash(hash64(value), count)
+
+    def estimate_hash(self, h):
+        counters = self.counters
+        return min(counters[cell] for cell in self._cells(h))
+
+    def estimate(self, value):
+        return self.estimate_hash(hash64(value))
+
+    def merge(self, other):
+        if (other.width, other.depth) != (self.width, self.depth):
+            raise ValueError('Cannot merge Count-Min sketches with different dimensions')
+        counters = self.counters
+        for i, value in enumerate(other.counters):
+            if value:
+                counters[i] += value
+        self.total += other.total
+        return self
+
+    def to_dict(self):
+        return {'type': 'cms', 'width': self.width, 'depth': self.depth,
+                'total': self.total, 'counters': _encode(self.counters)}
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(data['width'], data['depth'])
+        sketch.counters = array('q')
+        sketch.counters.frombytes(base64.b64decode(data['counters']))
+        sketch.total = data['total']
+        return sketch
+
+
+class TopK:
+    """Heavy hitters: Count-Min estimates plus a bounded candidate heap of size k"""
+
+    def __init__(self, k=10, width=1024, depth=4):
+        self.k = k
+        self.cms = CountMinSketch(width, depth)
+        self.candidates = {}  # item -> estimated count
+        self._floor = 0       # Smallest estimate among candidates once full
+
+    def add(self, item, count=1):
+        estimate = self.cms.add(item, count)
+        candidates = self.candidates
+        if item in candidates:
+            candidates[item] = estimate
+        elif len(candidates) < self.k:
+            candidates[item] = estimate
+            if len(candidates) == self.k:
+                self._floor = min(candidates.values())
+        elif estimate > self._floor:
+            smallest = min(candidates, key=candidates.get)
+            del candidates[smallest]
+            candidates[item] = estimate
+            self._floor = min(candidates.values())
+
+    def top(self, n=None):
+        items = heapq.nlargest(n or self.k, self.candidates.items(), key=lambda kv: kv[1])
+        return [{'item': item, 'count': count} for item, count in items]
+
+    def merge(self, other):
+        self.cms.merge(other.cms)
+        pool = set(self.candidates) | set(other.candidates)
+        estimates = {item: self.cms.estimate(item) for item in pool}
+        self.candidates = dict(heapq.nlargest(self.k, estimates.items(), key=lambda kv: kv[1]))
+        self._floor = min(self.candidates.values()) if len(self.candidates) == self.k else 0
+        return self
+
+    def to_dict(self):
+        return {'type': 'topk', 'k': self.k, 'cms': self.cms.to_dict(), 'candidates': self.candidates}
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(data['k'])
+        sketch.cms = CountMinSketch.from_dict(data['cms'])
+        sketch.candidates = dict(data['candidates'])
+        sketch._floor = min(sketch.candidates.values()) if len(sketch.candidates) == sketch.k else 0
+        return sketch
+
+
+class ClickstreamSketches:
+    """The sketch set kept per time bucket: unique users/sessions and top items"""
+
+    TOP_FIELDS = ('product_id', 'query', 'page')
+
+    def __init__(self, p=14, k=10, width=1024, depth=4):
+        self.users = HyperLogLog(p)
+        self.sessions = HyperLogLog(p)
+        self.top = {field: TopK(k, width, depth) for field in self.TOP_FIELDS}
+        self.events = 0
+
+    def update(self, event, user_hash=None, session_hash=None):
+        self.events += 1
+        if user_hash is not None:
+            self.users.add_hash(user_hash)
+        if session_hash is not None:
+            self.sessions.add_hash(session_hash)
+        properties = event.get('properties') or {}
+        for field, sketch in self.top.items():
+            value = properties.get(field)
+            if value:
+                sketch.add(value)
+
+    def merge(self, other):
+        self.users.merge(other.users)
+        self.sessions.merge(other.sessions)
+        for field, sketch in self.top.items():
+            sketch.merge(other.top[field])
+        self.events += other.events
+        return self
+
+    def summary(self, n=5):
+        return {
+            'events': self.events,
+            'unique_users': self.users.count(),
+            'unique_sessions': self.sessions.count(),
+            'top_products': self.top['product_id'].top(n),
+            'top_queries': self.top['query'].top(n),
+            'top_pages': self.top['page'].top(n)
+        }
+
+    def to_dict(self):
+        return {
+            'events': self.events,
+            'users': self.users.to_dict(),
+            'sessions': self.sessions.to_dict(),
+            'top': {field: sketch.to_dict() for field, sketch in self.top.items()}
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        sketches = cls()
+        sketches.events = data['events']
+        sketches.users = HyperLogLog.from_dict(data['users'])
+        sketches.sessions = HyperLogLog.from_dict(data['sessions'])
+        sketches.top = {field: TopK.from_dict(d) for field, d in data['top'].items()}
+        return sketches
+
+
+class SketchStore:
+    """Hourly sketch buckets with bounded retention plus an all-time set
+
+    Memory is fixed by `retention_buckets` regardless of traffic. Daily (or
+    any range) rollups are built by merging the hourly buckets, and buckets
+    serialize to JSON so shards can ship them to each other and merge.
+    """
+
+    def __init__(self, bucket_seconds=3600, retention_buckets=48, **sketch_args):
+        self.bucket_seconds = bucket_seconds
+        self.retention_buckets = retention_buckets
+        self.sketch_args = sketch_args
+        self.buckets = OrderedDict()  # bucket start -> ClickstreamSketches
+        self.all_time = ClickstreamSketches(**sketch_args)
+
+    def update(self, event, ts=None):
+        if ts is None:
+            ts = event_time(event) or 0
+        start = int(ts // self.bucket_seconds * self.bucket_seconds)
+        bucket = self.buckets.get(start)
+        if bucket is None:
+            bucket = self.buckets[start] = ClickstreamSketches(**self.sketch_args)
+            if len(self.buckets) > self.retention_buckets:
+                self.buckets.pop(min(self.buckets))
+
+        # Hash ids once and share them between the bucket and all-time sketches
+        user_id = event.get('user_id')
+        session_id = event.get('session_id')
+        user_hash = hash64(user_id) if user_id else None
+        session_hash = hash64(session_id) if session_id else None
+        bucket.update(event, user_hash, session_hash)
+        self.all_time.update(event, user_hash, session_hash)
+
+    def rollup(self, start=None, end=None):
+        """Merge the buckets whose start falls in [start, end)"""
+        merged = ClickstreamSketches(**self.sketch_args)
+        for bucket_start, bucket in self.buckets.items():
+            if (start is None or bucket_start >= start) and (end is None or bucket_start < end):
+                merged.merge(bucket)
+        return merged
+
+    def merge(self, other):
+        """Fold another shard's store into this one"""
+        for start, bucket in other.buckets.items():
+            if start in self.buckets:
+                self.buckets[start].merge(bucket)
+            else:
+                self.buckets[start] = bucket
+        self.buckets = OrderedDict(sorted(self.buckets.items())[-self.retention_buckets:])
+        self.all_time.merge(other.all_time)
+        return self
+
+    def to_dict(self):
+        return {
+            'bucket_seconds': self.bucket_seconds,
+            'buckets': {str(start): bucket.to_dict() for start, bucket in self.buckets.items()},
+            'all_time': self.all_time.to_dict()
+        }
+
+    @classmethod
+    def from_dict(cls, data, retention_buckets=48):
+        store = cls(data['bucket_seconds'], retention_buckets)
+        for start, bucket in sorted(data['buckets'].items(), key=lambda kv: int(kv[0])):
+            store.buckets[int(start)] = ClickstreamSketches.from_dict(bucket)
+        store.all_time = ClickstreamSketches.from_dict(data['all_time'])
+        return store
@@ -0,0 +1,475 @@
+import os
+import sys
+import json
+import mmap
+import time
+import pickle
+import bisect
+import struct
+import argparse
+import threading
+from array import array
+
+SEGMENT_MAGIC = b'CSEG1\n\x00\x00'
+SEGMENT_HEADER = struct.Struct('<8sQ')   # magic, event count
+SNAPSHOT_VERSION = 1
+
+# File names carry the offset of their first event, zero padded so they sort
+SEGMENT_NAME = 'events-{:012d}.seg'
+LOG_NAME = 'events-{:012d}.log'
+SNAPSHOT_NAME = 'snapshot-{:012d}.pkl'
+
+
+def _dumps(event):
+    return json.dumps(event, separators=(',', ':')).encode()
+
+
+class _Pickled:
+    """A value serialized ahead of time; unpickles as the value itself"""
+
+    __slots__ = ('data',)
+
+    def __init__(self, value):
+        self.data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def __reduce__(self):
+        return pickle.loads, (self.data,)
+
+
+def _freeze(state):
+    """Point-in-time version of the aggregate state that ingest may keep changing
+
+    Objects with a frozen() method return a copy (EventIndex reuses the
+    posting blocks it already copied); the rest are small enough to pickle
+    on the spot. The snapshot file pickles the result like the state itself.
+    """
+    if isinstance(state, dict):
+        return {key: _freeze(value) for key, value in state.items()}
+    return state.frozen() if hasattr(state, 'frozen') else _Pickled(state)
+
+
+def _numbered(directory, prefix, suffix):
+    """[(first offset, file name)] for files like prefix-000000000042.suffix, ascending"""
+    files = []
+    for name in os.listdir(directory):
+        if name.startswith(prefix) and name.endswith(suffix):
+            try:
+                files.append((int(name[len(prefix):-len(suffix)]), name))
+            except ValueError:
+                continue
+    return sorted(files)
+
+
+def _replace(path, data):
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+class Segment:
+    """An immutable run of events in one file, memory-mapped rather than read
+
+    Layout: magic and event count, (count + 1) uint64 payload offsets, then
+    one compact JSON document per event. Opening costs one mmap; an event
+    is decoded only when it is accessed, and the OS page cache, not the
+    Python heap, holds the bytes.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count = SEGMENT_HEADER.unpack_from(self._map)
+        if magic != SEGMENT_MAGIC:
+            self._map.close()
+            raise ValueError(f'Not an event segment: {path}')
+        table_end = SEGMENT_HEADER.size + 8 * (self.count + 1)
+        if sys.byteorder == 'little':
+            self._offsets = memoryview(self._map)[SEGMENT_HEADER.size:table_end].cast('Q')
+        else:
+            self._offsets = struct.unpack_from(f'<{self.count + 1}Q', self._map, SEGMENT_HEADER.size)
+        self._base = table_end
+
+    @classmethod
+    def write(cls, path, events):
+        """Write events to a new segment file (atomically) and map it"""
+        tmp = f'{path}.{os.getpid()}.tmp'
+        offsets = array('Q', [0])
+        with open(tmp, 'wb') as f:
+            # Payloads stream out after room for the offset table, filled in last
+            f.seek(SEGMENT_HEADER.size + 8 * (len(events) + 1))
+            position = 0
+            for event in events:
+                position += f.write(_dumps(event))
+                offsets.append(position)
+            if sys.byteorder != 'little':
+                offsets.byteswap()
+            f.seek(0)
+            f.write(SEGMENT_HEADER.pack(SEGMENT_MAGIC, len(events)))
+            f.write(offsets.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+        return cls(path)
+
+    def __len__(self):
+        return self.count
+
+    def raw(self, i):
+        return self._map[self._base + self._offsets[i]:self._base + self._offsets[i + 1]]
+
+    def get(self, i):
+        return json.loads(self.raw(i))
+
+    def nbytes(self):
+        return len(self._map)
+
+    def close(self):
+        if isinstance(self._offsets, memoryview):
+            self._offsets.release()
+        self._map.close()
+
+
+class EventStore:
+    """Append-only event list: mapped segments first, then events not yet snapshotted
+
+    Supports what callers of a plain list use (len, iteration, indexing,
+    slicing, append/extend). Appends go to the in-memory tail under the
+    caller's lock; seal() swaps a written segment in for the tail events it
+    holds, in one assignment, so readers never see a half-swapped store.
+    """
+
+    def __init__(self, segments=(), tail=None):
+        segments = list(segments)
+        starts = []
+        total = 0
+        for segment in segments:
+            starts.append(total)
+            total += len(segment)
+        self._state = (segments, starts, total, list(tail or []))
+
+    def __len__(self):
+        _, _, sealed, tail = self._state
+        return sealed + len(tail)
+
+    def __bool__(self):
+        return len(self) > 0
+
+    def __iter__(self):
+        segments, _, _, tail = self._state
+        for segment in segments:
+            for i in range(len(segment)):
+                yield segment.get(i)
+        yield from list(tail)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return [self._get(i) for i in range(*key.indices(len(self)))]
+        if key < 0:
+            key += len(self)
+        if not 0 <= key < len(self):
+            raise IndexError('event offset out of range')
+        return self._get(key)
+
+    def _get(self, offset):
+        segments, starts, sealed, tail = self._state
+        if offset >= sealed:
+            return tail[offset - sealed]
+        i = bisect.bisect_right(starts, offset) - 1
+        return segments[i].get(offset - starts[i])
+
+    def append(self, event):
+        self._state[3].append(event)
+
+    def extend(self, events):
+        self._state[3].extend(events)
+
+    @property
+    def sealed(self):
+        """Events already in segments"""
+        return self._state[2]
+
+    def iter_json(self):
+        """Each event as compact JSON bytes; segment events are copied without decoding"""
+        segments, _, _, tail = self._state
+        for segment in segments:
+            for i in range(len(segment)):
+                yield segment.raw(i)
+        for event in list(tail):
+            yield _dumps(event)
+
+    def seal(self, segment):
+        """Replace the first len(segment) tail events with the segment holding them"""
+        segments, starts, sealed, tail = self._state
+        self._state = (segments + [segment], starts + [sealed], sealed + len(segment), tail[len(segment):])
+
+    def segments(self):
+        return list(self._state[0])
+
+
+class SnapshotManager:
+    """Periodic snapshots of the event store and aggregate state, plus an event log
+
+    Every ingested batch is appended to an NDJSON log. A snapshot writes
+    the events added since the previous one as a new mapped segment and
+    pickles the aggregate state (counters, sketches, indexes) as of the
+    same event count, then starts a new log file at that count. Recovery
+    maps the segments named by the newest readable snapshot, unpickles
+    its state and replays only the log files written after it, so restart
+    cost follows the log tail and the aggregate state, not all events ever
+    ingested. Logs and snapshots older than the newest `keep` snapshots are
+    deleted once a snapshot is on disk.
+
+    Callers hold `lock` around appending to the store, the log and the
+    aggregates; a snapshot holds it only while copying the state, and
+    pickles the copy after releasing it.
+    """
+
+    def __init__(self, directory, interval_seconds=300, min_events=10000, keep=2, fsync=False):
+        self.directory = directory
+        self.interval_seconds = interval_seconds
+        self.min_events = min_events
+        self.keep = keep
+        self.fsync = fsync
+        self.lock = threading.RLock()
+        self._snapshot_lock = threading.Lock()
+        self._log = None
+        self._log_first = None
+        self._timer = None
+        self._stop = threading.Event()
+        self.stats = {'snapshots': 0, 'last_snapshot_events': 0, 'last_snapshot_seconds': None,
+                      'logged_events': 0, 'replayed_events': 0, 'torn_lines': 0, 'recovery_seconds': None}
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def latest_snapshot(self):
+        """(snapshot dict or None, segments) from the newest snapshot that loads"""
+        for _, name in reversed(_numbered(self.directory, 'snapshot-', '.pkl')):
+            try:
+                with open(self._path(name), 'rb') as f:
+                    snapshot = pickle.load(f)
+                if snapshot.get('version') != SNAPSHOT_VERSION:
+                    continue
+                segments = [Segment(self._path(segment)) for segment in snapshot['segments']]
+            except (OSError, ValueError, EOFError, pickle.UnpicklingError) as e:
+                print(f"⚠️  Skipping snapshot {name}: {e}")
+                continue
+            return snapshot, segments
+        return None, []
+
+    def recover(self):
+        """(store, aggregate state or None, generator of replayed log batches)
+
+        Consume the generator before appending; it opens a fresh log file
+        when it finishes.
+        """
+        started = time.perf_counter()
+        snapshot, segments = self.latest_snapshot()
+        store = EventStore(segments)
+        state = pickle.loads(snapshot['state']) if snapshot else None
+
+        def replay(batch_size=1000):
+            for first, name in _numbered(self.directory, 'events-', '.log'):
+                if first != len(store):
+                    # Already in the snapshot's segments
+                    continue
+                batch = []
+                for event in self._read_log(name):
+                    batch.append(event)
+                    if len(batch) >= batch_size:
+                        self.stats['replayed_events'] += len(batch)
+                        yield batch
+                        batch = []
+                if batch:
+                    self.stats['replayed_events'] += len(batch)
+                    yield batch
+            with self.lock:
+                self._open_log(len(store))
+            self.stats['recovery_seconds'] = round(time.perf_counter() - started, 3)
+
+        return store, state, replay()
+
+    def _read_log(self, name):
+        with open(self._path(name), 'rb') as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    # A write cut short by a crash
+                    self.stats['torn_lines'] += 1
+
+    def iter_events(self):
+        """Every stored event, read-only: the newest snapshot's segments, then the logs after it"""
+        _, segments = self.latest_snapshot()
+        count = 0
+        for segment in segments:
+            for i in range(len(segment)):
+                yield segment.get(i)
+            count += len(segment)
+        for first, name in _numbered(self.directory, 'events-', '.log'):
+            if first != count:
+                continue
+            for event in self._read_log(name):
+                count += 1
+                yield event
+
+    def _open_log(self, first):
+        if self._log is not None:
+            self._log.close()
+        self._log_first = first
+        self._log = open(self._path(LOG_NAME.format(first)), 'ab')
+
+    def append(self, events):
+        """Log a batch (caller holds `lock`); flush() makes it durable. No-op before recover()"""
+        if self._log is None:
+            return
+        self._log.write(b''.join(_dumps(event) + b'\n' for event in events))
+        self.stats['logged_events'] += len(events)
+
+    def flush(self):
+        with self.lock:
+            if self._log is not None:
+                self._log.flush()
+                if self.fsync:
+                    os.fsync(self._log.fileno())
+
+    def snapshot(self, store, get_state, force=False):
+        """Write a snapshot if enough events arrived since the last one; returns its event count"""
+        with self._snapshot_lock:
+            started = time.perf_counter()
+            with self.lock:
+                count = len(store)
+                sealed = store.sealed
+                if count == sealed or (count - sealed < self.min_events and not force):
+                    return None
+                state = _freeze(get_state())
+                self.flush()
+                self._open_log(count)
+            state = pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL)
+            # Events below `count` are only appended to, never changed, so
+            # the segment is written without holding up ingest
+            segment = Segment.write(self._path(SEGMENT_NAME.format(sealed)), store[sealed:count])
+            names = [os.path.basename(existing.path) for existing in store.segments()]
+            names.append(os.path.basename(segment.path))
+            _replace(self._path(SNAPSHOT_NAME.format(count)), pickle.dumps({
+                'version': SNAPSHOT_VERSION,
+                'events': count,
+                'segments': names,
+                'created': time.time(),
+                'state': state
+            }, protocol=pickle.HIGHEST_PROTOCOL))
+            with self.lock:
+                store.seal(segment)
+            self._prune()
+            self.stats['snapshots'] += 1
+            self.stats['last_snapshot_events'] = count
+            self.stats['last_snapshot_seconds'] = round(time.perf_counter() - started, 3)
+            return count
+
+    def _prune(self):
+        snapshots = _numbered(self.directory, 'snapshot-', '.pkl')
+        kept = snapshots[-self.keep:]
+        for _, name in snapshots[:-self.keep]:
+            os.remove(self._path(name))
+        # Logs are needed from the oldest kept snapshot on, in case the newest will not load
+        oldest = kept[0][0] if kept else 0
+        for first, name in _numbered(self.directory, 'events-', '.log'):
+            if first < oldest:
+                os.remove(self._path(name))
+
+    def start(self, store, get_state):
+        """Background snapshots every interval_seconds"""
+        if self._timer is not None:
+            return
+        self._stop.clear()
+
+        def run():
+            while not self._stop.wait(self.interval_seconds):
+                try:
+                    self.snapshot(store, get_state)
+                except Exception as e:
+                    print(f"❌ Snapshot failed: {e}")
+
+        self._timer = threading.Thread(target=run, name='snapshots', daemon=True)
+        self._timer.start()
+
+    def stop(self):
+        if self._timer is not None:
+            self._stop.set()
+            self._timer.join()
+            self._timer = None
+
+    def summary(self):
+        summary = dict(self.stats)
+        summary['directory'] = self.directory
+        summary['log_from_event'] = self._log_first
+        return summary
+
+
+def is_snapshot_dir(path):
+    return os.path.isdir(path) and any(
+        name.startswith('snapshot-') or name.endswith('.seg') for name in os.listdir(path)
+    )
+
+
+def create_snapshot_manager(directory=None, **kw):
+    return SnapshotManager(directory or os.environ.get('SNAPSHOT_DIR', os.path.join('data', 'state')), **kw)
+
+
+def benchmark(directory, events, batch_size=1000, tail=10000):
+    """Ingest `events` sample events with a snapshot before the last `tail`, then time recovery"""
+    from wire import sample_events
+    from event_index import EventIndex
+
+    manager = SnapshotManager(directory, min_events=1)
+    store, _, replay = manager.recover()
+    for _ in replay:
+        pass
+    index = EventIndex()
+    while len(store) < events:
+        batch = sample_events(min(batch_size, events - len(store)))
+        with manager.lock:
+            index.add_many(len(store), batch)
+            store.extend(batch)
+            manager.append(batch)
+        if not store.sealed and len(store) >= events - tail:
+            manager.snapshot(store, lambda: {'index': index}, force=True)
+    manager.flush()
+
+    started = time.perf_counter()
+    recovered = SnapshotManager(directory)
+    store, state, replay = recovered.recover()
+    index = state['index'] if state else EventIndex()
+    for batch in replay:
+        index.add_many(len(store), batch)
+        store.extend(batch)
+    return len(store), recovered.stats['replayed_events'], time.perf_counter() - started
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local API snapshots and event log')
+    parser.add_argument('--dir', default=os.environ.get('SNAPSHOT_DIR', os.path.join('data', 'state')),
+                        help='Snapshot directory')
+    parser.add_argument('--benchmark', type=int, metavar='EVENTS', help='Write EVENTS sample events, then time recovery')
+    parser.add_argument('--tail', type=int, default=10000, help='Events logged after the benchmark snapshot')
+    args = parser.parse_args()
+
+    if args.benchmark:
+        total, replayed, seconds = benchmark(args.dir, args.benchmark, tail=args.tail)
+        print(f"⚡ Recovered {total:,} events ({replayed:,} replayed from the log) in {seconds:.2f}s")
+    else:
+        manager = SnapshotManager(args.dir)
+        snapshot, segments = manager.latest_snapshot()
+        logs = _numbered(args.dir, 'events-', '.log')
+        if snapshot:
+            print(f"📸 Snapshot at {snapshot['events']:,} events, {len(segments)} segments, "
+                  f"{sum(segment.nbytes() for segment in segments) / 1e6:.1f} MB mapped")
+        else:
+            print("📭 No snapshot yet")
+        for first, name in logs:
+            print(f"📜 {name}: {os.path.getsize(os.path.join(args.dir, name)) / 1e6:.1f} MB from event {first:,}")
@@ -0,0 +1,187 @@
+import os
+import re
+import json
+import threading
+from datetime import datetime, timezone
+
+MANIFEST_PREFIX = '_watermarks/'
+PARTITION_PATTERN = re.compile(r'year=(\d{4})/month=(\d{1,2})(?:/day=(\d{1,2}))?(?:/hour=(\d{1,2}))?')
+
+# record_partition is a read-modify-write of one object; writer threads in a process take turns
+_write_lock = threading.Lock()
+
+
+def partition_start(partition):
+    """Start time of a 'year=YYYY/month=MM/day=DD/hour=HH' partition (UTC)"""
+    match = PARTITION_PATTERN.search(partition)
+    if not match:
+        raise ValueError(f'Not a partition path: {partition}')
+    year, month, day, hour = match.groups()
+    return datetime(int(year), int(month), int(day or 1), int(hour or 0), tzinfo=timezone.utc)
+
+
+def partition_path(dt, granularity='hour'):
+    """Partition path for a datetime, matching the Firehose/Glue layout"""
+    path = f'year={dt:%Y}/month={dt:%m}/day={dt:%d}'
+    if granularity == 'hour':
+        path += f'/hour={dt:%H}'
+    return path
+
+
+def _parse_time(value):
+    if not value:
+        return None
+    dt = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    return dt if dt.tzinfo else dt.replace(tzinfo=timezone.utc)
+
+
+class LocalManifestStore:
+    """Manifest objects as files under a local directory standing in for a bucket"""
+
+    def __init__(self, root):
+        self.root = root
+
+    def get(self, key):
+        path = os.path.join(self.root, key)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r') as f:
+            return json.load(f)
+
+    def put(self, key, manifest):
+        path = os.path.join(self.root, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, path)
+
+
+class S3ManifestStore:
+    """Manifest objects in S3; one GetObject per read"""
+
+    def __init__(self, s3, bucket):
+        self.s3 = s3
+        self.bucket = bucket
+
+    def get(self, key):
+        try:
+            response = self.s3.get_object(Bucket=self.bucket, Key=key)
+        except self.s3.exceptions.NoSuchKey:
+            return None
+        return json.loads(response['Body'].read())
+
+    def put(self, key, manifest):
+        self.s3.put_object(Bucket=self.bucket, Key=key, Body=json.dumps(manifest).encode('utf-8'),
+                           ContentType='application/json')
+
+
+class WatermarkManifest:
+    """Latest completed partition, max event time and per-partition row counts for one table
+
+    Writers call record_partition() after a partition is delivered or
+    rewritten (record_partitions() for a whole run at once); readers get freshness and counts from a single small object
+    instead of listing the bucket or scanning the table. Each table has its
+    own manifest key, so each should have a single writer process.
+
+    Maintenance rewrites (compaction) pass maintenance=True so they update
+    counts without moving updated_at: freshness reports when new data
+    last arrived, not when old partitions were last touched.
+    """
+
+    def __init__(self, store, table, retention_partitions=24 * 90):
+        self.store = store
+        self.table = table.strip('/')
+        self.key = f'{MANIFEST_PREFIX}{self.table}.json'
+        self.retention_partitions = retention_partitions
+
+    def load(self, empty=False):
+        return (None if empty else self.store.get(self.key)) or {
+            'table': self.table,
+            'latest_partition': None,
+            'max_event_time': None,
+            'updated_at': None,
+            'total_rows': 0,
+            'partitions': {}
+        }
+
+    def record_partition(self, partition, rows, max_event_time=None, bytes_written=None, replace=False,
+                         maintenance=False):
+        """Add rows to a partition (or set them, when replace=True after a rewrite)"""
+        with _write_lock:
+            manifest = self.load()
+            self._apply(manifest, partition, rows, max_event_time, bytes_written, replace, maintenance)
+            self.store.put(self.key, manifest)
+            return manifest
+
+    def record_partitions(self, entries, rebuild=False):
+        """Set many (partition, rows, max_event_time, bytes_written) entries with one read and one write
+
+        Writers that rewrite the whole table each run (the Glue ETL job)
+        pass rebuild=True so partitions they no longer wrote drop out.
+        """
+        with _write_lock:
+            manifest = self.load(empty=rebuild)
+            for partition, rows, max_event_time, bytes_written in entries:
+                self._apply(manifest, partition, rows, max_event_time, bytes_written, True, False)
+            self.store.put(self.key, manifest)
+            return manifest
+
+    def _apply(self, manifest, partition, rows, max_event_time, bytes_written, replace, maintenance):
+        now = datetime.now(timezone.utc).isoformat()
+        entry = manifest['partitions'].get(partition, {'rows': 0, 'bytes': 0, 'max_event_time': None})
+
+        previous_rows = entry['rows']
+        entry['rows'] = rows if replace else previous_rows + rows
+        if bytes_written is not None:
+            entry['bytes'] = bytes_written if replace else entry.get('bytes', 0) + bytes_written
+        if max_event_time and (entry['max_event_time'] is None or max_event_time > entry['max_event_time']):
+            entry['max_event_time'] = max_event_time
+        if not maintenance:
+            entry['completed_at'] = now
+        manifest['partitions'][partition] = entry
+        manifest['total_rows'] += entry['rows'] - previous_rows
+
+        if manifest['latest_partition'] is None or partition_start(partition) >= partition_start(manifest['latest_partition']):
+            manifest['latest_partition'] = partition
+        if max_event_time and (manifest['max_event_time'] is None or max_event_time > manifest['max_event_time']):
+            manifest['max_event_time'] = max_event_time
+        if not maintenance:
+            manifest['updated_at'] = now
+
+        if len(manifest['partitions']) > self.retention_partitions:
+            # Expired partitions leave the per-partition map but stay in total_rows
+            ordered = sorted(manifest['partitions'], key=partition_start)
+            for old in ordered[:len(ordered) - self.retention_partitions]:
+                del manifest['partitions'][old]
+
+    def freshness(self, now=None):
+        """Age of the last write and of the newest event, in minutes"""
+        manifest = self.store.get(self.key)
+        if manifest is None:
+            return None
+        now = now or datetime.now(timezone.utc)
+        updated_at = _parse_time(manifest.get('updated_at'))
+        max_event_time = _parse_time(manifest.get('max_event_time'))
+        # A manifest only maintenance has written has no arrival time; age it by its newest event
+        written_at = updated_at or max_event_time
+        return {
+            'latest_partition': manifest.get('latest_partition'),
+            'age_minutes': (now - written_at).total_seconds() / 60 if written_at else None,
+            'event_lag_minutes': (now - max_event_time).total_seconds() / 60 if max_event_time else None
+        }
+
+    def row_counts(self, now=None, windows_hours=(1, 24)):
+        """Total rows plus rows in partitions starting within each trailing window"""
+        manifest = self.store.get(self.key)
+        if manifest is None:
+            return None
+        now = now or datetime.now(timezone.utc)
+        counts = {'total_rows': manifest.get('total_rows', 0)}
+        starts = [(partition_start(p), entry['rows']) for p, entry in manifest['partitions'].items()]
+        for hours in windows_hours:
+            # Include the partition that contains the window start
+            cutoff = now.timestamp() - hours * 3600
+            cutoff -= cutoff % 3600
+            counts[f'rows_last_{hours}h'] = sum(rows for start, rows in starts if start.timestamp() >= cutoff)
+        return counts
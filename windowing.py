@@ -0,0 +1,270 @@
+import os
+import json
+import argparse
+from datetime import datetime, timezone
+
+from event_sources import event_time, iter_replay_file
+
+
+class ClickstreamAggregate:
+    """Partial state per pane: event counts by type, revenue and cart adds"""
+
+    def create(self):
+        return {'count': 0, 'events_by_type': {}, 'revenue': 0.0, 'cart_adds': 0}
+
+    def add(self, state, event):
+        state['count'] += 1
+        event_type = event.get('event_type', 'unknown')
+        by_type = state['events_by_type']
+        by_type[event_type] = by_type.get(event_type, 0) + 1
+        if event_type == 'purchase':
+            state['revenue'] += float((event.get('properties') or {}).get('total_amount') or 0)
+        elif event_type == 'add_to_cart':
+            state['cart_adds'] += 1
+
+    def merge(self, into, state):
+        into['count'] += state['count']
+        by_type = into['events_by_type']
+        for event_type, count in state['events_by_type'].items():
+            by_type[event_type] = by_type.get(event_type, 0) + count
+        into['revenue'] += state['revenue']
+        into['cart_adds'] += state['cart_adds']
+
+    def result(self, state):
+        result = dict(state)
+        result['revenue'] = round(state['revenue'], 2)
+        return result
+
+
+class InMemorySink:
+    """Collects window results in a list"""
+
+    def __init__(self):
+        self.results = []
+
+    def emit(self, result):
+        self.results.append(result)
+
+    def close(self):
+        pass
+
+
+class NdjsonFileSink:
+    """Appends window results as NDJSON, one file per UTC hour of window start"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._files = {}
+
+    def emit(self, result):
+        hour = result['window_start'][:13].replace('-', '').replace('T', '_')
+        f = self._files.get(hour)
+        if f is None:
+            f = self._files[hour] = open(os.path.join(self.directory, f'windows_{hour}.ndjson'), 'a')
+        f.write(json.dumps(result) + '\n')
+
+    def close(self):
+        for f in self._files.values():
+            f.close()
+        self._files = {}
+
+
+class CloudWatchMetricsSink:
+    """Turns window results into CloudWatch metric data, sent 20 at a time"""
+
+    def __init__(self, cloudwatch=None, namespace='ClickstreamPipeline/Windows'):
+        self.cloudwatch = cloudwatch
+        self.namespace = namespace
+        self.pending = []
+
+    def emit(self, result):
+        timestamp = datetime.fromisoformat(result['window_start'])
+        dimensions = [{'Name': 'WindowSeconds', 'Value': str(result['window_seconds'])}]
+        if result['key'] != 'all':
+            dimensions.append({'Name': 'Key', 'Value': str(result['key'])})
+
+        self.pending.append({'MetricName': 'Events', 'Value': result['count'], 'Unit': 'Count',
+                             'Timestamp': timestamp, 'Dimensions': dimensions})
+        self.pending.append({'MetricName': 'Revenue', 'Value': result['revenue'], 'Unit': 'None',
+                             'Timestamp': timestamp, 'Dimensions': dimensions})
+        if len(self.pending) >= 20:
+            self.flush()
+
+    def flush(self):
+        batch_size = 20
+        while self.pending:
+            batch, self.pending = self.pending[:batch_size], self.pending[batch_size:]
+            if self.cloudwatch is not None:
+                self.cloudwatch.put_metric_data(Namespace=self.namespace, MetricData=batch)
+
+    def close(self):
+        self.flush()
+
+
+class WindowedAggregator:
+    """Tumbling or sliding event-time windows with allowed lateness
+
+    Events are pre-aggregated into panes of `slide_seconds` (the window size
+    for tumbling windows), so each event touches exactly one partial state no
+    matter how many sliding windows overlap it; a window result merges its
+    panes when it fires. The watermark trails the highest event-time by
+    `max_out_of_orderness`. Windows fire once the watermark passes their end,
+    late events inside `allowed_lateness` re-emit the affected windows with
+    `is_update` set, and anything later is dropped and counted.
+    """
+
+    def __init__(self, window_seconds=60, slide_seconds=None, key_by=None, aggregate=None, sink=None,
+                 max_out_of_orderness=5, allowed_lateness=60, on_late_event=None):
+        self.size = window_seconds
+        self.slide = slide_seconds or window_seconds
+        if self.size % self.slide:
+            raise ValueError('window_seconds must be a multiple of slide_seconds')
+        if isinstance(key_by, str):
+            field = key_by
+            self.key_fn = lambda event: event.get(field, 'unknown')
+        else:
+            self.key_fn = key_by
+        self.aggregate = aggregate or ClickstreamAggregate()
+        self.sink = sink or InMemorySink()
+        self.max_out_of_orderness = max_out_of_orderness
+        self.allowed_lateness = allowed_lateness
+        self.on_late_event = on_late_event
+
+        self.panes = {}          # pane start -> {key: partial state}
+        self.next_end = None     # End of the next window to fire
+        self.max_event_time = None
+        self.watermark = float('-inf')
+        self.stats = {'events': 0, 'late_events': 0, 'dropped_events': 0,
+                      'invalid_events': 0, 'windows_emitted': 0, 'window_updates': 0}
+
+    def process(self, event, ts=None):
+        if ts is None:
+            ts = event_time(event)
+            if ts is None:
+                self.stats['invalid_events'] += 1
+                return
+        self.stats['events'] += 1
+
+        slide = self.slide
+        pane_start = int(ts // slide * slide)
+
+        if ts < self.watermark:
+            self.stats['late_events'] += 1
+            if pane_start + self.size + self.allowed_lateness <= self.watermark:
+                self.stats['dropped_events'] += 1
+                if self.on_late_event:
+                    self.on_late_event(event)
+                return
+
+        key = self.key_fn(event) if self.key_fn else 'all'
+        pane = self.panes.get(pane_start)
+        if pane is None:
+            pane = self.panes[pane_start] = {}
+        state = pane.get(key)
+        if state is None:
+            state = pane[key] = self.aggregate.create()
+        self.aggregate.add(state, event)
+
+        if self.next_end is None:
+            self.next_end = pane_start + slide
+        elif self.next_end > pane_start + slide:
+            # Late but allowed: refresh the windows over this pane that already fired
+            end = pane_start + slide
+            last = pane_start + self.size
+            while end <= last:
+                if end < self.next_end and end + self.allowed_lateness > self.watermark:
+                    self._fire(end, key, is_update=True)
+                end += slide
+
+        if self.max_event_time is None or ts > self.max_event_time:
+            self.max_event_time = ts
+            watermark = ts - self.max_out_of_orderness
+            if watermark > self.watermark:
+                self.advance_watermark(watermark)
+
+    def advance_watermark(self, watermark):
+        """Fire every window ending at or before the watermark and drop expired panes"""
+        self.watermark = watermark
+        if self.next_end is None:
+            return
+
+        slide = self.slide
+        while self.next_end <= watermark and self.panes:
+            if self.next_end - self.size > max(self.panes):
+                # No remaining pane can fall in this or any later window yet
+                self.next_end = int(watermark // slide * slide) + slide
+                break
+            first_pane = min(self.panes)
+            if self.next_end <= first_pane:
+                # Skip idle stretches without visiting every empty window
+                self.next_end = first_pane + slide
+                continue
+            self._fire(self.next_end)
+            self.next_end += slide
+
+        horizon = watermark - self.size - self.allowed_lateness
+        for start in [s for s in self.panes if s <= horizon]:
+            del self.panes[start]
+
+    def _fire(self, window_end, only_key=None, is_update=False):
+        window_start = window_end - self.size
+        merged = {}
+        aggregate = self.aggregate
+        start = window_start
+        while start < window_end:
+            pane = self.panes.get(start)
+            if pane:
+                for key, state in pane.items():
+                    if only_key is not None and key != only_key:
+                        continue
+                    into = merged.get(key)
+                    if into is None:
+                        into = merged[key] = aggregate.create()
+                    aggregate.merge(into, state)
+            start += self.slide
+
+        for key, state in merged.items():
+            result = aggregate.result(state)
+            result.update({
+                'window_start': datetime.fromtimestamp(window_start, timezone.utc).isoformat(),
+                'window_end': datetime.fromtimestamp(window_end, timezone.utc).isoformat(),
+                'window_seconds': self.size,
+                'key': key,
+                'is_update': is_update
+            })
+            self.sink.emit(result)
+            self.stats['window_updates' if is_update else 'windows_emitted'] += 1
+
+    def flush(self):
+        """Fire all remaining windows, e.g. at the end of a replay"""
+        if self.panes:
+            self.advance_watermark(max(self.panes) + self.size)
+        self.sink.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Windowed aggregation over clickstream events')
+    parser.add_argument('--replay', required=True, help='Replay file or directory of events')
+    parser.add_argument('--window', type=int, default=60, help='Window size in seconds')
+    parser.add_argument('--slide', type=int, help='Slide in seconds (omit for tumbling windows)')
+    parser.add_argument('--key-by', help='Event field to group by, e.g. event_type')
+    parser.add_argument('--lateness', type=int, default=60, help='Allowed lateness in seconds')
+    parser.add_argument('--output-dir', help='Write NDJSON window results to this directory')
+
+    args = parser.parse_args()
+
+    sink = NdjsonFileSink(args.output_dir) if args.output_dir else InMemorySink()
+    aggregator = WindowedAggregator(args.window, args.slide, key_by=args.key_by, sink=sink,
+                                    allowed_lateness=args.lateness)
+    for event in iter_replay_file(args.replay):
+        aggregator.process(event)
+    aggregator.flush()
+
+    if isinstance(sink, InMemorySink):
+        for result in sink.results:
+            print(f"🪟 {result['window_start']} [{result['key']}] "
+                  f"{result['count']} events, ${result['revenue']:.2f}")
+    else:
+        print(f"💾 Window results written to {args.output_dir}")
+    print(f"📊 {aggregator.stats}")